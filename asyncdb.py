@@ -0,0 +1,173 @@
+#!/usr/local/bin/python3
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database import database
+
+# class: an asyncio front end for a database
+#  - every call runs on a bounded pool of threads so the event loop never blocks
+#    on file io, the db is opened threadsafe so the threads can share it
+#  - identical lookups that are in flight at the same time share one read
+#  - addrow calls that arrive together are added as one batch with one flush
+# db: the database being wrapped
+# executor: the pool the db calls run on
+# inflight: a dict of (epoch, call, args) -> future of a lookup that is running
+# epoch: bumped by every change, a lookup started before a change is never shared
+#  with one asked for after it
+# pending: a list of (data, future) for addrow calls waiting for the next batch
+# batcher: the task adding batches while there are pending rows, None if idle
+# batchdelay: seconds to wait for more rows before adding a batch
+class asyncdatabase:
+    def __init__(self, maxworkers=4, batchdelay=0.0):
+        self.__db = database()
+        self.__executor = ThreadPoolExecutor(maxworkers)
+        self.__inflight = dict()
+        self.__epoch = 0
+        self.__pending = list()
+        self.__batcher = None
+        self.__batchdelay = batchdelay
+
+    # function: open a db file, takes the same arguments as database.open
+    #  - the db is always opened threadsafe
+    # return: 0 on sucess, 1 on fail, 2 on parse failure
+    async def open(self, filename, **kwargs) -> int:
+        kwargs["threadsafe"] = True
+        return await self.__run(self.__db.open, filename, **kwargs)
+
+    # function: add any pending rows, then close the db and the thread pool
+    async def close(self) -> int:
+        await self.__drain()
+        r = await self.__run(self.__db.close)
+        self.__executor.shutdown()
+        return r
+
+    # function: get the wrapped database (for calls that do not need to be async)
+    def getdb(self) -> database:
+        return self.__db
+
+    async def findkey(self, key):
+        return await self.__coalesce("findkey", key)
+
+    async def findval(self, field, val) -> dict:
+        return await self.__coalesce("findval", field, val)
+
+    async def findrange(self, field, lo, hi) -> dict:
+        return await self.__coalesce("findrange", field, lo, hi)
+
+    async def findall(self) -> dict:
+        return await self.__coalesce("findall")
+
+    async def aggregate(self, op, field=None, groupby=None, where=None):
+        return await self.__coalesce("aggregate", op, field, groupby, where)
+
+    # function: add a row
+    #  - rows added by calls waiting at the same time go in together, then the
+    #    db is flushed once for the whole batch
+    # return: 0 on sucess, 1 on fail
+    async def addrow(self, data) -> int:
+        f = asyncio.get_running_loop().create_future()
+        self.__pending.append((data, f))
+        if self.__batcher == None:
+            self.__batcher = asyncio.ensure_future(self.__runbatches())
+        return await f
+
+    async def removerow(self, key) -> int:
+        self.__epoch += 1
+        return await self.__run(self.__db.removerow, key)
+
+    async def update(self, key, field, val) -> int:
+        self.__epoch += 1
+        return await self.__run(self.__db.update, key, field, val)
+
+    # function: add any pending rows and write the cache to file
+    # return: 0 on sucess, 1 on fail
+    async def flush(self) -> int:
+        await self.__drain()
+        self.__epoch += 1
+        return await self.__run(self.__db.flush)
+
+    async def compact(self) -> int:
+        await self.__drain()
+        self.__epoch += 1
+        return await self.__run(self.__db.compact)
+
+    # function: iterate over every live row without blocking the loop
+    #  - rows are pulled from database.iterall on the thread pool, chunksize at a time
+    # return: an async generator of Row objects
+    async def iterall(self, chunksize=1000):
+        async for row in self.__iterate(self.__db.iterall(), chunksize):
+            yield row
+
+    # function: iterate over the rows with val in field without blocking the loop
+    # return: an async generator of Row objects
+    async def iterval(self, field, val, chunksize=1000):
+        async for row in self.__iterate(self.__db.iterval(field, val), chunksize):
+            yield row
+
+    # function: run a db call on the thread pool
+    async def __run(self, f, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, functools.partial(f, *args, **kwargs))
+
+    # function: run a lookup, or wait on the same lookup if it is already running
+    #  - dicts are copied for each caller so no two callers share a result
+    async def __coalesce(self, name, *args):
+        k = (self.__epoch, name, args)
+        f = self.__inflight.get(k)
+        if f == None:
+            f = asyncio.ensure_future(self.__run(getattr(self.__db, name), *args))
+            self.__inflight[k] = f
+            f.add_done_callback(lambda x: self.__inflight.pop(k, None))
+
+        # one caller giving up must not cancel the read for the others
+        r = await asyncio.shield(f)
+        if type(r) == dict:
+            return dict(r)
+        return r
+
+    async def __iterate(self, it, chunksize):
+        take = lambda: [row for i, row in zip(range(chunksize), it)]
+        while True:
+            rows = await self.__run(take)
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield row
+
+    # function: add batches of pending rows until there are none left
+    async def __runbatches(self):
+        try:
+            while len(self.__pending) > 0:
+                # let the other callers that are ready add their rows first
+                await asyncio.sleep(self.__batchdelay)
+                batch = self.__pending
+                self.__pending = list()
+                self.__epoch += 1
+                try:
+                    rs = await self.__run(self.__addbatch, [data for data, f in batch])
+                except Exception as e:
+                    for data, f in batch:
+                        if not f.done():
+                            f.set_exception(e)
+                    continue
+                for (data, f), r in zip(batch, rs):
+                    if not f.done():
+                        f.set_result(r)
+        finally:
+            self.__batcher = None
+
+    # function: add a batch of rows and flush them with one write (on the thread pool)
+    # return: a list of the addrow results
+    def __addbatch(self, rows) -> list:
+        with self.__db.getlock().writing():
+            rs = [self.__db.addrow(data) for data in rows]
+            if 0 in rs:
+                self.__db.flush()
+        return rs
+
+    # function: wait for the pending rows to be added
+    async def __drain(self):
+        while self.__batcher != None:
+            await asyncio.shield(self.__batcher)
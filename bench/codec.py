@@ -0,0 +1,146 @@
+#!/usr/local/bin/python3
+
+# benchmark: rows per second through the row codec of each file format
+#  - encodes and decodes a batch of rows with the format's encoderow/decoderow,
+#    then times a full findall (every row decoded from file, read cache off)
+#  - the old per-field encoder and decoder are kept below as a reference, their
+#    rows/sec are the "before" columns
+#  - usage: python3 bench/codec.py [rows]
+
+import os
+import sys
+import time
+import struct
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+from fileformat import FORMATS, binaryformat
+
+SCHEMAS = {
+    "mixed": (db.Schema(3, ["name", "qty", "price"], [str, int, float]),
+              lambda i: ("n{}".format(i % 100), i, i * 0.5)),
+    "numeric": (db.Schema(4, ["a", "b", "c", "d"], [int, int, float, float]),
+                lambda i: (i, -i, i * 0.5, i * 0.25)),
+}
+
+# function: serialize a row one field at a time, the way the formats did before
+#  the codecs were compiled per schema
+# return: the raw record, None on fail
+def oldencode(fmt, schema, key, data) -> bytes:
+    if fmt.name == "text":
+        s = str(key)
+        i = 0
+        while i < schema.numfields:
+            s += "," + str(data[i])
+            i += 1
+        return (s + "\n").encode()
+
+    p = [binaryformat.KEY.pack(key)]
+    try:
+        for i in range(schema.numfields):
+            ft = schema.fieldtypes[i]
+            if ft == int:
+                p.append(binaryformat.INT.pack(data[i]))
+            elif ft == float:
+                p.append(binaryformat.FLOAT.pack(data[i]))
+            else:
+                b = str(data[i]).encode()
+                p.append(binaryformat.LENGTH.pack(len(b)))
+                p.append(b)
+    except struct.error:
+        return None
+    b = b"".join(p)
+    return binaryformat.LENGTH.pack(len(b)) + b
+
+# function: parse a raw record one field at a time, the reference for decoderow
+# return: (key, data) on sucess, None on fail
+def olddecode(fmt, schema, rec):
+    if fmt.name == "text":
+        ss = rec.decode().replace("\n", "").split(",")
+        if len(ss) != schema.numfields + 1:
+            return None
+        try:
+            k = int(ss[0])
+        except ValueError:
+            return None
+        d = []
+        i = 0
+        while i < schema.numfields:
+            x = ss[i + 1]
+            ft = schema.fieldtypes[i]
+            if ft == int or ft == float:
+                try:
+                    d.append(ft(x))
+                except ValueError:
+                    return None
+            else:
+                d.append(x)
+            i += 1
+        return (k, d)
+
+    try:
+        k = binaryformat.KEY.unpack_from(rec, binaryformat.LENGTH.size)[0]
+        pos = binaryformat.LENGTH.size + binaryformat.KEY.size
+        d = []
+        for ft in schema.fieldtypes:
+            if ft == int:
+                d.append(binaryformat.INT.unpack_from(rec, pos)[0])
+                pos += binaryformat.INT.size
+            elif ft == float:
+                d.append(binaryformat.FLOAT.unpack_from(rec, pos)[0])
+                pos += binaryformat.FLOAT.size
+            else:
+                n = binaryformat.LENGTH.unpack_from(rec, pos)[0]
+                pos += binaryformat.LENGTH.size
+                d.append(rec[pos:pos + n].decode())
+                pos += n
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return (k, d)
+
+# function: time a function called once per item
+# return: items per second
+def rate(f, items) -> float:
+    start = time.perf_counter()
+    for x in items:
+        f(*x)
+    return len(items) / (time.perf_counter() - start)
+
+def main():
+    numrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print("{:8} {:8} {:>12} {:>12} {:>12} {:>12} {:>12}".format("format", "schema", "old enc/s", "encode/s",
+                                                               "old dec/s", "decode/s", "findall/s"))
+    for formatname, fmtclass in FORMATS.items():
+        for schemaname, (schema, makerow) in SCHEMAS.items():
+            fmt = fmtclass()
+            rows = [(k, makerow(k)) for k in range(1, numrows + 1)]
+            oldenc = rate(lambda k, d: oldencode(fmt, schema, k, d), rows)
+            enc = rate(lambda k, d: fmt.encoderow(schema, k, d), rows)
+            recs = [(fmt.encoderow(schema, k, d),) for k, d in rows]
+            olddec = rate(lambda rec: olddecode(fmt, schema, rec), recs)
+            dec = rate(lambda rec: fmt.decoderow(schema, rec), recs)
+
+            # the reference has to agree with the codec
+            for (k, d), (rec,) in zip(rows[:100], recs[:100]):
+                assert oldencode(fmt, schema, k, d) == rec
+                assert olddecode(fmt, schema, rec) == fmt.decoderow(schema, rec)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                fn = os.path.join(tmp, "bench.db")
+                d = db.createdb(fn, schema, formatname)
+                d.addrows([data for k, data in rows])
+                d.close()
+                d = db.database()
+                d.open(fn, cacherows=0)
+                start = time.perf_counter()
+                n = len(d.findall())
+                scan = n / (time.perf_counter() - start)
+                d.close()
+
+            print("{:8} {:8} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(formatname, schemaname, oldenc, enc,
+                                                                                   olddec, dec, scan))
+
+if __name__ == "__main__":
+    main()
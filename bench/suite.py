@@ -0,0 +1,183 @@
+#!/usr/local/bin/python3
+
+# benchmark suite: latency and throughput of the main database calls
+#  - builds a synthetic db for each schema and format, then times open, findkey
+#    (hit and miss), findval (scan and hash indexed), findall, addrow + flush and
+#    removerow against it
+#  - prints a table and writes the results as json, pass an earlier results file
+#    with --compare to see what got faster or slower
+#  - usage: python3 bench/suite.py [--rows N] [--schemas inventory,mixed]
+#           [--formats binary,text] [--poolbytes N] [--out results.json]
+#           [--compare old.json]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+LOCATIONS = ["shelf-{:02d}".format(i) for i in range(50)]
+
+# name -> (schema, function making the data of row i from a random.Random, field
+# and value findval looks for)
+SCHEMAS = {
+    "inventory": (db.Schema(4, ["name", "serial", "location", "comment"], [str, str, str, str]),
+                  lambda i, rng: ("part-{}".format(rng.randrange(5000)), "SN{:08d}".format(i),
+                                  rng.choice(LOCATIONS), "x" * rng.randrange(0, 40)),
+                  ("location", "shelf-07")),
+    "mixed": (db.Schema(3, ["name", "qty", "price"], [str, int, float]),
+              lambda i, rng: ("n{}".format(i % 100), rng.randrange(1000), rng.random() * 100),
+              ("name", "n7")),
+    "numeric": (db.Schema(4, ["a", "b", "c", "d"], [int, int, float, float]),
+                lambda i, rng: (i % 100, rng.randrange(1 << 30), rng.random(), i * 0.5),
+                ("a", 7)),
+}
+
+# results more than this much slower than the compared run are flagged
+THRESHOLD = 0.10
+
+# function: build a db file with numrows synthetic rows
+# return: the name of the file
+def makedb(dir, schemaname, formatname, numrows, seed) -> str:
+    schema, makerow, where = SCHEMAS[schemaname]
+    fn = os.path.join(dir, "{}.{}.db".format(schemaname, formatname))
+    rng = random.Random(seed)
+    d = db.createdb(fn, schema, formatname)
+    d.addrows([makerow(i, rng) for i in range(numrows)])
+    d.close()
+    return fn
+
+# function: sum up a list of latencies
+# latencies: seconds taken by each call
+# return: a dict with the count, throughput and percentiles (in microseconds)
+def summarize(latencies) -> dict:
+    s = sorted(latencies)
+    n = len(s)
+    total = sum(s)
+    pct = lambda p: s[min(n - 1, int(p * n))] * 1e6
+    return {"n": n, "opspersec": n / total if total > 0 else 0.0,
+            "p50": pct(0.50), "p90": pct(0.90), "p99": pct(0.99), "max": s[-1] * 1e6}
+
+# function: time a function once per set of arguments
+# return: a list of the seconds each call took
+def timecalls(f, argslist) -> list:
+    r = list()
+    clock = time.perf_counter
+    for args in argslist:
+        start = clock()
+        f(*args)
+        r.append(clock() - start)
+    return r
+
+# function: run every benchmark against one db file
+# return: a dict of op name -> summary
+def runall(fn, schemaname, numrows, ops, scans, seed, poolbytes=None) -> dict:
+    schema, makerow, (field, val) = SCHEMAS[schemaname]
+    rng = random.Random(seed + 1)
+    r = dict()
+
+    # open with the index sidecar, then rebuilding it
+    def openclose(rebuild):
+        if rebuild and os.path.exists(fn + ".idx"):
+            os.remove(fn + ".idx")
+        d = db.database()
+        d.open(fn)
+        d.close()
+    r["open"] = summarize(timecalls(openclose, [(False,)] * scans))
+    r["open-rebuild"] = summarize(timecalls(openclose, [(True,)] * scans))
+
+    # reads, with the read cache off so every call goes to the file (or the buffer pool)
+    d = db.database()
+    d.open(fn, cacherows=0, poolbytes=poolbytes)
+    r["findkey-hit"] = summarize(timecalls(d.findkey, [(rng.randint(1, numrows),) for i in range(ops)]))
+    r["findkey-miss"] = summarize(timecalls(d.findkey, [(numrows + 1 + i,) for i in range(ops)]))
+    r["findval"] = summarize(timecalls(d.findval, [(field, val)] * scans))
+    d.createindex(field)
+    r["findval-indexed"] = summarize(timecalls(d.findval, [(field, val)] * ops))
+    d.dropindex(field)
+    r["findall"] = summarize(timecalls(d.findall, [()] * max(1, scans // 4)))
+
+    # writes, each addrow flushed on its own
+    def addflush(data):
+        d.addrow(data)
+        d.flush()
+    r["addrow+flush"] = summarize(timecalls(addflush, [(makerow(numrows + i, rng),) for i in range(ops)]))
+    r["removerow"] = summarize(timecalls(d.removerow, [(k,) for k in rng.sample(range(1, numrows + 1), min(ops, numrows))]))
+    r["flush-removes"] = summarize(timecalls(d.flush, [()]))
+    d.close()
+    return r
+
+# function: describe the machine and code the results came from
+def getmeta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "rows": args.rows, "ops": args.ops, "scans": args.scans,
+            "seed": args.seed, "poolbytes": args.poolbytes}
+
+# function: print the results next to an earlier run
+#  - ops that lost more than THRESHOLD of their throughput are marked
+def compare(results, old, args):
+    prev = {(x["schema"], x["format"], x["op"]): x for x in old["results"]}
+    print("\ncompared with {} ({}):".format(old["meta"].get("commit") or "?", old["meta"].get("time")))
+    for k in ("rows", "ops", "scans", "poolbytes"):
+        if old["meta"].get(k) != getattr(args, k):
+            print("note: --{} was {} in that run, {} now".format(k, old["meta"].get(k), getattr(args, k)))
+    print("{:10} {:7} {:16} {:>12} {:>12} {:>8}".format("schema", "format", "op", "old ops/s", "new ops/s", "change"))
+    for x in results:
+        p = prev.get((x["schema"], x["format"], x["op"]))
+        if p == None or p["opspersec"] == 0:
+            continue
+        change = x["opspersec"] / p["opspersec"] - 1
+        flag = "  <- slower" if change < -THRESHOLD else ""
+        print("{:10} {:7} {:16} {:>12.0f} {:>12.0f} {:>+7.1%}{}".format(
+            x["schema"], x["format"], x["op"], p["opspersec"], x["opspersec"], change, flag))
+
+def main():
+    ap = argparse.ArgumentParser(description="benchmark the database calls")
+    ap.add_argument("--rows", type=int, default=100000, help="rows in each synthetic db")
+    ap.add_argument("--ops", type=int, default=1000, help="calls timed for the per-row benchmarks")
+    ap.add_argument("--scans", type=int, default=8, help="calls timed for opens and scans")
+    ap.add_argument("--schemas", default=",".join(SCHEMAS), help="schemas to run ({})".format(",".join(SCHEMAS)))
+    ap.add_argument("--formats", default="binary,text", help="file formats to run")
+    ap.add_argument("--poolbytes", type=int, help="open the db with a buffer pool of this many bytes")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write the results to this json file")
+    ap.add_argument("--compare", help="an earlier results file to compare against")
+    args = ap.parse_args()
+
+    results = list()
+    print("{:10} {:7} {:16} {:>7} {:>12} {:>10} {:>10} {:>10}".format(
+        "schema", "format", "op", "n", "ops/s", "p50 us", "p99 us", "max us"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for schemaname in args.schemas.split(","):
+            for formatname in args.formats.split(","):
+                fn = makedb(tmp, schemaname, formatname, args.rows, args.seed)
+                for op, s in runall(fn, schemaname, args.rows, args.ops, args.scans, args.seed,
+                                    args.poolbytes).items():
+                    s.update({"schema": schemaname, "format": formatname, "op": op})
+                    results.append(s)
+                    print("{:10} {:7} {:16} {:>7} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                        schemaname, formatname, op, s["n"], s["opspersec"], s["p50"], s["p99"], s["max"]))
+
+    if args.out != None:
+        with open(args.out, "w") as f:
+            json.dump({"meta": getmeta(args), "results": results}, f, indent=1)
+
+    if args.compare != None:
+        with open(args.compare) as f:
+            compare(results, json.load(f), args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/local/bin/python3
+
+# benchmark: read throughput of one threadsafe db shared by a pool of threads
+#  - random findkey calls (read cache off so every call reads the file), then
+#    findval scans, timed separately
+#  - usage: python3 bench/threads.py [rows] [seconds per run]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+THREADS = (1, 2, 4, 8)
+
+# function: run readers against an open db for a while
+# scans: call findval (a scan of the file) instead of findkey
+# return: the number of calls made per second
+def run(d, nthreads, numrows, seconds, scans=False) -> float:
+    counts = [0] * nthreads
+    stop = time.perf_counter() + seconds
+
+    def reader(i):
+        rng = random.Random(i)
+        n = 0
+        while time.perf_counter() < stop:
+            if scans:
+                d.findval("name", "n{}".format(rng.randint(0, 99)))
+            else:
+                d.findkey(rng.randint(1, numrows))
+            n += 1
+        counts[i] = n
+
+    ts = [threading.Thread(target=reader, args=(i,)) for i in range(nthreads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(counts) / seconds
+
+def main():
+    numrows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, "bench.db")
+        schema = db.Schema(3, ["name", "qty", "price"], [str, int, float])
+        d = db.createdb(fn, schema)
+        d.addrows([("n{}".format(i % 100), i, i * 0.5) for i in range(numrows)])
+        d.close()
+
+        for mm in (False, True):
+            d = db.database()
+            d.open(fn, usemmap=mm, cacherows=0, threadsafe=True)
+            for scans in (False, True):
+                what = "scans" if scans else "reads"
+                base = None
+                for n in THREADS:
+                    r = run(d, n, numrows, seconds, scans)
+                    base = base or r
+                    print("{:<6} threads={:<2} {:>10.0f} {}/sec  x{:.2f}".format("mmap" if mm else "pread", n, r, what, r / base))
+            d.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/local/bin/python3
+
+import io
+import os
+import threading
+
+# size of a block of the db file, the same as a page of a paged file so a page
+# is always exactly one block
+BLOCKSIZE = 4096
+
+# how much a reader from the pool reads at once
+READAHEAD = 1 << 16
+
+# class: a buffer pool caching fixed-size blocks of a db file
+#  - blocks are read into frames on demand and kept up to a byte budget
+#  - a frame is pinned while it is in use and can not be evicted until unpinned
+#  - frames are evicted with the clock algorithm: every hit sets the frame's
+#    reference bit, the hand clears it as it passes and evicts the first unpinned
+#    frame it finds without one
+#  - writes go into the frames and mark them dirty, flush writes back only the
+#    dirty frames (evicting a dirty frame writes it back first)
+#  - scans read through the pool without adding the blocks they miss, so one big
+#    scan does not push the hot blocks out
+# fd: the file descriptor of the db file, read and written with pread/pwrite
+# numframes: how many blocks the budget holds
+# blocks: the block number held in each frame, None for an empty frame
+# frames: a dict of block number -> frame
+# bufs: the bytes of each frame
+# sizes: how many bytes of each frame are in file (a block at the end of the file
+#  is short)
+# pins, refs, dirty: pin count, reference bit and dirty bit of each frame
+# hand: the frame the clock looks at next
+# lock: frames are shared by readers in different threads
+class bufferpool:
+    def __init__(self, fd, maxbytes, blocksize=BLOCKSIZE):
+        self.__blocksize = blocksize
+        self.__numframes = max(1, maxbytes // blocksize)
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__writes = 0
+        self.__lock = threading.Lock()
+        self.reset(fd)
+
+    def __len__(self) -> int:
+        return len(self.__frames)
+
+    def getblocksize(self) -> int:
+        return self.__blocksize
+
+    # function: drop every frame, dirty or not, and start over on a file
+    #  - for when the file was replaced or changed by someone else
+    def reset(self, fd):
+        with self.__lock:
+            self.__fd = fd
+            n = self.__numframes
+            self.__blocks = [None] * n
+            self.__frames = dict()
+            self.__bufs = [None] * n
+            self.__sizes = [0] * n
+            self.__pins = [0] * n
+            self.__refs = [False] * n
+            self.__dirty = [False] * n
+            self.__hand = 0
+
+    # function: get a block into a frame and pin it
+    # return: the bytearray of the frame (zero padded past the end of the file),
+    #  None if every frame is pinned
+    def pin(self, blockno) -> bytearray:
+        with self.__lock:
+            i = self.__fetch(blockno, True)
+            if i < 0:
+                return None
+            self.__pins[i] += 1
+            return self.__bufs[i]
+
+    # function: let a pinned block be evicted again
+    # dirty: the frame was changed and has to be written back
+    def unpin(self, blockno, dirty=False):
+        with self.__lock:
+            i = self.__frames.get(blockno)
+            if i == None or self.__pins[i] == 0:
+                return
+            self.__pins[i] -= 1
+            if dirty:
+                self.__dirty[i] = True
+                self.__sizes[i] = self.__blocksize
+
+    # function: read bytes of the file through the pool
+    # cache: add the blocks that miss to the pool, False to read them straight
+    #  from file (scans)
+    # return: the bytes, short at the end of the file
+    def read(self, pos, n, cache=True) -> bytes:
+        bs = self.__blocksize
+        o = pos % bs
+        if o + n <= bs:
+            # within one block, the usual case for a single record
+            with self.__lock:
+                i = self.__fetch(pos // bs, cache)
+                if i >= 0:
+                    return bytes(self.__bufs[i][o:min(o + n, self.__sizes[i])])
+            return os.pread(self.__fd, n, pos)
+        r = list()
+        end = pos + n
+        while pos < end:
+            blockno = pos // bs
+            o = pos - blockno * bs
+            m = min(end - pos, bs - o)
+            with self.__lock:
+                i = self.__fetch(blockno, cache)
+                if i >= 0:
+                    b = bytes(self.__bufs[i][o:min(o + m, self.__sizes[i])])
+            if i < 0:
+                # a miss that is not cached reads every block up to the next hit at once
+                stop = pos + m
+                while stop < end and stop // bs not in self.__frames:
+                    stop = min(end, stop + bs)
+                b = os.pread(self.__fd, stop - pos, pos)
+                m = stop - pos
+            r.append(b)
+            if len(b) < m:
+                break
+            pos += m
+        return b"".join(r)
+
+    # function: get a file over the pool for scanning the file
+    #  - blocks that miss are read from file without being added to the pool
+    def reader(self) -> io.BufferedReader:
+        return io.BufferedReader(poolfile(self), READAHEAD)
+
+    # function: write bytes of the file into the pool, they reach the file on flush
+    # cache: add the blocks that miss to the pool, False to write them straight to
+    #  file (appends, which would push the hot blocks out)
+    # return: the number of bytes written
+    def write(self, pos, b, cache=True) -> int:
+        bs = self.__blocksize
+        done = 0
+        while done < len(b):
+            blockno = (pos + done) // bs
+            o = pos + done - blockno * bs
+            m = min(len(b) - done, bs - o)
+            with self.__lock:
+                # a whole block is not read from file first, it is all overwritten
+                i = self.__fetch(blockno, cache, load=(m < bs))
+                if i >= 0:
+                    self.__bufs[i][o:o + m] = b[done:done + m]
+                    self.__dirty[i] = True
+                    self.__sizes[i] = max(self.__sizes[i], o + m)
+            if i < 0:
+                # a miss that is not cached writes every block up to the next hit at once
+                stop = pos + done + m
+                while stop < pos + len(b) and stop // bs not in self.__frames:
+                    stop = min(pos + len(b), stop + bs)
+                m = stop - pos - done
+                os.pwrite(self.__fd, b[done:done + m], pos + done)
+            done += m
+        return done
+
+    # function: write the dirty frames back to file
+    # return: the number of bytes written
+    def flush(self) -> int:
+        n = 0
+        with self.__lock:
+            for blockno in sorted(self.__frames.keys()):
+                i = self.__frames[blockno]
+                if self.__dirty[i]:
+                    n += self.__writeback(i)
+        return n
+
+    # function: drop the frames of a range of the file that was changed without
+    #  going through the pool (a truncated tail) or must not be written back
+    #  - dirty and pinned frames in the range are dropped, not written back
+    def invalidate(self, pos, n):
+        bs = self.__blocksize
+        with self.__lock:
+            for blockno in range(pos // bs, (pos + n - 1) // bs + 1):
+                i = self.__frames.pop(blockno, None)
+                if i != None:
+                    self.__blocks[i] = None
+                    self.__pins[i] = 0
+                    self.__dirty[i] = False
+
+    # function: get the counters and current size of the pool
+    # return: a dict with hits, misses, evictions, writes (blocks written back),
+    #  blocks, dirty blocks and bytes
+    def getstats(self) -> dict:
+        return {
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "evictions": self.__evictions,
+            "writes": self.__writes,
+            "blocks": len(self.__frames),
+            "dirty": sum(1 for i in self.__frames.values() if self.__dirty[i]),
+            "bytes": len(self.__frames) * self.__blocksize,
+        }
+
+    # function: find the frame of a block, reading the block in on a miss
+    #  - the lock must be held
+    # cache: take a frame for a block that misses, False to leave it out
+    # load: read the block from file into a new frame, False if it is about to be
+    #  overwritten
+    # return: the frame, -1 if the block is not in the pool (and was not added)
+    def __fetch(self, blockno, cache, load=True) -> int:
+        i = self.__frames.get(blockno)
+        if i != None:
+            self.__hits += 1
+            self.__refs[i] = True
+            return i
+        self.__misses += 1
+        if not cache:
+            return -1
+
+        i = self.__victim()
+        if i < 0:
+            return -1
+        if self.__bufs[i] == None:
+            self.__bufs[i] = bytearray(self.__blocksize)
+        buf = self.__bufs[i]
+        n = 0
+        if load:
+            b = os.pread(self.__fd, self.__blocksize, blockno * self.__blocksize)
+            n = len(b)
+            buf[:n] = b
+        buf[n:] = bytes(self.__blocksize - n)
+        self.__blocks[i] = blockno
+        self.__frames[blockno] = i
+        self.__sizes[i] = n
+        self.__pins[i] = 0
+        self.__refs[i] = True
+        self.__dirty[i] = False
+        return i
+
+    # function: free a frame with the clock, writing it back if it is dirty
+    #  - the lock must be held
+    # return: the frame, -1 if every frame is pinned
+    def __victim(self) -> int:
+        for j in range(2 * self.__numframes):
+            i = self.__hand
+            self.__hand = (i + 1) % self.__numframes
+            if self.__blocks[i] == None:
+                return i
+            if self.__pins[i] > 0:
+                continue
+            if self.__refs[i]:
+                self.__refs[i] = False
+                continue
+            if self.__dirty[i]:
+                self.__writeback(i)
+            del self.__frames[self.__blocks[i]]
+            self.__blocks[i] = None
+            self.__evictions += 1
+            return i
+        return -1
+
+    # function: write a frame to file and mark it clean
+    #  - the lock must be held
+    # return: the number of bytes written
+    def __writeback(self, i) -> int:
+        n = os.pwrite(self.__fd, self.__bufs[i][:self.__sizes[i]], self.__blocks[i] * self.__blocksize)
+        self.__dirty[i] = False
+        self.__writes += 1
+        return n
+
+# class: a read-only raw file over a bufferpool, a BufferedReader over it gives the
+#  file formats the file object they read records from
+# pool: the bufferpool
+# pos: the position in file
+class poolfile(io.RawIOBase):
+    def __init__(self, pool):
+        self.__pool = pool
+        self.__pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos, whence=0) -> int:
+        if whence == 1:
+            pos += self.__pos
+        elif whence == 2:
+            raise io.UnsupportedOperation("can not seek from the end of a pool")
+        self.__pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self.__pos
+
+    def readinto(self, b) -> int:
+        d = self.__pool.read(self.__pos, len(b), cache=False)
+        b[:len(d)] = d
+        self.__pos += len(d)
+        return len(d)
@@ -0,0 +1,164 @@
+#!/usr/local/bin/python3
+
+import socket
+
+import util as ut
+import protocol as pr
+
+# class: a connection to a db served by server.py
+#  - calls mirror database: findkey, findval, addrow, ... and return the same things
+#  - pipeline sends many requests before reading any response
+# sock: the socket, None when not connected
+# reader: a buffered file over the socket for reading frames
+# nextid: the id of the next request
+class client:
+    def __init__(self):
+        self.__sock = None
+        self.__reader = None
+        self.__nextid = 1
+
+    # function: connect to a server
+    # address: "host:port" for tcp, anything else is the path of a unix socket
+    # return: 0 on sucess, 1 on fail
+    def connect(self, address) -> int:
+        try:
+            host, sep, port = address.rpartition(":")
+            if sep != "" and port.isdigit():
+                s = socket.create_connection((host, int(port)))
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            else:
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.connect(address)
+        except OSError:
+            ut.output("unable to connect to {}.".format(address))
+            return 1
+        self.__sock = s
+        self.__reader = s.makefile("rb")
+        return 0
+
+    def close(self):
+        if self.__sock == None:
+            return
+        self.__reader.close()
+        self.__sock.close()
+        self.__sock = None
+
+    def isconnected(self) -> bool:
+        return self.__sock != None
+
+    def findkey(self, key):
+        return self.__call(pr.GET, key)
+
+    def addrow(self, data) -> int:
+        return self.__call(pr.ADD, list(data))
+
+    def update(self, key, field, val) -> int:
+        return self.__call(pr.UPDATE, key, field, val)
+
+    def removerow(self, key) -> int:
+        return self.__call(pr.DELETE, key)
+
+    def findval(self, field, val) -> dict:
+        return self.__call(pr.FIND, field, val)
+
+    def findrange(self, field, lo, hi) -> dict:
+        return self.__call(pr.RANGE, field, lo, hi)
+
+    def aggregate(self, op, field=None, groupby=None, where=None):
+        return self.__call(pr.AGGREGATE, op, field, groupby, where)
+
+    def flush(self) -> int:
+        return self.__call(pr.FLUSH)
+
+    # function: get every row in the db
+    # return: a dict of key -> data, None on fail
+    def findall(self) -> dict:
+        r = dict()
+        for row in self.iterall():
+            r[row[0]] = row[1]
+        return r if self.__sock != None else None
+
+    # function: iterate over every row in the db as the server streams it
+    #  - the connection can not be used for anything else until the scan is done
+    # return: a generator of (key, data) tuples
+    def iterall(self):
+        id = self.__send(pr.SCAN)
+        while True:
+            f = self.__recv()
+            if f == None:
+                return
+            rid, code, body = f
+            if code == pr.MORE:
+                for k, d in body:
+                    yield (k, tuple(d))
+                continue
+            if code == pr.ERROR:
+                ut.output("scan failed. {}".format(body))
+            return
+
+    # function: send many requests, then read all the responses
+    # calls: a list of (op, args) with an op from protocol.py and a list of arguments
+    #  - SCAN can not be pipelined
+    # return: a list of results in the order of calls
+    def pipeline(self, calls) -> list:
+        self.__sock.sendall(b"".join(self.__frame(op, args) for op, args in calls))
+        r = list()
+        for op, args in calls:
+            f = self.__recv()
+            r.append(None if f == None else self.__result(op, f))
+        return r
+
+    # function: build the frame of a request and give it an id
+    def __frame(self, op, args) -> bytes:
+        b = pr.encodeframe(self.__nextid, op, list(args))
+        self.__nextid += 1
+        return b
+
+    # return: the id of the request
+    def __send(self, op, *args) -> int:
+        id = self.__nextid
+        try:
+            self.__sock.sendall(self.__frame(op, args))
+        except OSError:
+            ut.output("lost the connection to the server.")
+            self.close()
+        return id
+
+    # return: (id, code, body), None if the connection is lost
+    def __recv(self):
+        if self.__sock == None:
+            return None
+        try:
+            f = pr.recvframe(self.__reader)
+        except OSError:
+            f = None
+        if f == None:
+            ut.output("lost the connection to the server.")
+            self.close()
+        return f
+
+    def __call(self, op, *args):
+        if self.__sock == None:
+            ut.output("unable to send request. not connected.")
+            return None
+        self.__send(op, *args)
+        f = self.__recv()
+        if f == None:
+            return None
+        return self.__result(op, f)
+
+    # function: turn the body of a response back into what database would return
+    def __result(self, op, f):
+        id, code, body = f
+        if code == pr.ERROR:
+            ut.output("request {} failed. {}".format(id, body))
+            return None
+        if body == None:
+            return None
+        if op == pr.GET:
+            return tuple(body)
+        if op == pr.FIND or op == pr.RANGE:
+            return pr.decoderows(body)
+        if op == pr.AGGREGATE and type(body) == list:
+            return {g: x for g, x in body}
+        return body
@@ -0,0 +1,202 @@
+#!/usr/local/bin/python3
+
+from array import array
+from bisect import bisect_right
+
+# numpy is optional, without it columns are plain arrays and ops are python loops
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# class: every row of a db held one column per field
+#  - int and float fields are typed arrays (numpy arrays when numpy is installed)
+#  - str fields are one utf-8 buffer plus an array of offsets into it
+#  - built once from a snapshot of the rows, then read only
+# keys: the key of the row at each position
+# cols: one column per field in schema order
+#  - int/float: array("q")/array("d") (or a numpy view of it)
+#  - str: (offsets, buffer), row i is buffer[offsets[i]:offsets[i + 1]]
+class columnstore:
+    def __init__(self, schema):
+        self.__schema = schema
+        self.__keys = array("q")
+        self.__cols = list()
+        for ft in schema.fieldtypes:
+            if ft == int:
+                self.__cols.append(array("q"))
+            elif ft == float:
+                self.__cols.append(array("d"))
+            else:
+                self.__cols.append((array("q", [0]), bytearray()))
+        self.__frozen = False
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    # function: add a row to the end of the columns
+    #  - only before freeze
+    def append(self, key, data):
+        self.__keys.append(key)
+        for c, ft, x in zip(self.__cols, self.__schema.fieldtypes, data):
+            if ft == int or ft == float:
+                c.append(x)
+            else:
+                c[1].extend(x.encode())
+                c[0].append(len(c[1]))
+
+    # function: finish building, numeric columns become numpy views if numpy is installed
+    def freeze(self):
+        if self.__frozen:
+            return
+        self.__frozen = True
+        self.__buffers = [bytes(c[1]) if type(c) == tuple else None for c in self.__cols]
+        if np == None:
+            return
+        self.__keys = np.frombuffer(self.__keys, dtype=np.int64)
+        for i, ft in enumerate(self.__schema.fieldtypes):
+            if ft == int:
+                self.__cols[i] = np.frombuffer(self.__cols[i], dtype=np.int64)
+            elif ft == float:
+                self.__cols[i] = np.frombuffer(self.__cols[i], dtype=np.float64)
+
+    def key(self, i) -> int:
+        return int(self.__keys[i])
+
+    # function: get the value of a field at a position
+    def value(self, fi, i):
+        c = self.__cols[fi]
+        if type(c) == tuple:
+            return self.__buffers[fi][c[0][i]:c[0][i + 1]].decode()
+        return c[i].item() if np != None else c[i]
+
+    # function: get the data tuple of the row at a position
+    def row(self, i) -> tuple:
+        return tuple(self.value(fi, i) for fi in range(len(self.__cols)))
+
+    # function: get every value of a field as a python list
+    # positions: the positions to get, None for every row
+    def values(self, fi, positions=None) -> list:
+        c = self.__cols[fi]
+        if type(c) == tuple:
+            if positions == None:
+                positions = range(len(self.__keys))
+            return [self.value(fi, i) for i in positions]
+        if positions == None:
+            return c.tolist()
+        if np != None:
+            return c[positions].tolist()
+        return [c[i] for i in positions]
+
+    # function: find the rows where a field equals a value
+    # return: a list of positions in ascending order
+    def match(self, fi, val) -> list:
+        c = self.__cols[fi]
+
+        # str: search the whole buffer for the value, keep hits that are a whole row
+        if type(c) == tuple:
+            offsets = c[0]
+            n = len(self.__keys)
+            b = val.encode()
+            if len(b) == 0:
+                return [i for i in range(n) if offsets[i] == offsets[i + 1]]
+            buf = self.__buffers[fi]
+            r = list()
+            p = buf.find(b)
+            while p >= 0:
+                i = bisect_right(offsets, p) - 1
+                if offsets[i] == p and offsets[i + 1] - p == len(b):
+                    r.append(i)
+                    p = buf.find(b, p + len(b))
+                else:
+                    p = buf.find(b, p + 1)
+            return r
+
+        if np != None:
+            return np.flatnonzero(c == val).tolist()
+        return [i for i, x in enumerate(c) if x == val]
+
+    # function: find the rows where a numeric field is in a range
+    # lo, hi: inclusive bounds, None for no bound
+    # return: a list of positions in ascending order
+    def between(self, fi, lo, hi) -> list:
+        c = self.__cols[fi]
+        if np != None:
+            m = np.ones(len(c), dtype=bool)
+            if lo != None:
+                m &= c >= lo
+            if hi != None:
+                m &= c <= hi
+            return np.flatnonzero(m).tolist()
+        return [i for i, x in enumerate(c) if (lo == None or x >= lo) and (hi == None or x <= hi)]
+
+    # function: count, sum, average, min or max a field
+    # op: "count", "sum", "avg", "min" or "max"
+    # positions: the positions to aggregate, None for every row
+    # return: the result, None for sum/avg/min/max over no rows
+    def reduce(self, op, fi, positions=None):
+        if op == "count":
+            return len(self.__keys) if positions == None else len(positions)
+        if op == "avg":
+            s = self.reduce("sum", fi, positions)
+            return None if s == None else s / self.reduce("count", fi, positions)
+
+        c = self.__cols[fi]
+        if type(c) == tuple or np == None:
+            vals = self.values(fi, positions)
+            if len(vals) == 0:
+                return None
+            return {"sum": sum, "min": min, "max": max}[op](vals)
+
+        if positions != None:
+            c = c[positions]
+        if len(c) == 0:
+            return None
+        return {"sum": c.sum, "min": c.min, "max": c.max}[op]().item()
+
+    # function: count, sum, average, min or max a field for each value of another field
+    # gfi: the field to group by
+    # op: "count", "sum", "avg", "min" or "max"
+    # fi: the field to aggregate (not used for count)
+    # positions: the positions to aggregate, None for every row
+    # return: a dict of group value -> result
+    def groupby(self, gfi, op, fi, positions=None):
+        if op == "avg":
+            s = self.groupby(gfi, "sum", fi, positions)
+            n = self.groupby(gfi, "count", fi, positions)
+            return {g: s[g] / n[g] for g in s}
+
+        g = self.__cols[gfi]
+        c = self.__cols[fi]
+
+        # numeric group and aggregate columns can be done in numpy
+        if np != None and type(g) != tuple and (op == "count" or type(c) != tuple):
+            if positions != None:
+                g = g[positions]
+                if type(c) != tuple:
+                    c = c[positions]
+            groups, inv = np.unique(g, return_inverse=True)
+            if op == "count":
+                r = np.bincount(inv, minlength=len(groups))
+            elif op == "sum":
+                r = np.zeros(len(groups), dtype=c.dtype)
+                np.add.at(r, inv, c)
+            elif op == "min":
+                r = np.full(len(groups), np.inf if c.dtype.kind == "f" else np.iinfo(c.dtype).max, dtype=c.dtype)
+                np.minimum.at(r, inv, c)
+            else:
+                r = np.full(len(groups), -np.inf if c.dtype.kind == "f" else np.iinfo(c.dtype).min, dtype=c.dtype)
+                np.maximum.at(r, inv, c)
+            return dict(zip(groups.tolist(), r.tolist()))
+
+        r = dict()
+        gv = self.values(gfi, positions)
+        if op == "count":
+            for x in gv:
+                r[x] = r.get(x, 0) + 1
+            return r
+
+        f = {"sum": lambda a, b: a + b, "min": min, "max": max}[op]
+        for x, y in zip(gv, self.values(fi, positions)):
+            r[x] = y if x not in r else f(r[x], y)
+        return r
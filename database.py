@@ -2,9 +2,28 @@
 
 import os
 import io
+import glob
+import mmap
+import time
+import fcntl
+import itertools
+import threading
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import util as ut
+from index import offsetindex, removesidecar, FIELDINDEXES
+from wal import writeaheadlog
+from readcache import readcache
+from columnar import columnstore
+from rwlock import rwlock, nolock, readlocked, writelocked
+from filelock import processlock
+from stats import statsrecorder, instrumented
+from pages import PAGESIZE, pagestore
+from bufferpool import BLOCKSIZE, bufferpool
+import parallelscan
+import dataio
+from fileformat import FORMATS, NAMETYPES, detectformat
 
 # Schema represents the data organization in a db
 # fieldids: string identifying each field in a row
@@ -18,136 +37,305 @@ Schema = namedtuple("Schema", ["numfields", "fieldids", "fieldtypes"])
 #  - both are stored as members in the db class
 Row = namedtuple("Row", ["key", "data"])
 
+# how many bytes to read at once when reading a single record
+READSIZE = 4096
+
+# numbers the dbs opened with multiprocess in this process, each gets its own log
+WALIDS = itertools.count()
+
+# ops that database.aggregate can compute
+AGGREGATEOPS = ("count", "sum", "avg", "min", "max")
+
+# fewest dead records in file before autocompact will rewrite it
+MINCOMPACTROWS = 1000
+
+# how many rows convert lays out at once
+CONVERTROWS = 10000
+
 # class: a database that interfaces with a file
 #  - organized in a schema
-#  - rows that have been recently recalled are stored in cache
+#  - rows that have been recently recalled are stored in readcache
 #  - rows that are modified are stored in cache
 # schema: a schema object that describes the schema
-# file: the file handle
-# numrows: the number of rows in the db
+# file: the file handle (binary mode)
+# format: a fileformat object that reads and writes the file's header and records
+# codec: the format's codec for the schema, compiled by setschema
+# numrows: the number of rows in the db (cached in the file header)
+# dataoffset: the offset of the first record in file, found once at open
 # cache: a dict with the modified rows
+# readcache: a bounded lru cache of rows read from file, never holds modified rows
+# index: an offsetindex mapping every key to the offset of its row in file
+# wal: a writeaheadlog every change is logged to before it reaches the cache
+# walid: the number in the name of the log when opened with multiprocess
+# fieldindexes: a dict of (fieldid, kind) -> secondary index (hashindex or rangeindex)
+# map: a read-only memory map of the file when opened with usemmap, reads come from it
+# columns: a columnstore of every row when opened with columnar, built on first use
+#  and dropped by any change to the rows
+# executor: the worker processes for parallel scans when opened with scanworkers > 1
+# scanoffsets: (writes, sorted live offsets in file) the last parallel scan split
+#  the file with, reused until the rows in file are written again (an offset of
+#  a row deleted since is still a record boundary to split on)
+# lock: an rwlock when opened with threadsafe, readers share it and changes hold
+#  it alone. iterall and iterval do not hold it while the caller has a row
+#  - opened with multiprocess it is a processlock, which also takes an flock on
+#    the file and reloads the db when another process has changed the file
+# version: the generation counter of the file (or its (size, mtime) for text
+#  files) as this db last saw it
+# autocompact: the ratio of dead records in file at which it is compacted, None
+#  to only compact when asked
+# compactor: the background thread checking the dead ratio when opened with
+#  compactinterval, None if there is none
+# stopcompactor: an event set to stop the compactor
+# recorder: a statsrecorder counting and timing the calls made on the db
+# pool: a bufferpool of blocks of the file when opened with poolbytes, reads of
+#  rows (and pages of a paged file) go through it, None if there is none
+# pages: a pagestore writing rows into the pages of a paged file, None for the
+#  append only formats
+# deleted: a dict of key -> offset in file of the rows removed since the last
+#  flush, so the flush can free their slots (paged files only)
+# writes: bumped every time rows in file are written or moved (flush, addrows,
+#  compact, a reload), a scan only fills the read cache while it has not changed
+#  since the scan started. a paged flush rewrites rows at the same offset, so the
+#  offset check of a scan that read the page before the flush still passes
 #
 # NOTE: a row in cache with null data is deleted
 # NOTE: -1 is an invalid value for keygen
+# NOTE: the rows in file are append only. flush appends new versions of rows and
+#       tombstones for deleted rows, the index points at the live version of each
+#       key. compact writes the live rows to a new file and renames it over the old
+# NOTE: except in a paged file, where flush rewrites the pages holding the changed
+#       rows and new rows fill the space deleted ones left. a crash part way
+#       through writing a page is only covered by the write-ahead log
 
-# TODO: add a metadata offset
-# TODO: convert to binary file
-# TODO: convert to a python type object in schema
 class database:
-    __NUM_METADATA_LINES = 5
-
     def __init__(self):
         self.__schema = None
         self.__file = None
+        self.__format = None
+        self.__codec = None
         self.__keygen = -1
         self.__cache = dict()
+        self.__readcache = readcache()
         self.__numrows = 0
+        self.__filename = None
+        self.__index = offsetindex()
+        self.__dataoffset = 0
+        self.__wal = None
+        self.__walid = 0
+        self.__fieldindexes = dict()
+        self.__usemmap = False
+        self.__map = None
+        self.__columnar = False
+        self.__columns = None
+        self.__scanworkers = 1
+        self.__executor = None
+        self.__scanoffsets = None
+        self.__lock = nolock()
+        self.__multiprocess = False
+        self.__version = None
+        self.__autocompact = None
+        self.__compactor = None
+        self.__stopcompactor = threading.Event()
+        self.__recorder = statsrecorder()
+        self.__pool = None
+        self.__pages = None
+        self.__deleted = dict()
+        self.__writes = 0
         pass
 
     # function: opens a db from a valid db file
+    #  - the format of the file (text, binary or paged) is detected automatically
+    #  - replays the write-ahead log if the db was not closed cleanly
     # filename: the name of the db file
+    # wal: log changes to a write-ahead log so they survive a crash before flush
+    # walbatch: how many changes to group into one write to the log
+    # walsync: when to fsync the log ("always", "flush" or "never")
+    # usemmap: read rows through a memory map of the file instead of file reads
+    # cacherows: most rows to keep in the read cache (None for no limit, 0 to disable)
+    # cachebytes: most bytes of rows to keep in the read cache (None for no limit)
+    # poolbytes: keep up to this many bytes of blocks of the file in a buffer pool,
+    #  None to read the file for every row the read cache misses (the pool is not
+    #  used for reads with usemmap)
+    # columnar: answer findval and the aggregates from a column per field held in
+    #  memory instead of decoding every row (for read-mostly dbs)
+    # scanworkers: how many processes findval, findrange and findall split a scan of
+    #  the file across (1 to scan in this process)
+    # threadsafe: lock the db so it can be shared between threads
+    # multiprocess: lock the file so it can be shared between processes, every
+    #  call takes an flock (shared to read, exclusive to write) and reloads the db
+    #  if another process changed the file since
+    # autocompact: compact the file after a flush once this ratio of the records in
+    #  it are dead (old versions of rows and tombstones), None to never
+    # compactinterval: check the dead ratio every this many seconds on a background
+    #  thread instead of after each flush (implies threadsafe)
     # return: 0 on sucess, 1 on fail, 2 on parse failure
-    def open(self, filename) -> int:
+    @instrumented
+    def open(self, filename, wal=True, walbatch=1, walsync="flush", usemmap=False,
+             cacherows=1024, cachebytes=None, columnar=False, scanworkers=1,
+             threadsafe=False, multiprocess=False, autocompact=None,
+             compactinterval=None, poolbytes=None) -> int:
         # does file exist?
         if os.path.exists(filename) != True:
             ut.output("{} does not exist.".format(filename))
             return 1
-        
+
         # attempt to open file
         try:
-            self.__file = open(filename, "r+")
+            self.__file = open(filename, "rb+")
         except:
             ut.output("unable to open file {}.".format(filename))
             return 1
 
-        # parse numfields
-        self.__file.seek(0, 0)
-        tmp = self.__file.readline()
-        tmp = tmp.replace("\n", "")
-
-        # try to convert to int
-        try:
-            numfields = int(tmp)
-        except:
-            ut.output("an error occured while parsing 'numfileds'. check db file.")
-            return 2
-
-        # parse fieldids
-        tmp = self.__file.readline()
-        tmp = tmp.replace("\n", "")
-        tmp = tmp.split(",")
-        fieldids = list()
-        for f in tmp:
-            if f == "":
-                continue
-            fieldids.append(f)
-        if len(fieldids) != numfields:
-            ut.output("unable to parse fieldids. fieldsids and numfields does not match.")
-            return 2
-
-        # parse fieldtypes
-        tmp = self.__file.readline()
-        tmp = tmp.replace("\n", "")
-        tmp = tmp.split(",")
-        fieldtypes = list()
-        for t in tmp:
-            if t == "":
-                continue
-            
-            # convert string to a python type object
-            if t == "str":
-                fieldtypes.append(str)
-            elif t == "int":
-                fieldtypes.append(int)
-            elif t == "float":
-                fieldtypes.append(float)
-
-        if len(fieldtypes) != numfields:
-            ut.output("unable to parse fieldtypes. fieldtypes and numfields does not match.")
-            return 2
-
-        # parse keygen
-        tmp = self.__file.readline()
-        tmp = tmp.replace("\n", "")
-
-        # attempt to convert to int 
+        self.__multiprocess = multiprocess
+        self.__walid = next(WALIDS)
+        self.__filename = filename
+        threadlock = rwlock() if threadsafe or compactinterval != None else nolock()
+        self.__lock = threadlock
+
+        # other processes may be writing, hold the file alone until it is loaded
+        if multiprocess:
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+            if self.__reopen() != 0:
+                self.__file.close()
+                return 1
         try:
-            keygen = int(tmp)
-        except:
-            ut.output("unable to parse keygen. check db file.")
-            return 2
-
-        # parse numrows
-        tmp = self.__file.readline()
-        tmp = tmp.replace("\n", "")
+            r = self.__load(filename, wal, walbatch, walsync, usemmap, cacherows,
+                            cachebytes, columnar, scanworkers, poolbytes)
+            self.__written()
+        finally:
+            if multiprocess:
+                fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+
+        if multiprocess:
+            self.__lock = processlock(threadlock, self.__file.fileno(), self.__haschanged,
+                                      self.__refresh, self.__written)
+
+        self.__autocompact = autocompact
+        if r == 0 and autocompact != None and compactinterval != None:
+            self.__stopcompactor.clear()
+            self.__compactor = threading.Thread(target=self.__compactloop,
+                                                args=(compactinterval,), daemon=True)
+            self.__compactor.start()
+        return r
 
-        # attempt to convert to int
-        try:
-            numrows = int(tmp)
-        except:
-            ut.output("unable to parse numrows. check db file.")
+    # function: read the header, indexes and write-ahead log of a just opened file
+    # return: 0 on sucess, 1 on fail, 2 on parse failure
+    def __load(self, filename, wal, walbatch, walsync, usemmap, cacherows, cachebytes,
+               columnar, scanworkers, poolbytes) -> int:
+        # parse the metadata
+        self.__format = detectformat(self.__file)
+        h = self.__format.readheader(self.__file)
+        if h == None:
             return 2
+        numfields, fieldids, fieldtypes, keygen, numrows = h
 
         # fill out member data
         self.setschema(Schema(numfields, fieldids, fieldtypes))
         self.__numrows = numrows
         self.__keygen = keygen
+        self.__filename = filename
+        self.__dataoffset = self.__file.tell()
+        self.__pool = bufferpool(self.__file.fileno(), poolbytes) if poolbytes != None else None
+        self.__pages = pagestore(self.__dataoffset, self.__pool) if self.__format.paged else None
+        self.__deleted = dict()
+        self.__usemmap = usemmap
+        self.__remap()
+        self.__readcache = readcache(cacherows, cachebytes)
+        self.__columnar = columnar
+        self.__columns = None
+        self.__scanworkers = max(1, scanworkers)
+        self.__scanoffsets = None
+        if self.__scanworkers > 1:
+            self.__executor = ProcessPoolExecutor(self.__scanworkers)
+
+        # load the key index, rebuild it if the sidecar is missing or stale
+        if self.__index.load(self.__indexfilename(), self.__getfilestamp()) != 0:
+            if self.__buildindex() != 0:
+                return 2
+            self.__index.save(self.__indexfilename(), self.__getfilestamp())
+
+        # the index knows exactly which rows are in file, trust it over the header
+        if len(self.__index) != self.__numrows:
+            ut.log(ut.WARNING, "numrows in header ({}) does not match the file. using {}.", self.__numrows, len(self.__index))
+            self.__numrows = len(self.__index)
+
+        # load the secondary indexes that exist for this db
+        if self.__loadfieldindexes() != 0:
+            return 2
+
+        # replay any changes that were logged but never flushed, including the logs
+        # of other processes that died before they flushed
+        if wal:
+            w = writeaheadlog(self.__walfilename(), walbatch, walsync)
+            if w.open() != 0:
+                return 1
+            orphans = self.__orphanwals() if self.__multiprocess else list()
+            for o in [w] + orphans:
+                if self.__replaywal(o) != 0:
+                    return 2
+            self.__wal = w
+            if self.__iscacheempty() or self.flush() == 0:
+                for o in orphans:
+                    o.close(remove=True)
 
         return 0
 
+    @instrumented
     def close(self) -> int:
         # is file already closed
-        if self.__file != None or self.__file.closed != True:
+        if not self.isopen():
+            return 0
+
+        if self.__compactor != None:
+            self.__stopcompactor.set()
+            self.__compactor.join()
+            self.__compactor = None
+
+        with self.__lock.writing():
             # flush cache
             if len(self.__cache) > 0:
-                self.flush()
+                if self.flush() != 0:
+                    # keep the log so the changes are replayed next time
+                    if self.__wal != None:
+                        self.__wal.close()
+                        self.__wal = None
+            if self.__wal != None:
+                self.__wal.close(remove=True)
+                self.__wal = None
+
+        # the file lock goes with the file
+        self.__lock = nolock()
+        self.__map = None
+        self.__pool = None
+        self.__columns = None
+        if self.__executor != None:
+            self.__executor.shutdown()
+            self.__executor = None
         self.__file.close()
         return 0
 
+    # function: write any changes buffered for the write-ahead log to it
+    #  - changes are durable once commited, without having to flush the db
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @writelocked
+    def commit(self) -> int:
+        if self.__wal == None:
+            return 0
+        return self.__wal.commit()
+
+    @instrumented
+    @writelocked
     def addrow(self, data) -> int:
         if type(data) != tuple:
             ut.output("unable to create row. data parameter must be of type 'tuple'")
             return 1
+        if not self.__checkdata(data):
+            ut.output("unable to create row. data does not match the schema.")
+            return 1
+        if not self.__checksize(data):
+            ut.output("unable to create row. row is too big for the file format.")
+            return 1
 
         key = self.__getnewkey()
 
@@ -155,78 +343,137 @@ class database:
             ut.output("unable to create row. invalid key.")
             return 1
 
+        if self.__logput(key, data) != 0:
+            ut.output("unable to create row. failed to log change.")
+            return 1
+
+        self.__indexrow(key, None, data)
         self.__cache[key] = data
+        self.__index.set(key, -1) # not in file until the next flush
         self.__numrows += 1
+        self.__columns = None
         return 0
 
+    # function: add many rows at once
+    #  - every row is checked against the schema before any is added
+    #  - keys are allocated as one contiguous block
+    #  - the rows go straight to the end of the file with a single write,
+    #    they do not pass through the cache or the write-ahead log
+    # rows: an iterable of data tuples
+    # return: a list of the new keys on sucess, None on fail
+    @instrumented
+    @writelocked
+    def addrows(self, rows) -> list:
+        if not self.isopen():
+            ut.output("unable to add rows. no db is open.")
+            return None
+        if self.__keygen == -1:
+            ut.output("unable to add rows. invalid keygen.")
+            return None
+
+        rows = list(rows)
+        for i, data in enumerate(rows):
+            if type(data) != tuple or not self.__checkdata(data):
+                ut.output("unable to add rows. row {} does not match the schema.".format(i))
+                return None
+            if not self.__checksize(data):
+                ut.output("unable to add rows. row {} is too big for the file format.".format(i))
+                return None
+
+        # allocate the block of keys and serialize the batch
+        self.__synckeygen()
+        keys = list(range(self.__keygen + 1, self.__keygen + 1 + len(rows)))
+        nd = list()
+        for k, data in zip(keys, rows):
+            rec = self.__serializerow(k, data)
+            if rec == None:
+                ut.output("unable to add rows. failed to serialize key {}.".format(k))
+                return None
+            nd.append((k, rec))
+        if self.__appendrecords(nd) != 0:
+            ut.output("unable to add rows. failed to write them to file.")
+            return None
+        self.__keygen += len(rows)
+        self.__numrows += len(rows)
+        self.__columns = None
+        for (fieldid, kind), idx in self.__fieldindexes.items():
+            fi = self.__schema.fieldids.index(fieldid)
+            idx.addmany([(k, data[fi]) for k, data in zip(keys, rows)])
+
+        if self.__writecounters() != 0:
+            if self.compact() != 0:
+                return None
+            return keys
+
+        self.__bumpgeneration()
+        self.__file.flush()
+        self.__remap()
+        if self.__wal != None and self.__wal.getsyncmode() == "always":
+            os.fsync(self.__file.fileno())
+
+        # unflushed rows are in the secondary indexes, they are saved on the next flush
+        if self.__iscacheempty():
+            self.__saveindexes()
+
+        return keys
+
+    @instrumented
+    @writelocked
     def removerow(self, key):
-        for r in self.__cache:
-            if r.key == key:
-                r.data = None
-                self.numrows -= 1
-                return 0
-
-        self.__file.seek(0)
-        for line in self.__file:
-            if int(line.split(",")[0]) == key:
-                self.__cache[key] = None
-                self.numrows -= 1
-                return 0
-
-        ut.output("{} does not exist in the db.".format(key))
-        return 1
+        # a row is live if it is in the index
+        pos = self.__index.get(key)
+        if pos == None:
+            ut.output("{} does not exist in the db.".format(key))
+            return 1
+
+        if self.__wal != None and self.__wal.append(writeaheadlog.DELETE, key) != 0:
+            ut.output("unable to remove key {}. failed to log change.".format(key))
+            return 1
+
+        if len(self.__fieldindexes) > 0:
+            self.__indexrow(key, self.__getrow(key), None)
+
+        # rows that never made it to file can just be dropped from cache,
+        # rows in file need a tombstone written on the next flush
+        if pos < 0:
+            self.__cache.pop(key, None)
+        else:
+            self.__cache[key] = None
+            if self.__pages != None:
+                self.__deleted[key] = pos
+        self.__readcache.invalidate(key)
+        self.__index.remove(key)
+        self.__numrows -= 1
+        self.__columns = None
+        return 0
 
     # function: find a row with designated key
     # return: the data tuple associated with key, None on fail/non-existent key
+    @instrumented
+    @readlocked
     def findkey(self, key):
         # preform checks
         if not self.isopen():
-            ut.output("unable to find key {}. no db is open.")
+            ut.output("unable to find key {}. no db is open.".format(key))
             return None
         if self.isempty():
-            ut.output("unable to find key {}. db is empty.")
-            return None
-        if not self.__validatefile():
-            ut.output("unable to find key {}. file not valid.".format(key))
+            ut.output("unable to find key {}. db is empty.".format(key))
             return None
 
-        # check cache first
-        if key in self.__cache.keys():
-            return self.__cache[key]
-        # look in file if not in cache
-        else:
-            nl = self.__getfilenumlines()
-
-            # loop through lines in file until a match is found
-            self.__file.seek(0)
-            i = 0
-            while i < nl:
-                if i in range(5): self.__file.readline(); i += 1; continue # skip metadata lines
-
-                # read line in file
-                l = self.__file.readline()
-                l = ut.stripnewlines(l)
-                sl = l.split(",")
-                if key == int(sl[0]): # does key match?
-                    r = self.__deserializerow(l)
-                    if r == None:
-                        ut.output("an error occured while deserailzing key {}. unable to retrive data.".format(key))
-                        return None
-                    return r.data
-                i += 1
-
-        return None
+        return self.__getrow(key)
 
+    @instrumented
+    @readlocked
     def findval(self, field, val) -> dict:
         # preform checks
         if not self.isopen():
-            ut.output("unable to find key {}. no db is open.")
+            ut.output("unable to find val {}. no db is open.".format(val))
             return None
         if self.isempty():
-            ut.output("unable to find key {}. db is empty.")
+            ut.output("unable to find val {}. db is empty.".format(val))
             return None
         if not self.__validatefile():
-            ut.output("unable to find key {}. file not valid.".format(key))
+            ut.output("unable to find val {}. file not valid.".format(val))
             return None
 
         # get the index of the desiered field
@@ -242,34 +489,14 @@ class database:
         if type(val) != ft:
             ut.output("unable to find val {}. field type is {} and val is {}.".format(val, type(val), ft))
             return 1
-            
-        # check all rows in file for val in field
-        r = dict()
-        nl = self.__getfilenumlines()
-        self.__file.seek(0)
-        i = 0
-        while i < nl: # loop through lines
-            if i in range(5): self.__file.readline(); i += 1; continue # skip metadata lines
-
-            # read line in file
-            l = self.__file.readline()
-            l = ut.stripnewlines(l)
-            row = self.__deserializerow(l)
-            if row == None:
-                ut.output("an error occured during findval op. failed to deserailze row {} in file.".format(i))
-            else:
-                if row.data[fi] == val:
-                    r[row.key] = row.data
-            i += 1
-
-        # check cache for desiered val
-        for k in self.__cache.keys():
-            y = self.__cache[k][fi]
-            if y == val:
-                r[k] = self.__cache[k] # add cache entry to dict
 
+        r = dict()
+        for row in self.__itermatches(fi, val):
+            r[row.key] = row.data
         return r
 
+    @instrumented
+    @readlocked
     def findall(self) -> dict:
         # preform checks
         if not self.isopen():
@@ -282,94 +509,112 @@ class database:
             ut.output("unable to find all rows. file not valid.")
             return None
 
-        # iterate through file first
-        nl = self.__getfilenumlines()
-        self.__file.seek(0)
         r = dict()
-        i = 0
-        while i < nl:
-            # TODO: possibley use a yield statement here
-            if i in range(5): self.__file.readline(); i += 1; continue 
-
-            l = self.__file.readline()
-            l = ut.stripnewlines(l)
-            row = self.__deserializerow(l)
-            if row == None:
-                ut.output("an error occured during findall op. failed to deserailze row {} in file.".format(i))
-            else:
+        rows = self.__parallelscan(None)
+        if rows != None:
+            for row, size in rows:
                 r[row.key] = row.data
+            for k, d in self.__cache.items():
+                if d != None:
+                    r[k] = d
+            return r
 
-            i += 1
+        for row in self.iterall():
+            r[row.key] = row.data
+        return r
 
-        # then cache and update any entries that are incorrect in file
-        for k in self.__cache.keys():
-            r[k] = self.__cache[k]
+    # function: iterate over every live row in the db, rows in file then rows in cache
+    #  - rows are read one at a time, memory use does not grow with the db
+    #  - rows changed while iterating may or may not be seen
+    # return: a generator of Row objects
+    def iterall(self):
+        if not self.isopen():
+            ut.output("unable to iterate rows. db is not open.")
+            return
+
+        for row, size in self.__iterfilerows():
+            yield row
+
+        # snapshot the keys, the cache may change while the caller holds a row
+        for k in list(self.__cache.keys()):
+            d = self.__cache.get(k)
+            if d != None:
+                yield Row(k, d)
+
+    # function: iterate over the rows with val in field
+    #  - uses a secondary index on the field if there is one
+    # return: a generator of Row objects
+    def iterval(self, field, val):
+        if not self.isopen():
+            ut.output("unable to iterate val {}. no db is open.".format(val))
+            return
 
-        return r
+        # get the index of the desiered field
+        try:
+            fi = self.__schema.fieldids.index(field)
+        except ValueError:
+            ut.output("unable to iterate val {}. field is invalid.".format(field))
+            return
 
-    def update(self, key, field, val):
-        # check the cache
-        if key in self.__cache.keys():
-            # get data of row in list form
-            l = list(self.__cache[key])
+        # ensure val is the same type as the field
+        if type(val) != self.__schema.fieldtypes[fi]:
+            ut.output("unable to iterate val {}. field type is {} and val is {}.".format(val, self.__schema.fieldtypes[fi], type(val)))
+            return
 
-            # get the index of the desiered field
-            fi = 0
-            try:
-                fi = self.__schema.fieldids.index(field)
-            except ValueError:
-                ut.output("unable to find val {}. field is invalid.".format(field))
-                return None
+        yield from self.__itermatches(fi, val)
 
-            # ensure val is the same type as field
-            ft = self.__schema.fieldtypes[fi]
-            if type(val) != ft:
-                ut.output("unable to update key {}. field and val are not the same type.")
-                return 1
+    # function: change one field of a row
+    #  - rows in file are pulled into cache and written out on the next flush
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @writelocked
+    def update(self, key, field, val):
+        # get data of row in list form (cache first, then file)
+        d = self.__getrow(key)
+        if d == None:
+            ut.output("unable to update key {}. key does not exist.".format(key))
+            return 1
+        l = list(d)
 
-            # rewrite new data
-            l[fi] = val
-            self.__cache[key] = tuple(l)
-        else: # check in file
-            # find the line in file
-            self.__file.seek(0)
-            ln = 0 # line number
-            lp = 0 # last pos of file
-            for l in self.__file:
-                if ln in range(5): self.__file.readline(); ln += 1; continue # skip metadata
-
-                # get the key of the line
-                ls = l.split(",")
-                k = int()
-                try:
-                    k = int(ls[0])
-                except:
-                    ut.output("unable to update key {}. key in file not valid.".format(key))
-                    return 1
+        # get the index of the desiered field
+        fi = 0
+        try:
+            fi = self.__schema.fieldids.index(field)
+        except ValueError:
+            ut.output("unable to update key {}. field {} is invalid.".format(key, field))
+            return 1
 
-                # is this the key we are looking for?
-                if k == key:
-                    # get the data in list form
-                    r = self.__deserializerow(l)
-                    if r == None:
-                        ut.output("unable to update key {}. failed to deserialize row.")
-                        return 1
-                    
-                    d = list(r.data)
-
-                ln += 1
-                lp = self.__file.tell()
-
-                    
-            # change data
-            # delete key
-            # re-add key
-            ln += 1
-            NotImplemented
-        return None
+        # ensure val is the same type as field
+        ft = self.__schema.fieldtypes[fi]
+        if type(val) != ft:
+            ut.output("unable to update key {}. field and val are not the same type.".format(key))
+            return 1
 
-    # TODO: uodate the search method. line by line and dump only updated rows into file
-    # TODO: idea... make a row container (or cache line container so only dirty rows are thrown into file)
+        # rewrite new data
+        l[fi] = val
+        if not self.__codec.check(tuple(l)):
+            ut.output("unable to update key {}. val can not be stored in the file format.".format(key))
+            return 1
+        if not self.__checksize(tuple(l)):
+            ut.output("unable to update key {}. row is too big for the file format.".format(key))
+            return 1
+        if self.__logput(key, tuple(l)) != 0:
+            ut.output("unable to update key {}. failed to log change.".format(key))
+            return 1
+        self.__indexrow(key, d, tuple(l))
+        self.__cache[key] = tuple(l)
+        self.__readcache.invalidate(key)
+        self.__columns = None
+        return 0
+
+    # function: write the cache to file
+    #  - new and modified rows are appended to the end of the file
+    #  - deleted rows get a tombstone appended
+    #  - in a paged file the rows are written into pages instead, see pagestore
+    #  - only the counters in the header are rewritten
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @writelocked
     def flush(self) -> int:
         if not self.isopen():
             ut.output("unable to flush cache. no db is open.")
@@ -377,92 +622,430 @@ class database:
         if self.__iscacheempty():
             ut.output("unable to flush cache. cahce is empty.")
             return 1
-        
-        # lines in the new file
-        nd = list()
 
-        # itr thru every line in file
-        nl = self.__getfilenumlines()
-        self.__file.seek(0)
-        i = 0
-        while i < nl:
-            if i in range(5): self.__file.readline(); i += 1; continue
-
-            od = self.__file.readline()
-            od = od.replace("\n", "")
-            k = int(od.split(",")[0])
-            
-            # see if its in cache
-            if k in self.__cache.keys():
-                if self.__cache[k] == None:
-                    self.__cache.popitem(k) # done with this cache line
-                else:
-                    # build new line from data
-                    newline = self.__serializerow(k, self.__cache[k])
-                    self.__cache.popitem(k) # done with this cache line
-            else:
-                nd.append(od)
-                pass
-            i += 1
+        # the counters written below must not undo keys another process handed out
+        self.__synckeygen()
 
-        # clean up remaining cache
+        # build the delta, bail out before touching the file if any row fails to serialize
+        nd = list()
         for k in self.__cache.keys():
             if self.__cache[k] == None:
-                pass
+                rec = self.__format.encodetombstone(k)
             else:
-                # build data from cache line data
-                d = self.__serializerow(k, self.__cache[k])
-                nd.append(d)
+                rec = self.__serializerow(k, self.__cache[k])
+            if rec == None:
+                ut.output("unable to flush cache. failed to serialize key {}.".format(k))
+                return 1
+            nd.append((k, rec))
+
+        # append the delta (or write it into its pages)
+        if self.__appendrecords(nd) != 0:
+            ut.output("unable to flush cache. failed to write the rows to file.")
+            return 1
 
         # clear cache
         self.__cache = dict()
 
-        # clear file
-        self.__file.seek(0)
+        # patch the counters in the header, a header that is not fixed-size means
+        # an old file and the whole thing has to be rewritten
+        if self.__writecounters() != 0:
+            return self.compact()
 
-        # write metadata to file ----------
+        self.__bumpgeneration()
+        self.__file.flush()
+        self.__remap()
+        self.__checkpoint()
+        self.__saveindexes()
 
-        # numfields
-        s = "{}\n".format(self.__schema.numfields)
-        print(s, end="")
-        self.__file.write(s)
+        # with a background compactor the flush does not wait on a compaction
+        if self.__compactor == None and self.__shouldcompact():
+            return self.compact()
 
-        # fieldids
-        for fieldid in self.__schema.fieldids:
-            s = "{},".format(fieldid)
-            print(s, end="")
-            self.__file.write(s)
-        self.__file.write("\n")
-
-        # field types
-        for ft in self.__schema.fieldtypes:
-            s = str()
-            if ft == str:
-                s = "str,"
-            elif ft == int:
-                s = "int,"
-            elif ft == float:
-                s = "float,"
-            self.__file.write(s)
-        self.__file.write("\n")
-
-        # keygen
-        s = "{}\n".format(self.__keygen)
-        self.__file.write(s)
-
-        # num rows
-        s = "{}\n".format(self.__numrows)
-        self.__file.write(s)
-
-        # write new data to file
-        for x in nd:
-            self.__file.write("{}\n".format(x))
+        return 0
 
-        self.__file.flush()
+    # function: rewrite the file with only the live rows
+    #  - drops old versions of modified rows and tombstones
+    #  - flushes the cache first
+    #  - the rows are written to a temp file that is renamed over the db file, so a
+    #    crash leaves either the old file or the new one. other processes sharing
+    #    the file with multiprocess see it was replaced and open the new one
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @writelocked
+    def compact(self) -> int:
+        if not self.isopen():
+            ut.output("unable to compact db. no db is open.")
+            return 1
+        if not self.__iscacheempty():
+            if self.flush() != 0:
+                return 1
+        self.__synckeygen()
+
+        # records in the new file
+        nd = [(self.__format.recordkey(rec), rec) for pos, rec in self.__iterlive()]
+
+        tmp = self.__filename + ".compact"
+        try:
+            f = open(tmp, "wb+")
+        except OSError:
+            ut.output("unable to compact db. unable to create {}.".format(tmp))
+            return 1
+
+        try:
+            # write metadata and live data to the new file, recording where each row lands
+            self.__format.writeheader(f, self.__schema, self.__keygen, self.__numrows)
+            dataoffset = f.tell()
+            b, offsets = self.__format.packrecords([rec for k, rec in nd], dataoffset)
+            f.write(b)
+            self.__recorder.addwritten(len(b))
+
+            # the new file carries on the generation of the old one
+            g = self.__format.readgeneration(self.__file)
+            if g != None:
+                self.__format.writegeneration(f, g + 1)
+            f.flush()
+            os.fsync(f.fileno())
+        except OSError:
+            ut.output("unable to compact db. failed to write {}.".format(tmp))
+            f.close()
+            os.remove(tmp)
+            return 1
+
+        # nobody else can see the new file yet, so its lock is taken right away. the
+        # old file is only let go once the rename is done, so a process waiting on
+        # it always finds it replaced
+        if self.__multiprocess:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        os.replace(tmp, self.__filename)
+        self.__syncdir()
+        if self.__multiprocess:
+            self.__lock.movefile(f.fileno())
+        self.__file.close()
+        self.__file = f
+        self.__writes += 1
+        if self.__pool != None:
+            self.__pool.reset(f.fileno())
+
+        self.__dataoffset = dataoffset
+        self.__index.clear()
+        for (k, rec), pos in zip(nd, offsets):
+            self.__index.set(k, pos)
+        if self.__pages != None:
+            self.__pages = pagestore(dataoffset, self.__pool)
+        self.__remap()
+        self.__checkpoint()
+        self.__saveindexes()
 
         return 0
 
+    # function: find the rows with a numeric field in a range
+    #  - uses a range index on the field if there is one, otherwise scans the file
+    # field: the id of an int or float field
+    # lo, hi: inclusive bounds, None for no bound
+    # return: a dict of key -> data (ordered by field when indexed), None on fail
+    @instrumented
+    @readlocked
+    def findrange(self, field, lo, hi) -> dict:
+        # preform checks
+        if not self.isopen():
+            ut.output("unable to find range on {}. no db is open.".format(field))
+            return None
+        if self.isempty():
+            ut.output("unable to find range on {}. db is empty.".format(field))
+            return None
+
+        # get the index of the desiered field
+        try:
+            fi = self.__schema.fieldids.index(field)
+        except ValueError:
+            ut.output("unable to find range on {}. field is invalid.".format(field))
+            return None
+
+        # only numeric fields have a meaningful order
+        if self.__schema.fieldtypes[fi] not in (int, float):
+            ut.output("unable to find range on {}. field is not numeric.".format(field))
+            return None
+        for b in (lo, hi):
+            if b != None and type(b) not in (int, float):
+                ut.output("unable to find range on {}. bound {} is not a number.".format(field, b))
+                return None
+
+        idx = self.__fieldindexes.get((field, "range"))
+        if idx != None:
+            return self.__findkeys(idx.range(lo, hi))
+
+        # no index, check every row
+        r = dict()
+        w = (fi, lo, hi, False)
+        rows = self.__parallelscan(w)
+        if rows != None:
+            for row, size in rows:
+                r[row.key] = row.data
+            rows = (Row(k, d) for k, d in list(self.__cache.items()) if d != None)
+        else:
+            rows = self.iterall()
+        for row in rows:
+            if parallelscan.matchwhere(w, row.data):
+                r[row.key] = row.data
+        return r
+
+    # function: compute an aggregate over the rows in a single pass
+    #  - rows are streamed from file then cache and folded into the result one at
+    #    a time, they are never collected
+    #  - a where on an indexed field only reads the matching rows
+    #  - with columnar, the columns are aggregated instead
+    # op: one of AGGREGATEOPS
+    # field: the id of the field to aggregate (not needed for count)
+    # groupby: the id of a field to group by, None for one result over every row
+    # where: only use rows where a field matches, either (fieldid, val) or
+    #  (fieldid, lo, hi) with inclusive bounds on a numeric field (None for no bound)
+    # return: the result, a dict of group value -> result with groupby, None on fail
+    #  - sum, avg, min and max of no rows are None
+    @instrumented
+    @readlocked
+    def aggregate(self, op, field=None, groupby=None, where=None):
+        # preform checks
+        if not self.isopen():
+            ut.output("unable to aggregate {}. no db is open.".format(field))
+            return None
+        if op not in AGGREGATEOPS:
+            ut.output("unable to aggregate {}. {} is not a valid op.".format(field, op))
+            return None
+
+        fi = None
+        if op != "count" or field != None:
+            try:
+                fi = self.__schema.fieldids.index(field)
+            except ValueError:
+                ut.output("unable to aggregate {}. field is invalid.".format(field))
+                return None
+            if op in ("sum", "avg") and self.__schema.fieldtypes[fi] not in (int, float):
+                ut.output("unable to {} {}. field is not numeric.".format(op, field))
+                return None
+
+        gfi = None
+        if groupby != None:
+            try:
+                gfi = self.__schema.fieldids.index(groupby)
+            except ValueError:
+                ut.output("unable to aggregate {}. groupby field {} is invalid.".format(field, groupby))
+                return None
+
+        w = None
+        if where != None:
+            w = self.__parsewhere(where)
+            if w == None:
+                return None
+
+        # an index on the where field gives the keys of the rows to read
+        keys = None
+        if w != None:
+            keys = self.__wherekeys(w)
+            if keys != None and op == "count" and gfi == None:
+                return len(keys)
+
+        # otherwise the columns can answer it without touching any row
+        cs = self.__getcolumns() if keys == None else None
+        if cs != None:
+            positions = None
+            if w != None:
+                wfi, lo, hi, eq = w
+                positions = cs.match(wfi, lo) if eq else cs.between(wfi, lo, hi)
+            if fi == None:
+                fi = 0
+            if gfi != None:
+                return cs.groupby(gfi, op, fi, positions)
+            return cs.reduce(op, fi, positions)
+
+        if keys != None:
+            rows = (Row(k, d) for k, d in ((k, self.__getrow(k)) for k in keys) if d != None)
+        elif w != None and w[3]:
+            rows = self.__itermatches(w[0], w[1])
+        elif w != None:
+            rows = (row for row in self.iterall() if (w[1] == None or row.data[w[0]] >= w[1]) and (w[2] == None or row.data[w[0]] <= w[2]))
+        else:
+            rows = self.iterall()
+        return self.__fold(op, fi, gfi, rows)
+
+    # function: count the rows in the db, or the rows with val in a field
+    # field: the id of the field to match, None to count every row
+    # return: the number of rows, -1 on fail
+    def count(self, field=None, val=None) -> int:
+        if field == None and self.isopen():
+            return self.__numrows
+        r = self.aggregate("count", where=None if field == None else (field, val))
+        return -1 if r == None else r
+
+    # function: add up a numeric field over every row
+    # return: the total, None if the db is empty or on fail
+    def sum(self, field):
+        return self.aggregate("sum", field)
+
+    # function: get the smallest value of a field
+    # return: the smallest value, None if the db is empty or on fail
+    def min(self, field):
+        return self.aggregate("min", field)
+
+    # function: get the largest value of a field
+    # return: the largest value, None if the db is empty or on fail
+    def max(self, field):
+        return self.aggregate("max", field)
+
+    # function: aggregate a field for each value of another field
+    # field: the id of the field to group by
+    # op: one of AGGREGATEOPS
+    # aggfield: the id of the field to aggregate (not needed for count)
+    # return: a dict of group value -> result, None on fail
+    def groupby(self, field, op="count", aggfield=None) -> dict:
+        return self.aggregate(op, aggfield, groupby=field)
+
+    # function: build a secondary index over a field
+    #  - hash indexes answer findval, range indexes answer findrange (and findval)
+    #  - the index is kept up to date by every change and saved on flush
+    # fieldid: the id of the field to index
+    # kind: "hash" or "range" (range only for int and float fields)
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @writelocked
+    def createindex(self, fieldid, kind="hash") -> int:
+        if not self.isopen():
+            ut.output("unable to create index on {}. no db is open.".format(fieldid))
+            return 1
+        if fieldid not in self.__schema.fieldids:
+            ut.output("unable to create index on {}. field is invalid.".format(fieldid))
+            return 1
+        if kind not in FIELDINDEXES:
+            ut.output("unable to create index on {}. {} is not a valid kind.".format(fieldid, kind))
+            return 1
+        if kind == "range" and self.__schema.fieldtypes[self.__schema.fieldids.index(fieldid)] not in (int, float):
+            ut.output("unable to create range index on {}. field is not numeric.".format(fieldid))
+            return 1
+        if (fieldid, kind) in self.__fieldindexes:
+            return 0
+
+        idx = FIELDINDEXES[kind](fieldid)
+        if self.__fillfieldindexes([idx]) != 0:
+            return 1
+        self.__fieldindexes[(fieldid, kind)] = idx
+
+        # unflushed rows are in the index, so it can only be saved once they are in file
+        if self.__iscacheempty():
+            idx.save(self.__fieldindexfilename(fieldid, kind), self.__getfilestamp())
+        return 0
+
+    # function: remove a secondary index from a field
+    # return: 0 on sucess, 1 if there is no such index on the field
+    @instrumented
+    @writelocked
+    def dropindex(self, fieldid, kind="hash") -> int:
+        if (fieldid, kind) not in self.__fieldindexes:
+            ut.output("unable to drop {} index on {}. field is not indexed.".format(kind, fieldid))
+            return 1
+        del self.__fieldindexes[(fieldid, kind)]
+        removesidecar(self.__fieldindexfilename(fieldid, kind))
+        return 0
+
+    # function: import rows from a csv or jsonl file
+    #  - the file is streamed in chunks, each chunk is added with one addrows call
+    #  - csv files need a header row naming the fields, jsonl lines are objects
+    #  - values are converted to the field types, rows that do not fit the schema
+    #    or can not be stored in the file format are skipped
+    #  - a "key" column is ignored, new keys are assigned
+    # path: the name of the file to import
+    # format: "csv" or "jsonl"
+    # chunksize: most rows to hold in memory at once
+    # return: the number of rows imported, -1 on fail
+    @instrumented
+    def importfile(self, path, format, chunksize=10000) -> int:
+        if not self.isopen():
+            ut.output("unable to import {}. no db is open.".format(path))
+            return -1
+        if format not in dataio.IOFORMATS:
+            ut.output("unable to import {}. {} is not a valid format.".format(path, format))
+            return -1
+
+        # the same checks addrows makes, so one bad row does not fail its chunk
+        def check(data):
+            return self.__checkdata(data) and self.__checksize(data)
+
+        n = 0
+        t = time.perf_counter()
+        try:
+            with open(path, "r", newline="") as f:
+                for chunk in dataio.readchunks(f, format, self.__schema, chunksize, check):
+                    if self.addrows(chunk) == None:
+                        ut.output("unable to import {}. failed after {} rows.".format(path, n))
+                        return -1
+                    n += len(chunk)
+        except OSError:
+            ut.output("unable to import {}. unable to read file.".format(path))
+            return -1
+
+        t = time.perf_counter() - t
+        ut.log(ut.INFO, "imported {} rows in {:.2f}s ({:.0f} rows/sec).", n, t, n / t if t > 0 else 0)
+        return n
+
+    # function: export every row to a csv or jsonl file
+    #  - rows are streamed out one at a time
+    #  - the key of each row is written as a "key" column
+    # path: the name of the file to write
+    # format: "csv" or "jsonl"
+    # return: the number of rows exported, -1 on fail
+    @instrumented
+    @readlocked
+    def exportfile(self, path, format) -> int:
+        if not self.isopen():
+            ut.output("unable to export {}. no db is open.".format(path))
+            return -1
+        if format not in dataio.IOFORMATS:
+            ut.output("unable to export {}. {} is not a valid format.".format(path, format))
+            return -1
+
+        t = time.perf_counter()
+        try:
+            with open(path, "w", newline="") as f:
+                n = dataio.writerows(f, format, self.__schema, self.iterall())
+        except OSError:
+            ut.output("unable to export {}. unable to write file.".format(path))
+            return -1
+
+        t = time.perf_counter() - t
+        ut.log(ut.INFO, "exported {} rows in {:.2f}s ({:.0f} rows/sec).", n, t, n / t if t > 0 else 0)
+        return n
+
+    # function: write the db (including cache) to a new file in another format
+    #  - rows are streamed across one at a time
+    # filename: the name of the new db file
+    # format: the format of the new file ("binary", "text" or "paged")
+    # return: 0 on sucess, 1 on fail
+    @instrumented
+    @readlocked
+    def convert(self, filename, format="binary") -> int:
+        if not self.isopen():
+            ut.output("unable to convert db. no db is open.")
+            return 1
+        if format not in FORMATS:
+            ut.output("unable to convert db. {} is not a valid format.".format(format))
+            return 1
+        if os.path.exists(filename):
+            ut.output("unable to convert db. {} already exists.".format(filename))
+            return 1
+
+        fmt = FORMATS[format]()
+        try:
+            f = open(filename, "xb")
+        except:
+            ut.output("unable to create file {}.".format(filename))
+            return 1
+
+        with f:
+            r = self.__convertrows(f, fmt)
+        if r != 0:
+            os.remove(filename)
+        return r
+
     # function: set the schema of this db
+    #  - compiles the row codec of the file format for the schema
     # schema: the new schema
     # return: 1 on fail, 0 on sucess
     def setschema(self, schema) -> int:
@@ -470,6 +1053,8 @@ class database:
             ut.output("cannot change the schema of a non-empty db.")
             return 1
         self.__schema = schema
+        if self.__format != None:
+            self.__codec = self.__format.compile(schema)
         return 0
 
     # function: get the current schema of the db
@@ -482,6 +1067,62 @@ class database:
     def getnumrows(self) -> int:
         return self.__numrows
 
+    # function: get how many records in file are dead (old versions of rows and
+    #  tombstones), compact drops them
+    def getdeadrows(self) -> int:
+        return self.__index.getdead()
+
+    # function: get the hit/miss counters and size of the read cache
+    # return: a dict with hits, misses, rows and bytes
+    def getcachestats(self) -> dict:
+        return self.__readcache.getstats()
+
+    # function: get the stats recorded since open (or the last resetstats)
+    #  - "ops" has, for each method called, the number of calls, total, mean and
+    #    max seconds, p50/p90/p99 seconds (from a log2 histogram) and the histogram
+    #  - bytesread and byteswritten count records read from and written to the db
+    #    file, rowsdecoded the records decoded into rows (all in this process,
+    #    parallel scan workers are not counted)
+    #  - "cache" is getcachestats, "pool" the stats of the buffer pool if there is one
+    # return: a dict of stats
+    def stats(self) -> dict:
+        r = self.__recorder.snapshot()
+        r["cache"] = self.__readcache.getstats()
+        if self.__pool != None:
+            r["pool"] = self.__pool.getstats()
+        return r
+
+    def resetstats(self):
+        self.__recorder.reset()
+
+    # function: turn timing of each call on or off
+    #  - the counters of bytes and rows are kept either way
+    def setstats(self, enabled):
+        self.__recorder.setenabled(enabled)
+
+    # function: set a profiler to wrap every call made on the db
+    # profiler: a function taking the name of the method called and returning a
+    #  context manager entered around the call, None to remove it
+    def setprofiler(self, profiler):
+        self.__recorder.setprofiler(profiler)
+
+    # function: get the statsrecorder of the db (used by the instrumented decorator)
+    def getrecorder(self) -> statsrecorder:
+        return self.__recorder
+
+    # function: get the lock of the db
+    #  - hold it to make several calls atomic, e.g. with db.getlock().writing()
+    # return: an rwlock if the db was opened with threadsafe, otherwise a lock that does nothing
+    def getlock(self):
+        return self.__lock
+
+    # function: get the name of the on-disk format of the db
+    # return: "text", "binary" or "paged", None if no db is open
+    def getformat(self) -> str:
+        if self.__format == None:
+            return None
+        return self.__format.name
+
     def isopen(self) -> bool:
         if self.__file == None or self.__file.closed:
             return False
@@ -498,66 +1139,188 @@ class database:
             return True
         return False
 
+    # function: check that a data tuple conforms to the schema
+    #  - and that the file format can store its values, see the codecs' check
+    # return: True if data has a value of the right type for every field
+    def __checkdata(self, data) -> bool:
+        if len(data) != self.__schema.numfields:
+            return False
+        for x, ft in zip(data, self.__schema.fieldtypes):
+            if type(x) != ft:
+                return False
+        return self.__codec.check(data)
+
+    # function: check that a row fits in a record of the file format
+    #  - assumes data conforms to the schema
+    def __checksize(self, data) -> bool:
+        if self.__format.maxrecord == None:
+            return True
+        return len(self.__serializerow(0, data)) <= self.__format.maxrecord
+
     # function: serialize a row given the key and the data
     #  - assumes data conforms to the schema
-    # return: a serialized string according to the schema
-    def __serializerow(self, key, data) -> str:
-        s = str(key)
-        i = 0
-        while i < self.__schema.numfields:
-            s += "," + str(data[i])
-            i += 1
-        return s
-
-    # function: create a Row from a string
-    # return: a Row object with the dat from the string on sucess, None on fail
-    def __deserializerow(self, string) -> Row:
-        ss = string.split(",")
-        
-        # check schema
-        if len(ss) != self.__schema.numfields + 1:
-            ut.output("unable to deserialize row string \"{}\". invalid schema.".format(string))
-            return None
-
-        # parse key section
-        k = 0
+    # return: a raw record in the format of the file, None on fail
+    def __serializerow(self, key, data) -> bytes:
+        return self.__codec.encode(key, data)
+
+    # function: create a Row from a raw record
+    # return: a Row object with the data from the record on sucess, None on fail
+    def __deserializerow(self, rec) -> Row:
+        self.__recorder.adddecoded(1)
+        r = self.__codec.decode(rec)
+        if r == None:
+            return None
+        return Row(r[0], r[1])
+
+    # function: iterate over the raw records in file
+    #  - reads through its own file handle (or the memory map, or the buffer pool)
+    #    so the db can be used while iterating
+    # return: a generator of (offset, record) tuples
+    def __iterrecords(self):
+        n = 0
         try:
-            k = int(ss[0])
-            del ss[0] # we are done with this now
-        except:
-            ut.output("unable to parse key \"{}\". invalid format.".format(ss[0]))
-            return None
-
-        # parse data section
-        d = []
-        i = 0
-        while i < self.__schema.numfields:
-            if self.__schema.fieldtypes[i] == "int":
-                try:
-                    x = int(ss[0])
-                    d.append(x)
-                    del ss[0] # we are done with this now
-                except:
-                    ut.output("unable to parse data {} as int. invalid type.".format(ss[0]))
-                    return None
-            elif self.__schema.fieldtypes[i] == "float":
-                try:
-                    x = float(ss[0])
-                    d.append(x)
-                    del ss[0] # we are done with this now
-                except:
-                    ut.output("unable to parse data {} as float. invalid type.".format(ss[0]))
-                    return None
-            # any other type treat as string FIXME: add more types
+            if self.__map != None:
+                # records are found with find/unpack on the map, no line reads
+                for pos, rec in self.__format.iterbuffer(self.__map, self.__dataoffset):
+                    n += len(rec)
+                    yield (pos, rec)
+                return
+
+            self.__file.flush()
+            f = self.__pool.reader() if self.__pool != None else open(self.__filename, "rb")
+            with f:
+                for pos, rec in self.__format.iterrecords(f, self.__dataoffset):
+                    n += len(rec)
+                    yield (pos, rec)
+        finally:
+            self.__recorder.addread(n)
+
+    # function: read the record that starts at an offset in file
+    #  - positional reads, the shared file handle is never moved so readers in
+    #    other threads are not disturbed
+    #  - goes through the buffer pool if there is one
+    # return: the raw record, None at the end of the file (or on a torn record)
+    def __readrecordat(self, pos) -> bytes:
+        fd = self.__file.fileno()
+        n = READSIZE
+        if self.__pool != None:
+            # the rest of the block first, most records do not run into the next one
+            n -= pos % BLOCKSIZE
+        while True:
+            b = self.__pool.read(pos, n) if self.__pool != None else os.pread(fd, n, pos)
+            end = self.__format.recordend(b, 0)
+            if end > 0:
+                self.__recorder.addread(end)
+                return b[:end]
+            if len(b) < n:
+                return None
+            n *= 2
+
+    # function: append raw records to the end of the file with a single write
+    #  - points the index at each row, tombstones are not indexed
+    #  - a paged file has the records written into its pages instead
+    # nd: a list of (key, record) tuples
+    #  - counts the records this makes dead: the versions in file that are replaced,
+    #    and each tombstone along with the row it deletes
+    # return: 0 on sucess, 1 on fail
+    def __appendrecords(self, nd) -> int:
+        self.__writes += 1
+        if self.__pages != None:
+            n = self.__pages.write(self.__file, nd, self.__index, self.__deleted, self.__format,
+                                   self.__fsmfilename(), self.__getfilestamp())
+            if n < 0:
+                return 1
+            for k, rec in nd:
+                self.__readcache.invalidate(k)
+            self.__recorder.addwritten(n)
+            return 0
+
+        self.__file.seek(0, 2)
+        pos = self.__file.tell()
+        dead = 0
+        for k, rec in nd:
+            if self.__format.istombstone(rec):
+                dead += 2
             else:
-                x = ss[0]
-                d.append(x)
-                del ss[0] # we are done with this now
+                old = self.__index.get(k)
+                if old != None and old >= 0:
+                    dead += 1
+                self.__index.set(k, pos)
+            self.__readcache.invalidate(k)
+            pos += len(rec)
+        b = b"".join(rec for k, rec in nd)
+        if self.__pool != None:
+            # the cached block at the end of the file takes its part of the append
+            self.__pool.write(pos - len(b), b, cache=False)
+            self.__pool.flush()
+        else:
+            self.__file.write(b)
+        self.__recorder.addwritten(len(b))
+        self.__index.setdead(self.__index.getdead() + dead)
+        return 0
 
-            i += 1
-        
-        # create row named tuple
-        return Row(k, d)
+    # function: write every row to a new file in another format
+    #  - fails rather than leave out a row that can not be read or stored
+    # return: 0 on sucess, 1 on fail
+    def __convertrows(self, f, fmt) -> int:
+        fmt.writeheader(f, self.__schema, self.__keygen, self.__numrows)
+        codec = fmt.compile(self.__schema)
+        recs = list()
+        n = 0
+        for row in self.iterall():
+            if not codec.check(row.data):
+                ut.output("unable to convert db. key {} can not be stored as {}.".format(row.key, fmt.name))
+                return 1
+            recs.append(codec.encode(row.key, row.data))
+            n += 1
+            if len(recs) >= CONVERTROWS:
+                if self.__writerecords(f, fmt, recs) != 0:
+                    return 1
+                recs = list()
+        if self.__writerecords(f, fmt, recs) != 0:
+            return 1
+        if n != self.__numrows:
+            ut.output("unable to convert db. only {} of {} rows could be read.".format(n, self.__numrows))
+            return 1
+        return 0
+
+    # function: write records to the end of a new file in a format
+    # return: 0 on sucess, 1 if a record does not fit the format
+    def __writerecords(self, f, fmt, recs) -> int:
+        p = fmt.packrecords(recs, f.tell())
+        if p == None:
+            ut.output("unable to write {}. a row is too big for the file format.".format(f.name))
+            return 1
+        f.write(p[0])
+        return 0
+
+    # function: iterate over the live rows in file that the cache does not override
+    # return: a generator of (Row, size of record) tuples
+    def __iterfilerows(self):
+        for pos, rec in self.__iterlive():
+            if self.__format.recordkey(rec) in self.__cache.keys():
+                continue # the cache holds a newer version of this row
+            row = self.__deserializerow(rec)
+            if row == None:
+                ut.log(ut.WARNING, "an error occured while iterating rows. failed to deserailze row at {} in file.", pos)
+                continue
+            yield (row, len(rec))
+
+    # function: iterate over the live records in file
+    #  - skips tombstones and rows that have a newer version later in the file
+    # return: a generator of (offset, record) tuples
+    def __iterlive(self):
+        for pos, rec in self.__iterrecords():
+            if self.__index.get(self.__format.recordkey(rec)) == pos:
+                yield (pos, rec)
+
+    # function: map the file again after it has changed size
+    #  - a scan still holding the old map keeps reading it until it finishes
+    def __remap(self):
+        if not self.__usemmap:
+            return
+        self.__file.flush()
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
 
     # function: gets a new key according to the current keygen
     # return: a new & unused key on sucess, -1 on failure
@@ -566,26 +1329,610 @@ class database:
             ut.output("unable to gen key. invalid keygen.")
             return -1
 
+        self.__synckeygen()
         self.__keygen += 1
+
+        # other processes must not hand out the same key before this row is flushed
+        if self.__multiprocess:
+            self.__writecounters()
         return self.__keygen
 
-    # function: get the numlines in the db file
-    # return: numlines in file on sucess, 0 on fail/empty file
-    def __getfilenumlines(self):
-        if self.__file == None or self.__file.closed:
-            ut.output("unable to get num lines in file. file closed.")
+    # function: move keygen past any key another process has handed out
+    def __synckeygen(self):
+        if not self.__multiprocess:
+            return
+        c = self.__format.readcounters(self.__file)
+        if c != None and c[0] > self.__keygen:
+            self.__keygen = c[0]
+
+    # function: get the (size, mtime) of the db file
+    #  - used to tell if the index sidecar still matches the file
+    def __getfilestamp(self):
+        st = os.fstat(self.__file.fileno())
+        return (st.st_size, st.st_mtime_ns)
+
+    def __indexfilename(self) -> str:
+        return self.__filename + ".idx"
+
+    def __fsmfilename(self) -> str:
+        return self.__filename + ".fsm"
+
+    # function: get the name of the write-ahead log
+    #  - each db sharing the file with multiprocess has its own log, named by the
+    #    pid and a number unique to the open db within the process
+    def __walfilename(self) -> str:
+        if self.__multiprocess:
+            return "{}.{}-{}.wal".format(self.__filename, os.getpid(), self.__walid)
+        return self.__filename + ".wal"
+
+    # function: open the write-ahead logs of processes that exited without flushing
+    # return: a list of writeaheadlog objects
+    def __orphanwals(self) -> list:
+        r = list()
+        fns = glob.glob(glob.escape(self.__filename) + ".*.wal")
+        fns.append(self.__filename + ".wal")
+        for fn in fns:
+            pid = fn[len(self.__filename) + 1:-len(".wal")].split("-")[0]
+            if pid == "" and not os.path.exists(fn):
+                continue
+            if pid != "":
+                if not pid.isdigit() or int(pid) == os.getpid() or ut.isalive(int(pid)):
+                    continue
+            w = writeaheadlog(fn)
+            if w.open() == 0:
+                r.append(w)
+        return r
+
+    def __fieldindexfilename(self, fieldid, kind) -> str:
+        return "{}.{}.{}idx".format(self.__filename, fieldid, kind[0])
+
+    # function: get the version of the file as it is now
+    #  - the generation counter in the header, bumped by every write
+    #  - text files have none, their (size, mtime) is used instead
+    def __getversion(self):
+        g = self.__format.readgeneration(self.__file)
+        if g != None:
+            return g
+        return self.__getfilestamp()
+
+    # function: bump the generation counter so other processes see the file changed
+    def __bumpgeneration(self):
+        g = self.__format.readgeneration(self.__file)
+        if g != None:
+            self.__format.writegeneration(self.__file, g + 1)
+            self.__headerwritten()
+
+    # function: patch keygen and numrows in the header
+    # return: 0 on sucess, 1 if the header is not fixed-size
+    def __writecounters(self) -> int:
+        r = self.__format.writecounters(self.__file, self.__keygen, self.__numrows)
+        if r == 0:
+            self.__headerwritten()
+        return r
+
+    # function: the header was written through the file, push it out and drop the
+    #  blocks of it the buffer pool holds
+    #  - a frame of the first block also holds rows of a small file, an append
+    #    flushing it would otherwise put the old header back
+    def __headerwritten(self):
+        self.__file.flush()
+        if self.__pool != None:
+            self.__pool.invalidate(0, self.__dataoffset)
+
+    def __haschanged(self) -> bool:
+        return self.__ismoved() or self.__getversion() != self.__version
+
+    # function: check if the db file was replaced by another (compacted by another process)
+    # return: True if the file at filename is not the one this db has open
+    def __ismoved(self) -> bool:
+        try:
+            st = os.stat(self.__filename)
+        except OSError:
+            return False
+        fst = os.fstat(self.__file.fileno())
+        return (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino)
+
+    # function: open the db file again for as long as it keeps being replaced
+    #  - the file lock is moved to the new file
+    # return: 0 on sucess, 1 on fail
+    def __reopen(self) -> int:
+        while self.__ismoved():
+            try:
+                f = open(self.__filename, "rb+")
+            except OSError:
+                ut.output("unable to reopen {}.".format(self.__filename))
+                return 1
+            if isinstance(self.__lock, processlock):
+                self.__lock.movefile(f.fileno())
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.__file.close()
+            self.__file = f
+        return 0
+
+    # function: make a rename in the directory of the db file durable
+    def __syncdir(self):
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.__filename)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # function: check if enough of the file is dead to be worth compacting
+    def __shouldcompact(self) -> bool:
+        if self.__autocompact == None:
+            return False
+        dead = self.__index.getdead()
+        if dead < MINCOMPACTROWS:
+            return False
+        return dead >= self.__autocompact * (dead + len(self.__index))
+
+    # function: compact the file whenever the dead ratio is crossed, until close
+    #  - runs on the compactor thread, rows waiting in the cache are left for the
+    #    next flush
+    def __compactloop(self, interval):
+        while not self.__stopcompactor.wait(interval):
+            with self.__lock.writing():
+                if self.isopen() and self.__iscacheempty() and self.__shouldcompact():
+                    self.compact()
+
+    # function: remember the file as this process left it
+    def __written(self):
+        self.__file.flush()
+        self.__version = self.__getversion()
+
+    # function: reload what this db knows about the file after another process changed it
+    #  - the file is opened again if it was replaced
+    #  - the header, key index and secondary indexes are reloaded, the read cache
+    #    and columns are dropped
+    #  - changes in the cache that are not flushed yet are laid back over the file
+    def __refresh(self):
+        if self.__reopen() != 0:
+            return
+        h = self.__format.readheader(self.__file)
+        if h == None:
+            ut.output("unable to reload {}. invalid header.".format(self.__filename))
+            return
+        if h[3] > self.__keygen:
+            self.__keygen = h[3]
+        self.__dataoffset = self.__file.tell()
+        if self.__pool != None:
+            self.__pool.reset(self.__file.fileno())
+        if self.__pages != None:
+            self.__pages = pagestore(self.__dataoffset, self.__pool)
+        self.__remap()
+        self.__readcache.clear()
+        self.__writes += 1
+        self.__columns = None
+
+        if self.__index.load(self.__indexfilename(), self.__getfilestamp()) != 0:
+            if self.__buildindex() != 0:
+                ut.output("unable to reload {}. failed to index the file.".format(self.__filename))
+                return
+        self.__deleted = dict()
+        for k, d in self.__cache.items():
+            if d == None:
+                pos = self.__index.get(k)
+                if self.__pages != None and pos != None:
+                    self.__deleted[k] = pos
+                self.__index.remove(k)
+            elif k not in self.__index:
+                self.__index.set(k, -1)
+        self.__numrows = len(self.__index)
+
+        # the sidecars only cover the file, with changes in the cache start over
+        if self.__iscacheempty():
+            self.__loadfieldindexes(save=False)
+        else:
+            self.__fillfieldindexes(list(self.__fieldindexes.values()))
+        self.__version = self.__getversion()
+
+    # function: save the key index and all secondary indexes, stamped with the current file
+    #  - each index only journals what changed since it was last saved
+    def __saveindexes(self):
+        stamp = self.__getfilestamp()
+        self.__index.savechanges(self.__indexfilename(), stamp)
+        if self.__pages != None:
+            self.__pages.savefsm(self.__fsmfilename(), stamp)
+        for (fieldid, kind), idx in self.__fieldindexes.items():
+            idx.savechanges(self.__fieldindexfilename(fieldid, kind), stamp)
+
+    # function: load every secondary index that has a sidecar file
+    #  - stale indexes are rebuilt together in a single pass over the file
+    # save: write the rebuilt indexes back to their sidecars
+    # return: 0 on sucess, 1 on fail
+    def __loadfieldindexes(self, save=True) -> int:
+        self.__fieldindexes = dict()
+        stamp = self.__getfilestamp()
+        stale = list()
+        for fieldid in self.__schema.fieldids:
+            for kind in FIELDINDEXES:
+                fn = self.__fieldindexfilename(fieldid, kind)
+                if not os.path.exists(fn):
+                    continue
+                idx = FIELDINDEXES[kind](fieldid)
+                if idx.load(fn, stamp) != 0:
+                    stale.append(idx)
+                self.__fieldindexes[(fieldid, kind)] = idx
+
+        if len(stale) > 0:
+            if self.__fillfieldindexes(stale) != 0:
+                return 1
+            for idx in stale:
+                if save:
+                    idx.save(self.__fieldindexfilename(idx.getfieldid(), idx.kind), stamp)
+        return 0
+
+    # function: fill secondary indexes from the live rows in file and in cache
+    # idxs: a list of index objects to fill
+    # return: 0 on sucess, 1 on fail
+    def __fillfieldindexes(self, idxs) -> int:
+        fis = [self.__schema.fieldids.index(idx.getfieldid()) for idx in idxs]
+        pairs = [list() for idx in idxs]
+
+        for row in self.iterall():
+            for p, fi in zip(pairs, fis):
+                p.append((row.key, row.data[fi]))
+
+        for idx, p in zip(idxs, pairs):
+            idx.clear()
+            idx.addmany(p)
+        return 0
+
+    # function: iterate over the rows with val in a field, without any checks
+    # fi: the index of the field in the schema
+    # return: a generator of Row objects
+    def __itermatches(self, fi, val):
+        # use a secondary index if there is one, they cover the cache as well
+        field = self.__schema.fieldids[fi]
+        idx = self.__fieldindexes.get((field, "hash"))
+        if idx == None:
+            idx = self.__fieldindexes.get((field, "range"))
+        if idx != None:
+            for k in list(idx.get(val)):
+                d = self.__getrow(k)
+                if d != None:
+                    yield Row(k, d)
+            return
+
+        # then the columns, compared all at once
+        cs = self.__getcolumns()
+        if cs != None:
+            for i in cs.match(fi, val):
+                yield Row(cs.key(i), cs.row(i))
+            return
+
+        # otherwise scan, rows found in file go in the read cache unless the file
+        # was written since the scan started (the caller may hold the generator)
+        writes = self.__writes
+        rows = self.__parallelscan((fi, val, val, True))
+        if rows == None:
+            rows = (r for r in self.__iterfilerows() if r[0].data[fi] == val)
+        for row, size in rows:
+            d = tuple(row.data)
+            if self.__writes == writes:
+                self.__readcache.put(row.key, d, size)
+            yield Row(row.key, d)
+
+        for k in list(self.__cache.keys()):
+            d = self.__cache.get(k)
+            if d != None and d[fi] == val:
+                yield Row(k, d)
+
+    # function: get the column store, building it from every live row if needed
+    # return: the columnstore, None if the db was not opened with columnar
+    def __getcolumns(self):
+        if not self.__columnar:
+            return None
+        if self.__columns == None:
+            cs = columnstore(self.__schema)
+            for row in self.iterall():
+                cs.append(row.key, row.data)
+            cs.freeze()
+            self.__columns = cs
+        return self.__columns
+
+    # function: check the where of an aggregate
+    # where: (fieldid, val) or (fieldid, lo, hi)
+    # return: (field index, lo, hi, is equality) on sucess, None on fail
+    def __parsewhere(self, where):
+        if type(where) != tuple or len(where) not in (2, 3):
+            ut.output("unable to aggregate. where must be (field, val) or (field, lo, hi).")
+            return None
+        try:
+            wfi = self.__schema.fieldids.index(where[0])
+        except ValueError:
+            ut.output("unable to aggregate. where field {} is invalid.".format(where[0]))
+            return None
+        ft = self.__schema.fieldtypes[wfi]
+
+        if len(where) == 2:
+            if type(where[1]) != ft:
+                ut.output("unable to aggregate. where field type is {} and val is {}.".format(ft, type(where[1])))
+                return None
+            return (wfi, where[1], where[1], True)
+
+        if ft not in (int, float):
+            ut.output("unable to aggregate. where field {} is not numeric.".format(where[0]))
+            return None
+        for x in where[1:]:
+            if x != None and type(x) not in (int, float):
+                ut.output("unable to aggregate. where bound {} is not a number.".format(x))
+                return None
+        return (wfi, where[1], where[2], False)
+
+    # function: get the keys of the rows matching a where from a secondary index
+    # w: a where from __parsewhere
+    # return: a collection of keys, None if no index covers the where
+    def __wherekeys(self, w):
+        wfi, lo, hi, eq = w
+        field = self.__schema.fieldids[wfi]
+        if eq:
+            for kind in FIELDINDEXES:
+                idx = self.__fieldindexes.get((field, kind))
+                if idx != None:
+                    return idx.get(lo)
+            return None
+        idx = self.__fieldindexes.get((field, "range"))
+        if idx == None:
+            return None
+        return idx.range(lo, hi)
+
+    # function: fold rows into an aggregate, one row at a time
+    # fi: the index of the field to aggregate, None for count
+    # gfi: the index of the field to group by, None for no groups
+    # rows: an iterable of Row objects
+    # return: the result, a dict of group value -> result if gfi is given
+    def __fold(self, op, fi, gfi, rows):
+        # group -> [number of rows, running value]
+        acc = dict()
+        for row in rows:
+            g = None if gfi == None else row.data[gfi]
+            y = None if fi == None else row.data[fi]
+            a = acc.get(g)
+            if a == None:
+                acc[g] = [1, y]
+                continue
+            a[0] += 1
+            if op == "sum" or op == "avg":
+                a[1] += y
+            elif op == "min":
+                if y < a[1]:
+                    a[1] = y
+            elif op == "max":
+                if y > a[1]:
+                    a[1] = y
+
+        if op == "count":
+            r = {g: a[0] for g, a in acc.items()}
+        elif op == "avg":
+            r = {g: a[1] / a[0] for g, a in acc.items()}
+        else:
+            r = {g: a[1] for g, a in acc.items()}
+
+        if gfi != None:
+            return r
+        return r.get(None, 0 if op == "count" else None)
+
+    # function: scan the file with the worker processes
+    #  - the data region is split into byte ranges on record boundaries, one per worker
+    #  - workers decode and filter their range, the rows they send back are checked
+    #    against the key index here so only live rows the cache does not override are kept
+    # where: only rows that match, see parallelscan.matchwhere
+    # return: a list of (Row, size of record) tuples in file order, None if the scan
+    #  should be done in this process (scanworkers is 1 or the file is small)
+    def __parallelscan(self, where):
+        if self.__scanworkers <= 1:
+            return None
+        end = os.fstat(self.__file.fileno()).st_size
+        if end - self.__dataoffset < parallelscan.MINBYTES:
+            return None
+
+        if self.__format.paged:
+            offsets = range(self.__dataoffset, end, PAGESIZE)
+        else:
+            # sorting every offset is only done again after the file is written
+            if self.__scanoffsets == None or self.__scanoffsets[0] != self.__writes:
+                self.__scanoffsets = (self.__writes, sorted(o for o in self.__index.offsets() if o >= 0))
+            offsets = self.__scanoffsets[1]
+        ranges = parallelscan.splitranges(offsets, self.__dataoffset, end, self.__scanworkers)
+
+        self.__file.flush()
+        fs = [self.__executor.submit(parallelscan.scanrange, self.__filename, self.__format.name,
+                                     self.__schema, start, stop, where) for start, stop in ranges]
+        r = list()
+        for f in fs:
+            for pos, size, k, d in f.result():
+                if self.__index.get(k) == pos and k not in self.__cache:
+                    r.append((Row(k, d), size))
+        return r
+
+    # function: get the data of a row from the cache, the read cache or the file
+    #  - findkey without the checks, for calls that need rows of an open db
+    # return: the data tuple associated with key, None on fail/non-existent key
+    def __getrow(self, key):
+        # check cache first
+        if key in self.__cache.keys():
+            return self.__cache[key]
+
+        # look up the row's offset in the index and read just that record
+        pos = self.__index.get(key)
+        if pos == None or pos < 0:
+            return None
+
+        # then rows that were read recently
+        d = self.__readcache.get(key)
+        if d != None:
+            return d
+
+        if self.__map != None:
+            end = self.__format.recordend(self.__map, pos)
+            rec = self.__map[pos:end] if end > 0 else None
+            self.__recorder.addread(end - pos if end > 0 else 0)
+        else:
+            rec = self.__readrecordat(pos)
+        r = None
+        if rec != None:
+            r = self.__deserializerow(rec)
+        if r == None or r.key != key:
+            ut.output("an error occured while deserailzing key {}. unable to retrive data.".format(key))
+            return None
+
+        d = tuple(r.data)
+        self.__readcache.put(key, d, len(rec))
+        return d
+
+    # function: read the rows for a collection of keys
+    #  - keys that no longer exist are skipped
+    # return: a dict of key -> data in the order of keys
+    def __findkeys(self, keys) -> dict:
+        r = dict()
+        for k in keys:
+            d = self.__getrow(k)
+            if d != None:
+                r[k] = d
+        return r
+
+    # function: move a row between values in every secondary index
+    # old: the data of the row before the change, None for a new row
+    # new: the data of the row after the change, None for a deleted row
+    def __indexrow(self, key, old, new):
+        for (fieldid, kind), idx in self.__fieldindexes.items():
+            fi = self.__schema.fieldids.index(fieldid)
+            if old != None:
+                idx.remove(key, old[fi])
+            if new != None:
+                idx.add(key, new[fi])
+
+    # function: log a new version of a row to the write-ahead log
+    # return: 0 on sucess (or no wal), 1 on fail
+    def __logput(self, key, data) -> int:
+        if self.__wal == None:
             return 0
-        
-        self.__file.seek(0)
+        rec = self.__serializerow(key, data)
+        if rec == None:
+            return 1
+        return self.__wal.append(writeaheadlog.PUT, key, rec)
+
+    # function: apply the changes in a write-ahead log to the cache
+    #  - must run before the log is attached to the db so nothing is logged twice
+    # return: 0 on sucess, 1 on fail
+    def __replaywal(self, w) -> int:
+        changes = w.replay()
+        for op, key, rec in changes:
+            if op == writeaheadlog.PUT:
+                row = self.__deserializerow(rec)
+                if row == None:
+                    ut.output("unable to replay wal. failed to deserialize key {}.".format(key))
+                    return 1
+                if key not in self.__index:
+                    self.__index.set(key, -1)
+                    self.__numrows += 1
+                    self.__indexrow(key, None, row.data)
+                else:
+                    self.__indexrow(key, self.__getrow(key), row.data)
+                self.__cache[key] = tuple(row.data)
+                self.__readcache.invalidate(key)
+                if key > self.__keygen:
+                    self.__keygen = key
+            elif op == writeaheadlog.DELETE:
+                if key in self.__index:
+                    self.removerow(key)
+
+        if len(changes) > 0:
+            ut.log(ut.INFO, "replayed {} changes from the wal.", len(changes))
+        return 0
+
+    # function: the file now holds everything in the write-ahead log, so empty it
+    #  - the db file is synced first unless the log is never synced
+    def __checkpoint(self):
+        if self.__wal == None:
+            return
+        if self.__wal.getsyncmode() != "never":
+            os.fsync(self.__file.fileno())
+        self.__wal.reset()
+
+    # function: rebuild the key index with a single pass over the records in file
+    #  - later records for a key replace earlier ones, tombstones remove the key
+    #  - a torn record at the end of the file (crash during flush) is truncated, a
+    #    text file whose last line has no newline gets one, anything else that can
+    #    not be read fails rather than drop the rows after it
+    #  - keygen is moved past any key in file in case the header was not updated
+    # return: 0 on sucess, 1 on fail
+    def __buildindex(self) -> int:
+        self.__index.clear()
+        end = self.__dataoffset
         n = 0
-        for l in self.__file:
+        for pos, rec in self.__iterrecords():
+            k = self.__format.recordkey(rec)
+            if k < 0:
+                ut.output("unable to index row at offset {}. invalid key.".format(pos))
+                return 1
+            if self.__format.istombstone(rec):
+                self.__index.remove(k)
+            else:
+                self.__index.set(k, pos)
+            if k > self.__keygen:
+                self.__keygen = k
+            end = pos + len(rec)
             n += 1
-        return n
+
+        # pages are not read as a stream of records, a partial page is just skipped
+        size = os.fstat(self.__file.fileno()).st_size
+        if self.__pages == None and size > end:
+            if self.__istorn(end):
+                ut.log(ut.WARNING, "truncating a torn record at offset {} in file.", end)
+                self.__file.truncate(end)
+                if self.__pool != None:
+                    self.__pool.invalidate(end, READSIZE)
+            else:
+                # anything else is only kept if it is a whole last record missing its end
+                rec = self.__format.finishrecord(self.__file, end)
+                if rec == None or not (self.__format.istombstone(rec) or self.__deserializerow(rec) != None):
+                    ut.output("unable to index row at offset {}. file is corrupt from there on.".format(end))
+                    return 1
+                self.__file.seek(size)
+                self.__file.write(rec[size - end:])
+                self.__file.flush()
+                if self.__pool != None:
+                    self.__pool.invalidate(end, len(rec))
+                k = self.__format.recordkey(rec)
+                if self.__format.istombstone(rec):
+                    self.__index.remove(k)
+                else:
+                    self.__index.set(k, end)
+                if k > self.__keygen:
+                    self.__keygen = k
+                n += 1
+            self.__remap()
+
+        self.__index.setdead(n - len(self.__index))
+        return 0
+
+    # function: check if what follows the last whole record in file was left by a
+    #  flush that never finished
+    #  - either the key index was last saved with the file ending at or before it,
+    #    or a write-ahead log still holds changes that were never flushed
+    # end: the offset just past the last whole record
+    def __istorn(self, end) -> bool:
+        stamp = self.__index.readstamp(self.__indexfilename())
+        if stamp != None and stamp[0] <= end:
+            return True
+        fns = glob.glob(glob.escape(self.__filename) + ".*.wal")
+        fns.append(self.__filename + ".wal")
+        for fn in fns:
+            if os.path.exists(fn) and os.path.getsize(fn) > 0:
+                return True
+        return False
 
     def __validatefile(self) -> bool:
-        n = self.__getfilenumlines()
-        if n == 0 or n < self.__NUM_METADATA_LINES:
-            ut.output("an error ocurred while finding key: {}. invalid number of lines in file.".format(key))
+        if os.fstat(self.__file.fileno()).st_size < self.__dataoffset:
+            ut.output("an error ocurred while validating the file. file is shorter than its metadata.")
             return False
 
         # TODO: check other things here as well
@@ -593,29 +1940,42 @@ class database:
         return True
 
 # function: creates a new db file
+#  - will prompt for the schema if one is not given
 #  - will prompt for file overwrite
 # filename: the name of the file to create
-# return: a database object on sucess, None on fail
-def createdb(filename) -> database:
+# schema: the schema of the new db, None to prompt for it
+# format: the on-disk format of the new db ("binary", "text" or "paged")
+# return: an open database object on sucess, None on fail
+def createdb(filename, schema=None, format="binary") -> database:
     db = database()
     f = None
 
-    # how many fields
-    a = input("schema: how many fields > ")
-    try: numfields = int(a)
-    except:
-        ut.output("{} is not a number.".format(numfields))
+    if format not in FORMATS:
+        ut.output("{} is not a valid format.".format(format))
         return None
 
-    # enter ids for all those fields
-    fieldids = list()
-    fieldtypes = list()
-    for i in range(numfields):
-        fieldid = input("field {} id >  ".format(i))
-        fieldids.append(fieldid)
+    if schema == None:
+        # how many fields
+        a = input("schema: how many fields > ")
+        try: numfields = int(a)
+        except:
+            ut.output("{} is not a number.".format(a))
+            return None
+
+        # enter ids for all those fields
+        fieldids = list()
+        fieldtypes = list()
+        for i in range(numfields):
+            fieldid = input("field {} id >  ".format(i))
+            fieldids.append(fieldid)
+
+            fieldtype = input("field {} type > ".format(i))
+            if fieldtype not in NAMETYPES:
+                ut.output("{} is not a valid type. use str, int or float.".format(fieldtype))
+                return None
+            fieldtypes.append(NAMETYPES[fieldtype])
 
-        fieldtype = input("field {} type > ".format(i))
-        fieldtypes.append(fieldtype)
+        schema = Schema(numfields, fieldids, fieldtypes)
 
     # should we overwritte?
     if os.path.exists(filename):
@@ -623,39 +1983,46 @@ def createdb(filename) -> database:
         if a != "y":
             ut.output("aborting...")
             return None
-    
+
     # open file
-    try: f = open(filename, "x")
+    try: f = open(filename, "wb")
     except:
         ut.output("an error occurred creating the db.")
-        return 1
-
-    # create db object
-    db.setschema(Schema(numfields, fieldids, fieldtypes))
-    db.file = f
+        return None
 
     # write the schema to the file
-    f.write("{}\n".format(db.getschema().numfields))
-    for fid in db.getschema().fieldids:
-        f.write("{},".format(fid))
-    f.write("\n")
-    for ftype in db.getschema().fieldtypes:
-        f.write("{},".format(ftype))
-    f.write("\n")
-    f.flush()
-
-    # dump db object to file
-    db.flush()
-    return None
+    with f:
+        FORMATS[format]().writeheader(f, schema, 0, 0)
+
+    # open the new db
+    if db.open(filename) != 0:
+        return None
+    return db
+
+# function: work out a schema from a csv or jsonl file
+#  - the fields come from the csv header or the keys of the jsonl objects
+#  - a field is int if every sampled value is an int, float if every value is a
+#    number, otherwise str
+#  - pass the result to createdb, then load the file with importfile
+# path: the name of the file to look at
+# format: "csv" or "jsonl"
+# samplerows: how many rows to sample for the field types
+# return: a Schema on sucess, None on fail
+def inferschema(path, format, samplerows=1000) -> Schema:
+    r = dataio.inferfields(path, format, samplerows)
+    if r == None:
+        return None
+    return Schema(len(r[0]), r[0], r[1])
 
 # TEST SECTION
-db = database()
-db.open("poo.db")
-m = "michael"
-t = tuple(m)
-db.addrow(t)
-r = db.findval("name", "bob")
-print(r)
-r = db.findval("name", "michael")
-print(r)
-db.close()
\ No newline at end of file
+if __name__ == "__main__":
+    db = database()
+    db.open("poo.db")
+    m = "michael"
+    t = tuple(m)
+    db.addrow(t)
+    r = db.findval("name", "bob")
+    print(r)
+    r = db.findval("name", "michael")
+    print(r)
+    db.close()
@@ -0,0 +1,161 @@
+#!/usr/local/bin/python3
+
+import csv
+import json
+
+import util as ut
+
+# formats that rows can be imported from and exported to
+#  - csv: a header row with the field ids, then one row per line
+#  - jsonl: one json object per line, keyed by field id
+IOFORMATS = ("csv", "jsonl")
+
+# column/field in an import or export file that holds the row key
+KEYFIELD = "key"
+
+# function: open a csv or jsonl file for reading and get its records
+#  - csv records are dicts built from the header row, jsonl records are the objects
+# return: a generator of (line number, dict) tuples
+def readrecords(f, format):
+    if format == "csv":
+        r = csv.DictReader(f)
+        for rec in r:
+            yield (r.line_num, rec)
+    else:
+        for n, l in enumerate(f, 1):
+            l = l.strip()
+            if l == "":
+                continue
+            try:
+                rec = json.loads(l)
+            except ValueError:
+                ut.output("unable to parse line {}. invalid json.".format(n))
+                continue
+            if type(rec) != dict:
+                ut.output("unable to parse line {}. not a json object.".format(n))
+                continue
+            yield (n, rec)
+
+# function: convert a record from an import file to a data tuple
+# schema: the schema the tuple must conform to
+# rec: a dict of field id -> value
+# return: a data tuple on sucess, None if a field is missing or has the wrong type
+def coercerecord(schema, rec) -> tuple:
+    d = list()
+    for fid, ft in zip(schema.fieldids, schema.fieldtypes):
+        if fid not in rec or rec[fid] == None:
+            return None
+        x = rec[fid]
+        try:
+            # ints from a csv file or json can be used in float fields, not the other way
+            if ft == int and type(x) == float:
+                return None
+            d.append(ft(x))
+        except (TypeError, ValueError):
+            return None
+    return tuple(d)
+
+# function: read chunks of data tuples from an import file
+#  - rows that do not fit the schema, or that check turns down, are reported and
+#    skipped
+# chunksize: most rows per chunk
+# check: a function telling if a data tuple can be stored in the db, None to
+#  take every row that fits the schema
+# return: a generator of lists of data tuples
+def readchunks(f, format, schema, chunksize, check=None):
+    chunk = list()
+    for n, rec in readrecords(f, format):
+        d = coercerecord(schema, rec)
+        if d == None:
+            ut.output("skipping line {}. does not match the schema.".format(n))
+            continue
+        if check != None and not check(d):
+            ut.output("skipping line {}. can not be stored in the db.".format(n))
+            continue
+        chunk.append(d)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = list()
+    if len(chunk) > 0:
+        yield chunk
+
+# function: write rows to an export file
+# rows: an iterable of Row objects
+# return: the number of rows written
+def writerows(f, format, schema, rows) -> int:
+    n = 0
+    if format == "csv":
+        w = csv.writer(f)
+        w.writerow([KEYFIELD] + list(schema.fieldids))
+        for row in rows:
+            w.writerow([row.key] + list(row.data))
+            n += 1
+    else:
+        for row in rows:
+            rec = {KEYFIELD: row.key}
+            rec.update(zip(schema.fieldids, row.data))
+            f.write(json.dumps(rec) + "\n")
+            n += 1
+    return n
+
+# function: work out the type of a field from a sample of its values
+#  - int if every value is an int, float if every value is a number, otherwise str
+def infertype(vals):
+    t = int
+    for x in vals:
+        if type(x) == str:
+            try:
+                int(x)
+                continue
+            except ValueError:
+                pass
+            try:
+                float(x)
+                if t == int:
+                    t = float
+                continue
+            except ValueError:
+                return str
+        elif type(x) == int:
+            continue
+        elif type(x) == float:
+            if t == int:
+                t = float
+        else:
+            return str
+    return t
+
+# function: work out the fields of an import file
+#  - the field ids come from the csv header or the keys of the jsonl objects
+#  - a "key" column/field is not a field, it is the row key
+# samplerows: how many rows to look at for the types
+# return: (fieldids, fieldtypes) on sucess, None on fail
+def inferfields(path, format, samplerows=1000):
+    if format not in IOFORMATS:
+        ut.output("unable to infer schema. {} is not a valid format.".format(format))
+        return None
+
+    fieldids = list()
+    vals = dict()
+    try:
+        with open(path, "r", newline="") as f:
+            for n, rec in readrecords(f, format):
+                for fid in rec.keys():
+                    if fid != KEYFIELD and fid not in vals:
+                        fieldids.append(fid)
+                        vals[fid] = list()
+                for fid in fieldids:
+                    if rec.get(fid) != None:
+                        vals[fid].append(rec[fid])
+                samplerows -= 1
+                if samplerows <= 0:
+                    break
+    except OSError:
+        ut.output("unable to infer schema. unable to read {}.".format(path))
+        return None
+
+    if len(fieldids) == 0:
+        ut.output("unable to infer schema. {} has no fields.".format(path))
+        return None
+
+    return (fieldids, [infertype(vals[fid]) for fid in fieldids])
@@ -0,0 +1,760 @@
+#!/usr/local/bin/python3
+
+import os
+import struct
+
+import util as ut
+from pages import PAGESIZE, SLOT, HEADER as PAGEHEADER, iterpages, packpages
+
+# python type objects allowed in a schema and their names in a text db file
+TYPENAMES = {str: "str", int: "int", float: "float"}
+NAMETYPES = {"str": str, "int": int, "float": float}
+
+# class: the original comma separated text format
+#  - 5 metadata lines: numfields, fieldids, fieldtypes, keygen, numrows
+#  - followed by one "key,field,field,..." line per row
+# a record is one line of the file including its newline
+#  - a line with only a key is a tombstone for that key
+# schema, codec: the schema the codec was last compiled for and the codec
+#
+# NOTE: keygen and numrows are written zero padded to a fixed width so they can
+#       be patched in place. files written before that are rewritten on flush
+class textformat:
+    name = "text"
+
+    # rows are appended, never rewritten in place
+    paged = False
+
+    # the biggest record the format can hold, None for no limit
+    maxrecord = None
+
+    # keygen and numrows lines
+    COUNTER = "{:020d}\n"
+    COUNTERSIZE = 21
+
+    def __init__(self):
+        self.__counteroffset = -1
+        self.__schema = None
+        self.__codec = None
+
+    # function: parse the metadata lines at the start of the file
+    #  - leaves the file positioned at the first row
+    # f: the db file handle (binary mode)
+    # return: (numfields, fieldids, fieldtypes, keygen, numrows) on sucess, None on parse failure
+    def readheader(self, f):
+        # parse numfields
+        f.seek(0, 0)
+        tmp = f.readline().decode()
+        tmp = tmp.replace("\n", "")
+
+        # try to convert to int
+        try:
+            numfields = int(tmp)
+        except:
+            ut.output("an error occured while parsing 'numfileds'. check db file.")
+            return None
+
+        # parse fieldids
+        tmp = f.readline().decode()
+        tmp = tmp.replace("\n", "")
+        tmp = tmp.split(",")
+        fieldids = list()
+        for fid in tmp:
+            if fid == "":
+                continue
+            fieldids.append(fid)
+        if len(fieldids) != numfields:
+            ut.output("unable to parse fieldids. fieldsids and numfields does not match.")
+            return None
+
+        # parse fieldtypes
+        tmp = f.readline().decode()
+        tmp = tmp.replace("\n", "")
+        tmp = tmp.split(",")
+        fieldtypes = list()
+        for t in tmp:
+            if t == "":
+                continue
+
+            # convert string to a python type object
+            if t in NAMETYPES:
+                fieldtypes.append(NAMETYPES[t])
+
+        if len(fieldtypes) != numfields:
+            ut.output("unable to parse fieldtypes. fieldtypes and numfields does not match.")
+            return None
+
+        # parse keygen
+        counteroffset = f.tell()
+        kl = f.readline()
+        tmp = kl.decode()
+        tmp = tmp.replace("\n", "")
+
+        # attempt to convert to int
+        try:
+            keygen = int(tmp)
+        except:
+            ut.output("unable to parse keygen. check db file.")
+            return None
+
+        # parse numrows
+        nl = f.readline()
+        tmp = nl.decode()
+        tmp = tmp.replace("\n", "")
+
+        # attempt to convert to int
+        try:
+            numrows = int(tmp)
+        except:
+            ut.output("unable to parse numrows. check db file.")
+            return None
+
+        # the counters can only be patched in place if they are fixed width
+        if len(kl) == self.COUNTERSIZE and len(nl) == self.COUNTERSIZE:
+            self.__counteroffset = counteroffset
+        else:
+            self.__counteroffset = -1
+
+        return (numfields, fieldids, fieldtypes, keygen, numrows)
+
+    # function: write the metadata lines at the start of the file
+    #  - leaves the file positioned at the first row
+    def writeheader(self, f, schema, keygen, numrows):
+        f.seek(0, 0)
+        f.write("{}\n".format(schema.numfields).encode())
+        f.write("".join("{},".format(fid) for fid in schema.fieldids).encode() + b"\n")
+        f.write("".join("{},".format(TYPENAMES[ft]) for ft in schema.fieldtypes).encode() + b"\n")
+        self.__counteroffset = f.tell()
+        f.write(self.COUNTER.format(keygen).encode())
+        f.write(self.COUNTER.format(numrows).encode())
+
+    # function: overwrite keygen and numrows in the header without touching the rest of the file
+    # return: 0 on sucess, 1 if the header is not fixed-size and must be rewritten
+    def writecounters(self, f, keygen, numrows) -> int:
+        if self.__counteroffset < 0:
+            return 1
+        f.seek(self.__counteroffset, 0)
+        f.write((self.COUNTER.format(keygen) + self.COUNTER.format(numrows)).encode())
+        return 0
+
+    # function: read keygen and numrows from the header as they are in file now
+    #  - positional read, the file handle is not moved
+    # return: (keygen, numrows) on sucess, None if the header is not fixed-size
+    def readcounters(self, f):
+        if self.__counteroffset < 0:
+            return None
+        f.flush()
+        b = os.pread(f.fileno(), self.COUNTERSIZE * 2, self.__counteroffset)
+        try:
+            return (int(b[:self.COUNTERSIZE]), int(b[self.COUNTERSIZE:]))
+        except ValueError:
+            return None
+
+    # function: read the generation counter from the header
+    #  - text files have no generation counter
+    # return: None
+    def readgeneration(self, f):
+        return None
+
+    # function: write the generation counter to the header
+    # return: 1, text files have no generation counter
+    def writegeneration(self, f, generation) -> int:
+        return 1
+
+    # function: read the record at the current position of the file
+    # return: the raw record, None at the end of the file (or on a torn record)
+    def readrecord(self, f) -> bytes:
+        l = f.readline()
+        if l == b"" or l[-1:] != b"\n":
+            return None
+        return l
+
+    # function: find the end of the record that starts at pos in a buffer
+    #  - lets a mapped file be scanned without reading it through a file object
+    # return: the offset just past the record, -1 if the buffer ends first
+    def recordend(self, buf, pos) -> int:
+        i = buf.find(b"\n", pos)
+        if i < 0:
+            return -1
+        return i + 1
+
+    # function: iterate over the records in file from an offset
+    # f: a file handle (binary mode) on the db file
+    # return: a generator of (offset, record) tuples, stops at the end of the file
+    #  (or at a torn record)
+    def iterrecords(self, f, start):
+        f.seek(start)
+        pos = start
+        while True:
+            rec = self.readrecord(f)
+            if rec == None:
+                return
+            yield (pos, rec)
+            pos += len(rec)
+
+    # function: iterate over the records in a buffer holding the file (a memory map)
+    # return: a generator of (offset, record) tuples
+    def iterbuffer(self, buf, start):
+        pos = start
+        while pos < len(buf):
+            end = self.recordend(buf, pos)
+            if end < 0:
+                return
+            yield (pos, buf[pos:end])
+            pos = end
+
+    # function: complete a last record that is missing its newline
+    #  - files written by hand or by older versions may not end the last line
+    # f: a file handle (binary mode) on the db file
+    # pos: the offset just past the last whole record
+    # return: the record with its newline, None if the rest of the file is not
+    #  one unterminated record
+    def finishrecord(self, f, pos) -> bytes:
+        f.seek(pos)
+        tail = f.read()
+        if b"\n" in tail or self.recordkey(tail) < 0:
+            return None
+        return tail + b"\n"
+
+    # function: lay out records to be written to file at an offset
+    # return: (the bytes to write, a list of the offset of each record)
+    def packrecords(self, recs, start):
+        offsets = list()
+        pos = start
+        for rec in recs:
+            offsets.append(pos)
+            pos += len(rec)
+        return (b"".join(recs), offsets)
+
+    # function: get the key of a raw record without decoding the rest of it
+    # return: the key on sucess, -1 on fail
+    def recordkey(self, rec) -> int:
+        try:
+            return int(rec.split(b",", 1)[0])
+        except ValueError:
+            return -1
+
+    # function: check if a raw record is a tombstone (marks its key as deleted)
+    def istombstone(self, rec) -> bool:
+        return b"," not in rec
+
+    # function: build a tombstone record for a key
+    # return: the raw record
+    def encodetombstone(self, key) -> bytes:
+        return "{}\n".format(key).encode()
+
+    # function: build the codec for a schema
+    # return: a textcodec
+    def compile(self, schema):
+        if schema is not self.__schema:
+            self.__schema = schema
+            self.__codec = textcodec(schema)
+        return self.__codec
+
+    # function: serialize a row given the key and the data
+    #  - assumes data conforms to the schema
+    #  - the codec is only built again when the schema changes, for many rows use
+    #    the codec from compile directly
+    # return: the raw record
+    def encoderow(self, schema, key, data) -> bytes:
+        return self.compile(schema).encode(key, data)
+
+    # function: parse a raw record
+    # return: (key, data) on sucess, None on fail
+    def decoderow(self, schema, rec):
+        return self.compile(schema).decode(rec)
+
+# function: check that a str can be written as utf-8
+#  - a lone surrogate (from a bad decode) can not be
+def isencodable(s) -> bool:
+    if s.isascii():
+        return True
+    try:
+        s.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
+
+# class: encodes and decodes the records of a text file for one schema
+#  - built once per schema, a row is one format call or a split plus one
+#    converter per field
+# template: a format string for a whole record
+# convs: a tuple with the type to parse each field with (str is a no-op)
+# numfields: the number of fields in a row
+# strfields: the indexes of the str fields, for check
+class textcodec:
+    def __init__(self, schema):
+        self.__template = ",".join(["{}"] * (schema.numfields + 1)) + "\n"
+        self.__convs = tuple(ft if ft == int or ft == float else str for ft in schema.fieldtypes)
+        self.__numfields = schema.numfields
+        self.__strfields = tuple(i for i, ft in enumerate(schema.fieldtypes) if ft == str)
+
+    # function: check that the values of a row can be written in the format
+    #  - fields are split on ',' and records on newlines, str values can hold neither
+    #  - assumes data conforms to the schema
+    # return: True if the row can be encoded
+    def check(self, data) -> bool:
+        for i in self.__strfields:
+            if "," in data[i] or "\n" in data[i]:
+                ut.output("unable to store \"{}\" in a text db. ',' and newlines are not allowed.".format(data[i]))
+                return False
+            if not isencodable(data[i]):
+                ut.output("unable to store {!r} in a text db. it is not valid unicode.".format(data[i]))
+                return False
+        return True
+
+    # function: serialize a row given the key and the data
+    #  - assumes data conforms to the schema
+    # return: the raw record, None on fail
+    def encode(self, key, data) -> bytes:
+        try:
+            return self.__template.format(key, *data).encode()
+        except UnicodeEncodeError:
+            ut.output("unable to serialize key {}. data is not valid unicode.".format(key))
+            return None
+
+    # function: parse a raw record
+    # return: (key, data) on sucess, None on fail
+    def decode(self, rec):
+        string = rec.decode()
+        if string[-1:] == "\n":
+            string = string[:-1]
+        ss = string.split(",")
+
+        # check schema
+        if len(ss) != self.__numfields + 1:
+            ut.log(ut.WARNING, "unable to deserialize row string \"{}\". invalid schema.", string)
+            return None
+
+        # parse key section
+        try:
+            k = int(ss[0])
+        except ValueError:
+            ut.log(ut.WARNING, "unable to parse key \"{}\". invalid format.", ss[0])
+            return None
+
+        # parse data section
+        try:
+            d = [c(x) for c, x in zip(self.__convs, ss[1:])]
+        except ValueError:
+            for c, x in zip(self.__convs, ss[1:]):
+                try:
+                    c(x)
+                except ValueError:
+                    ut.log(ut.WARNING, "unable to parse data {} as {}. invalid type.", x, TYPENAMES[c])
+                    break
+            return None
+
+        return (k, d)
+
+# class: a compact binary format
+#  - a fixed-size header, then one entry per field (type code, id length, id)
+#  - followed by one record per row
+# a record is: u32 payload length, i64 key, then each field in schema order
+#  - int: i64, float: f64, str: u32 length + utf-8 bytes
+#  - a record with only a key is a tombstone for that key
+# schema, codec: the schema the codec was last compiled for and the codec
+class binaryformat:
+    name = "binary"
+
+    # rows are appended, never rewritten in place
+    paged = False
+
+    # the biggest record the format can hold, None for no limit
+    maxrecord = None
+
+    # the first record starts on a multiple of this
+    ALIGN = 1
+
+    MAGIC = b"TDBF"
+    VERSION = 1
+
+    # magic, version, numfields, keygen, numrows, dataoffset, generation, reserved
+    #  - generation is bumped by every write so other processes can tell the file
+    #    changed (it was reserved space before, so older files read it as 0)
+    HEADER = struct.Struct("<4sHHqqqq24x")
+    COUNTERS = struct.Struct("<qq")
+    COUNTEROFFSET = 8
+    GENERATION = struct.Struct("<q")
+    GENERATIONOFFSET = 32
+    FIELD = struct.Struct("<BH")
+    LENGTH = struct.Struct("<I")
+    KEY = struct.Struct("<q")
+    INT = struct.Struct("<q")
+    FLOAT = struct.Struct("<d")
+
+    TYPECODES = {int: 1, float: 2, str: 3}
+    CODETYPES = {1: int, 2: float, 3: str}
+
+    def __init__(self):
+        self.__schema = None
+        self.__codec = None
+
+    # function: parse the header and field entries at the start of the file
+    #  - leaves the file positioned at the first row
+    # f: the db file handle (binary mode)
+    # return: (numfields, fieldids, fieldtypes, keygen, numrows) on sucess, None on parse failure
+    def readheader(self, f):
+        f.seek(0, 0)
+        h = f.read(self.HEADER.size)
+        if len(h) != self.HEADER.size:
+            ut.output("unable to parse header. file is too short.")
+            return None
+
+        magic, version, numfields, keygen, numrows, dataoffset, generation = self.HEADER.unpack(h)
+        if magic != self.MAGIC:
+            ut.output("unable to parse header. not a binary db file.")
+            return None
+        if version > self.VERSION:
+            ut.output("unable to parse header. unsupported version {}.".format(version))
+            return None
+
+        fieldids = list()
+        fieldtypes = list()
+        for i in range(numfields):
+            b = f.read(self.FIELD.size)
+            if len(b) != self.FIELD.size:
+                ut.output("unable to parse field {}. file is too short.".format(i))
+                return None
+            code, n = self.FIELD.unpack(b)
+            if code not in self.CODETYPES:
+                ut.output("unable to parse field {}. invalid type code {}.".format(i, code))
+                return None
+            fieldtypes.append(self.CODETYPES[code])
+            fieldids.append(f.read(n).decode())
+
+        f.seek(dataoffset, 0)
+        return (numfields, fieldids, fieldtypes, keygen, numrows)
+
+    # function: write the header and field entries at the start of the file
+    #  - leaves the file positioned at the first row
+    #  - the generation counter is kept if the file already has one
+    def writeheader(self, f, schema, keygen, numrows):
+        generation = self.readgeneration(f) or 0
+        fields = b""
+        for fid, ft in zip(schema.fieldids, schema.fieldtypes):
+            b = fid.encode()
+            fields += self.FIELD.pack(self.TYPECODES[ft], len(b)) + b
+
+        n = self.HEADER.size + len(fields)
+        dataoffset = -(-n // self.ALIGN) * self.ALIGN
+        f.seek(0, 0)
+        f.write(self.HEADER.pack(self.MAGIC, self.VERSION, schema.numfields, keygen, numrows, dataoffset, generation))
+        f.write(fields + bytes(dataoffset - n))
+
+    # function: overwrite keygen and numrows in the header without touching the rest of the file
+    # return: 0 on sucess
+    def writecounters(self, f, keygen, numrows) -> int:
+        f.seek(self.COUNTEROFFSET, 0)
+        f.write(self.COUNTERS.pack(keygen, numrows))
+        return 0
+
+    # function: read keygen and numrows from the header as they are in file now
+    #  - positional read, the file handle is not moved
+    # return: (keygen, numrows) on sucess, None if the header is too short
+    def readcounters(self, f):
+        f.flush()
+        b = os.pread(f.fileno(), self.COUNTERS.size, self.COUNTEROFFSET)
+        if len(b) != self.COUNTERS.size:
+            return None
+        return self.COUNTERS.unpack(b)
+
+    # function: read the generation counter from the header as it is in file now
+    #  - positional read, the file handle is not moved
+    # return: the generation, None if the header is too short (or the file is write only)
+    def readgeneration(self, f):
+        try:
+            f.flush()
+            b = os.pread(f.fileno(), self.GENERATION.size, self.GENERATIONOFFSET)
+        except OSError:
+            return None
+        if len(b) != self.GENERATION.size:
+            return None
+        return self.GENERATION.unpack(b)[0]
+
+    # function: write the generation counter to the header
+    # return: 0 on sucess
+    def writegeneration(self, f, generation) -> int:
+        f.seek(self.GENERATIONOFFSET, 0)
+        f.write(self.GENERATION.pack(generation))
+        return 0
+
+    # function: read the record at the current position of the file
+    # return: the raw record, None at the end of the file (or on a torn record)
+    def readrecord(self, f) -> bytes:
+        h = f.read(self.LENGTH.size)
+        if len(h) != self.LENGTH.size:
+            return None
+        n = self.LENGTH.unpack(h)[0]
+        p = f.read(n)
+        if len(p) != n:
+            return None
+        return h + p
+
+    # function: find the end of the record that starts at pos in a buffer
+    #  - lets a mapped file be scanned without reading it through a file object
+    # return: the offset just past the record, -1 if the buffer ends first
+    def recordend(self, buf, pos) -> int:
+        if pos + self.LENGTH.size > len(buf):
+            return -1
+        end = pos + self.LENGTH.size + self.LENGTH.unpack_from(buf, pos)[0]
+        if end > len(buf):
+            return -1
+        return end
+
+    # function: iterate over the records in file from an offset
+    # f: a file handle (binary mode) on the db file
+    # return: a generator of (offset, record) tuples, stops at the end of the file
+    #  (or at a torn record)
+    def iterrecords(self, f, start):
+        f.seek(start)
+        pos = start
+        while True:
+            rec = self.readrecord(f)
+            if rec == None:
+                return
+            yield (pos, rec)
+            pos += len(rec)
+
+    # function: iterate over the records in a buffer holding the file (a memory map)
+    # return: a generator of (offset, record) tuples
+    def iterbuffer(self, buf, start):
+        pos = start
+        while pos < len(buf):
+            end = self.recordend(buf, pos)
+            if end < 0:
+                return
+            yield (pos, buf[pos:end])
+            pos = end
+
+    # function: complete a last record that is missing its end
+    #  - a record carries its length, a short one is always torn
+    # return: None
+    def finishrecord(self, f, pos) -> bytes:
+        return None
+
+    # function: lay out records to be written to file at an offset
+    # return: (the bytes to write, a list of the offset of each record)
+    def packrecords(self, recs, start):
+        offsets = list()
+        pos = start
+        for rec in recs:
+            offsets.append(pos)
+            pos += len(rec)
+        return (b"".join(recs), offsets)
+
+    # function: get the key of a raw record without decoding the rest of it
+    # return: the key on sucess, -1 on fail
+    def recordkey(self, rec) -> int:
+        if len(rec) < self.LENGTH.size + self.KEY.size:
+            return -1
+        return self.KEY.unpack_from(rec, self.LENGTH.size)[0]
+
+    # function: check if a raw record is a tombstone (marks its key as deleted)
+    def istombstone(self, rec) -> bool:
+        return len(rec) == self.LENGTH.size + self.KEY.size
+
+    # function: build a tombstone record for a key
+    # return: the raw record
+    def encodetombstone(self, key) -> bytes:
+        return self.LENGTH.pack(self.KEY.size) + self.KEY.pack(key)
+
+    # function: build the codec for a schema
+    # return: a binarycodec
+    def compile(self, schema):
+        if schema is not self.__schema:
+            self.__schema = schema
+            self.__codec = binarycodec(schema)
+        return self.__codec
+
+    # function: serialize a row given the key and the data
+    #  - assumes data conforms to the schema
+    #  - the codec is only built again when the schema changes, for many rows use
+    #    the codec from compile directly
+    # return: the raw record, None on fail
+    def encoderow(self, schema, key, data) -> bytes:
+        return self.compile(schema).encode(key, data)
+
+    # function: parse a raw record
+    # return: (key, data) on sucess, None on fail
+    def decoderow(self, schema, rec):
+        return self.compile(schema).decode(rec)
+
+# class: encodes and decodes the records of a binary file for one schema
+#  - built once per schema. each run of int and float fields is packed with one
+#    struct, so a schema without str fields is a single pack or unpack per row
+# record: a struct for the whole record if every field is fixed width, else None
+# steps: (struct, start, end) for each run of fixed width fields, (None, i, i + 1)
+#  for each str field
+# intfields, strfields: the indexes of the int and str fields, for check
+class binarycodec:
+    LENGTH = binaryformat.LENGTH
+    KEY = binaryformat.KEY
+
+    # prefix of every record: payload length and key
+    PREFIX = "<Iq"
+    CODES = {int: "q", float: "d"}
+
+    # range of an int field (i64)
+    MININT = -(1 << 63)
+    MAXINT = (1 << 63) - 1
+
+    def __init__(self, schema):
+        self.__record = None
+        self.__steps = list()
+        self.__intfields = tuple(i for i, ft in enumerate(schema.fieldtypes) if ft == int)
+        self.__strfields = tuple(i for i, ft in enumerate(schema.fieldtypes) if ft == str)
+
+        fts = schema.fieldtypes
+        if all(ft in self.CODES for ft in fts):
+            self.__record = struct.Struct(self.PREFIX + "".join(self.CODES[ft] for ft in fts))
+            return
+
+        i = 0
+        while i < len(fts):
+            if fts[i] not in self.CODES:
+                self.__steps.append((None, i, i + 1))
+                i += 1
+                continue
+            j = i
+            while j < len(fts) and fts[j] in self.CODES:
+                j += 1
+            self.__steps.append((struct.Struct("<" + "".join(self.CODES[ft] for ft in fts[i:j])), i, j))
+            i = j
+
+    # function: check that the values of a row can be written in the format
+    #  - ints are stored in 64 bits, strs as utf-8
+    #  - assumes data conforms to the schema
+    # return: True if the row can be encoded
+    def check(self, data) -> bool:
+        for i in self.__intfields:
+            if data[i] < self.MININT or data[i] > self.MAXINT:
+                ut.output("unable to store {} in a binary db. ints must fit in 64 bits.".format(data[i]))
+                return False
+        for i in self.__strfields:
+            if not isencodable(data[i]):
+                ut.output("unable to store {!r} in a binary db. it is not valid unicode.".format(data[i]))
+                return False
+        return True
+
+    # function: serialize a row given the key and the data
+    #  - assumes data conforms to the schema
+    # return: the raw record, None on fail
+    def encode(self, key, data) -> bytes:
+        try:
+            if self.__record != None:
+                return self.__record.pack(self.__record.size - self.LENGTH.size, key, *data)
+
+            p = [self.KEY.pack(key)]
+            for s, i, j in self.__steps:
+                if s == None:
+                    b = str(data[i]).encode()
+                    p.append(self.LENGTH.pack(len(b)))
+                    p.append(b)
+                else:
+                    p.append(s.pack(*data[i:j]))
+        except struct.error:
+            ut.output("unable to serialize key {}. data does not match schema.".format(key))
+            return None
+        except UnicodeEncodeError:
+            ut.output("unable to serialize key {}. data is not valid unicode.".format(key))
+            return None
+
+        p = b"".join(p)
+        return self.LENGTH.pack(len(p)) + p
+
+    # function: parse a raw record
+    # return: (key, data) on sucess, None on fail
+    def decode(self, rec):
+        if self.__record != None:
+            if len(rec) != self.__record.size:
+                ut.log(ut.WARNING, "unable to deserialize record {}. invalid schema.", rec[:16])
+                return None
+            r = self.__record.unpack(rec)
+            return (r[1], list(r[2:]))
+
+        try:
+            k = self.KEY.unpack_from(rec, self.LENGTH.size)[0]
+            pos = self.LENGTH.size + self.KEY.size
+            d = []
+            for s, i, j in self.__steps:
+                if s == None:
+                    n = self.LENGTH.unpack_from(rec, pos)[0]
+                    pos += self.LENGTH.size
+                    d.append(rec[pos:pos + n].decode())
+                    pos += n
+                else:
+                    d.extend(s.unpack_from(rec, pos))
+                    pos += s.size
+        except (struct.error, UnicodeDecodeError):
+            ut.log(ut.WARNING, "unable to deserialize record {}. invalid format.", rec[:16])
+            return None
+
+        if pos != len(rec):
+            ut.log(ut.WARNING, "unable to deserialize key {}. invalid schema.", k)
+            return None
+
+        return (k, d)
+
+# class: the binary format stored in fixed-size slotted pages (see pages.py)
+#  - the same header (with its own magic) padded to a whole page, then pages
+#  - records are binary records, each lives in a slot of a page. a change to a
+#    row rewrites the one page it is in, deleted rows free their slot and the
+#    space is reused by later rows, so there are no tombstones in file
+#  - a record must fit in a page
+class pagedformat(binaryformat):
+    name = "paged"
+
+    MAGIC = b"TDBP"
+
+    # rows are written into pages in place
+    paged = True
+
+    maxrecord = PAGESIZE - PAGEHEADER.size - SLOT.size
+
+    ALIGN = PAGESIZE
+
+    # pages read at once while scanning
+    SCANPAGES = 64
+
+    # function: iterate over the records in file from an offset
+    # f: a file handle (binary mode) on the db file
+    # start: the offset of the first page
+    # return: a generator of (offset, record) tuples, a partial page at the end of
+    #  the file (torn write) is skipped
+    def iterrecords(self, f, start):
+        f.seek(start)
+        pos = start
+        while True:
+            b = f.read(PAGESIZE * self.SCANPAGES)
+            yield from iterpages(b, pos)
+            if len(b) < PAGESIZE * self.SCANPAGES:
+                return
+            pos += len(b)
+
+    # function: iterate over the records in a buffer holding the file (a memory map)
+    # return: a generator of (offset, record) tuples
+    def iterbuffer(self, buf, start):
+        n = PAGESIZE * self.SCANPAGES
+        for pos in range(start, len(buf), n):
+            yield from iterpages(buf[pos:pos + n], pos)
+
+    # function: lay out records in new pages to be written to file at an offset
+    # return: (the bytes to write, a list of the offset of each record), None if a
+    #  record is too big for a page
+    def packrecords(self, recs, start):
+        return packpages(recs, start)
+
+FORMATS = {"text": textformat, "binary": binaryformat, "paged": pagedformat}
+
+# function: work out which format a db file is in
+# f: the db file handle (binary mode)
+# return: a format object for the file
+def detectformat(f):
+    f.seek(0, 0)
+    magic = f.read(len(binaryformat.MAGIC))
+    if magic == binaryformat.MAGIC:
+        return binaryformat()
+    if magic == pagedformat.MAGIC:
+        return pagedformat()
+    return textformat()
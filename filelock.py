@@ -0,0 +1,114 @@
+#!/usr/local/bin/python3
+
+import fcntl
+import threading
+from contextlib import contextmanager
+
+# class: an advisory flock on a db file shared by every thread of a process
+#  - flock belongs to the open file, not the thread, so holds are counted here
+#    and the os lock is only taken by the first holder and dropped by the last
+#  - shared while only readers hold it, exclusive while a writer does
+# fd: the file descriptor of the db file
+# shared: how many shared holds are out
+# exclusive: how many exclusive holds are out (nested calls of one writer)
+#
+# NOTE: other processes must use the same locks for any of this to help, a
+#       process that opens the file without locking can still clobber it
+class filelock:
+    def __init__(self, fd):
+        self.__fd = fd
+        self.__mutex = threading.Lock()
+        self.__shared = 0
+        self.__exclusive = 0
+
+    def isexclusive(self) -> bool:
+        return self.__exclusive > 0
+
+    def acquireshared(self):
+        with self.__mutex:
+            if self.__shared == 0 and self.__exclusive == 0:
+                fcntl.flock(self.__fd, fcntl.LOCK_SH)
+            self.__shared += 1
+
+    def releaseshared(self):
+        with self.__mutex:
+            self.__shared -= 1
+            if self.__shared == 0 and self.__exclusive == 0:
+                fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    # return: True if this took the lock, False if this process already held it exclusive
+    def acquireexclusive(self) -> bool:
+        with self.__mutex:
+            self.__exclusive += 1
+            if self.__exclusive > 1:
+                return False
+            fcntl.flock(self.__fd, fcntl.LOCK_EX)
+            return True
+
+    def releaseexclusive(self):
+        with self.__mutex:
+            self.__exclusive -= 1
+            if self.__exclusive == 0:
+                # readers in other threads of this process may still hold it shared
+                fcntl.flock(self.__fd, fcntl.LOCK_SH if self.__shared > 0 else fcntl.LOCK_UN)
+
+    # function: move the lock to another file, holding it there as it is held now
+    #  - used when the db file is replaced by a new one (compaction)
+    # fd: the file descriptor of the new file
+    def move(self, fd):
+        with self.__mutex:
+            if self.__exclusive > 0:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            elif self.__shared > 0:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+            self.__fd = fd
+
+# class: locks a db against other threads and other processes
+#  - wraps the db's thread lock (rwlock or nolock) and a filelock
+#  - before anything reads or writes, checks whether another process changed the
+#    file and has the db reload what it knows about it
+# threadlock: the lock used between threads of this process
+# fd: the file descriptor of the db file
+# haschanged: function, True if the file changed (or was replaced) since this
+#  process last saw it
+# refresh: function, reload the header, indexes and caches from the file
+# written: function, record the file as this process left it after a change
+class processlock:
+    def __init__(self, threadlock, fd, haschanged, refresh, written):
+        self.__thread = threadlock
+        self.__file = filelock(fd)
+        self.__haschanged = haschanged
+        self.__refresh = refresh
+        self.__written = written
+
+    # function: move the file lock to the file that replaced the db file
+    def movefile(self, fd):
+        self.__file.move(fd)
+
+    @contextmanager
+    def reading(self):
+        self.__file.acquireshared()
+        try:
+            # a writer in this process already has the file as it is
+            if not self.__file.isexclusive() and self.__haschanged():
+                with self.__thread.writing():
+                    if self.__haschanged():
+                        self.__refresh()
+            with self.__thread.reading():
+                yield
+        finally:
+            self.__file.releaseshared()
+
+    @contextmanager
+    def writing(self):
+        with self.__thread.writing():
+            outer = self.__file.acquireexclusive()
+            try:
+                if outer and self.__haschanged():
+                    self.__refresh()
+                yield
+            finally:
+                if outer:
+                    self.__written()
+                self.__file.releaseexclusive()
@@ -0,0 +1,551 @@
+#!/usr/local/bin/python3
+
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+import util as ut
+
+# sidecar header: magic, size and mtime (ns) of the db file it describes
+#  - journal header: the journal magic and the size and mtime of the sidecar it follows
+SIDECAR = struct.Struct("<4sqq")
+JOURNALMAGIC = b"TDJ1"
+
+# journal batch header: payload length, (size, mtime) of the db file the batch
+# starts from, (size, mtime) of the db file after it
+BATCH = struct.Struct("<qqqqq")
+
+# a journal can grow to this, or to the size of its sidecar if that is bigger,
+# before the next save writes a whole new sidecar instead
+MINJOURNAL = 1 << 16
+
+# function: get the name of the journal of a sidecar
+def journalname(filename) -> str:
+    return filename + ".log"
+
+# function: read a sidecar and the batches in its journal
+#  - batches are used while each one starts where the last left off
+# magic: the magic of the sidecar
+# return: (sidecar payload, list of batch payloads, (size, mtime) of the db file
+#  after the last batch), None if missing or corrupt
+def readchain(filename, magic):
+    try:
+        with open(filename, "rb") as f:
+            h = f.read(SIDECAR.size)
+            payload = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError:
+        ut.output("unable to read index file {}.".format(filename))
+        return None
+    if len(h) != SIDECAR.size:
+        return None
+    m, size, mtime = SIDECAR.unpack(h)
+    if m != magic:
+        return None
+
+    # a journal left over from an older sidecar is ignored
+    cur = (size, mtime)
+    batches = list()
+    try:
+        with open(journalname(filename), "rb") as f:
+            j = f.read()
+    except OSError:
+        j = b""
+    if len(j) >= SIDECAR.size and SIDECAR.unpack_from(j, 0) == (JOURNALMAGIC, size, mtime):
+        pos = SIDECAR.size
+        while pos + BATCH.size <= len(j):
+            n, bsize, bmtime, asize, amtime = BATCH.unpack_from(j, pos)
+            if (bsize, bmtime) != cur or pos + BATCH.size + n > len(j):
+                break
+            batches.append(j[pos + BATCH.size:pos + BATCH.size + n])
+            cur = (asize, amtime)
+            pos += BATCH.size + n
+
+    return (payload, batches, cur)
+
+# function: read a sidecar and the batches in its journal for a db file
+# stamp: (size, mtime) of the db file, the sidecar is stale unless it (or its last
+#  batch) matches
+# return: (sidecar payload, list of batch payloads), None if missing, stale or corrupt
+def readsidecar(filename, magic, stamp):
+    c = readchain(filename, magic)
+    if c == None or c[2] != tuple(stamp):
+        return None
+    return (c[0], c[1])
+
+# function: write a whole sidecar and start its journal over
+#  - written to a temp file first so a crash never leaves a half written sidecar
+# return: 0 on sucess, 1 on fail
+def writesidecar(filename, magic, stamp, payload) -> int:
+    tmp = filename + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(SIDECAR.pack(magic, stamp[0], stamp[1]))
+            f.write(payload)
+        os.replace(tmp, filename)
+        with open(journalname(filename), "wb") as f:
+            f.write(SIDECAR.pack(JOURNALMAGIC, stamp[0], stamp[1]))
+    except OSError:
+        ut.output("unable to write index file {}.".format(filename))
+        return 1
+    return 0
+
+# function: append a batch of changes to the journal of a sidecar
+# before: the stamp the sidecar and its journal describe so far
+# stamp: the stamp of the db file with the changes
+# return: 0 on sucess, 1 if the journal is missing, too big or can not be written
+#  (the caller writes a whole sidecar instead)
+def appendjournal(filename, before, stamp, payload) -> int:
+    jn = journalname(filename)
+    try:
+        limit = max(MINJOURNAL, os.path.getsize(filename))
+        if os.path.getsize(jn) + BATCH.size + len(payload) > limit:
+            return 1
+        with open(jn, "ab") as f:
+            f.write(BATCH.pack(len(payload), before[0], before[1], stamp[0], stamp[1]) + payload)
+    except OSError:
+        return 1
+    return 0
+
+# function: remove a sidecar and its journal
+def removesidecar(filename):
+    for fn in (filename, journalname(filename)):
+        if os.path.exists(fn):
+            os.remove(fn)
+
+# class: maps the key of every row to the byte offset of that row in the db file
+#  - lets a lookup seek straight to a row instead of scanning the file
+#  - persisted to a sidecar file next to the db file, a save only appends the
+#    keys that changed since the last one to the sidecar's journal
+# offsets: a dict of key -> byte offset
+# dead: how many records in the file are dead (old versions of rows and tombstones)
+# changes: a dict of key -> offset (-1 if removed) of the keys changed since the
+#  sidecar was loaded or saved, None if only a whole save will do
+# stamp: the stamp the sidecar was loaded or saved with, None if there is none
+#
+# NOTE: an offset of -1 means the row only lives in the db cache (not flushed yet)
+class offsetindex:
+    # sidecar payload: dead records, then flat key, offset pairs
+    #  - journal batch: dead records, then key, offset pairs with -1 for a removed key
+    __MAGIC = b"TDI3"
+
+    def __init__(self):
+        self.__offsets = dict()
+        self.__dead = 0
+        self.__changes = None
+        self.__stamp = None
+
+    def __len__(self) -> int:
+        return len(self.__offsets)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__offsets
+
+    # function: get the offset of a key
+    # return: the offset of key, None if key is not in the index
+    def get(self, key):
+        return self.__offsets.get(key)
+
+    def set(self, key, offset):
+        self.__offsets[key] = offset
+        if self.__changes != None:
+            self.__changes[key] = offset
+
+    def remove(self, key):
+        self.__offsets.pop(key, None)
+        if self.__changes != None:
+            self.__changes[key] = -1
+
+    def clear(self):
+        self.__offsets = dict()
+        self.__dead = 0
+        self.__changes = None
+
+    def keys(self):
+        return self.__offsets.keys()
+
+    def offsets(self):
+        return self.__offsets.values()
+
+    def getdead(self) -> int:
+        return self.__dead
+
+    def setdead(self, n):
+        self.__dead = n
+
+    # function: get the stamp of the db file the sidecar was last saved for, even
+    #  if the db file has changed since
+    #  - the size is where the file ended after the last flush that completed
+    # return: (size, mtime), None if there is no readable sidecar
+    def readstamp(self, filename):
+        c = readchain(filename, self.__MAGIC)
+        if c == None:
+            return None
+        return c[2]
+
+    # function: load the index from a sidecar file and replay its journal
+    # filename: the name of the sidecar file
+    # stamp: (size, mtime) of the db file, the sidecar is stale if it does not match
+    # return: 0 on sucess, 1 if the sidecar is missing, stale or corrupt
+    def load(self, filename, stamp) -> int:
+        s = readsidecar(filename, self.__MAGIC, stamp)
+        if s == None:
+            return 1
+        payload, batches = s
+
+        a = array("q")
+        try:
+            a.frombytes(payload)
+        except ValueError:
+            return 1
+        if len(a) % 2 != 1:
+            return 1
+        offsets = dict(zip(a[1::2], a[2::2]))
+        dead = a[0]
+
+        for b in batches:
+            a = array("q")
+            try:
+                a.frombytes(b)
+            except ValueError:
+                return 1
+            if len(a) % 2 != 1:
+                return 1
+            dead = a[0]
+            for k, o in zip(a[1::2], a[2::2]):
+                if o < 0:
+                    offsets.pop(k, None)
+                else:
+                    offsets[k] = o
+
+        self.__offsets = offsets
+        self.__dead = dead
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: write the whole index to a sidecar file
+    #  - rows that only live in the cache are not written
+    # filename: the name of the sidecar file
+    # stamp: (size, mtime) of the db file the index describes
+    # return: 0 on sucess, 1 on fail
+    def save(self, filename, stamp) -> int:
+        a = array("q", [self.__dead])
+        for k, o in self.__offsets.items():
+            if o < 0:
+                continue
+            a.append(k)
+            a.append(o)
+
+        if writesidecar(filename, self.__MAGIC, stamp, a.tobytes()) != 0:
+            return 1
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: save the keys changed since the last load or save
+    #  - appended to the journal, a whole save is done instead when there is no
+    #    sidecar to append to or the journal has outgrown it
+    # return: 0 on sucess, 1 on fail
+    def savechanges(self, filename, stamp) -> int:
+        if self.__changes == None or self.__stamp == None:
+            return self.save(filename, stamp)
+        if len(self.__changes) == 0 and self.__stamp == tuple(stamp):
+            return 0
+
+        # rows that only live in the cache are not in file, same as removed
+        a = array("q", [self.__dead])
+        for k, o in self.__changes.items():
+            a.append(k)
+            a.append(o)
+        if appendjournal(filename, self.__stamp, stamp, a.tobytes()) != 0:
+            return self.save(filename, stamp)
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+# type tags of values in the sidecars of secondary indexes
+VALINT = b"i"
+VALFLOAT = b"f"
+VALSTR = b"s"
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+COUNT = struct.Struct("<I")
+
+# function: encode a field value with its type tag
+def packval(val) -> bytes:
+    if type(val) == int:
+        return VALINT + INT.pack(val)
+    if type(val) == float:
+        return VALFLOAT + FLOAT.pack(val)
+    b = str(val).encode()
+    return VALSTR + COUNT.pack(len(b)) + b
+
+# function: decode a field value written by packval
+# return: (value, offset just past it)
+def unpackval(buf, pos):
+    tag = buf[pos:pos + 1]
+    pos += 1
+    if tag == VALINT:
+        return (INT.unpack_from(buf, pos)[0], pos + INT.size)
+    if tag == VALFLOAT:
+        return (FLOAT.unpack_from(buf, pos)[0], pos + FLOAT.size)
+    if tag == VALSTR:
+        n = COUNT.unpack_from(buf, pos)[0]
+        pos += COUNT.size
+        if pos + n > len(buf):
+            raise ValueError("truncated value")
+        return (buf[pos:pos + n].decode(), pos + n)
+    raise ValueError("bad value tag")
+
+# class: what hashindex and rangeindex share, a secondary index over one field
+#  persisted to a binary sidecar file next to the db file
+#  - the sidecar holds the field id and a group per value: the value, the number
+#    of keys and the keys
+#  - a save only appends the adds and removes made since the last one to the
+#    sidecar's journal
+# fieldid: the id of the indexed field
+# changes: a list of (op, key, val) made since the sidecar was loaded or saved,
+#  None if only a whole save will do
+# stamp: the stamp the sidecar was loaded or saved with, None if there is none
+class fieldindex:
+    MAGIC = b"TDX1"
+
+    # journal ops
+    ADD = b"a"
+    REMOVE = b"r"
+
+    def __init__(self, fieldid):
+        self.__fieldid = fieldid
+        self.__changes = None
+        self.__stamp = None
+
+    def getfieldid(self) -> str:
+        return self.__fieldid
+
+    # function: note an add or remove for the next save
+    def logchange(self, op, key, val):
+        if self.__changes != None:
+            self.__changes.append((op, key, val))
+
+    # function: forget the changes, the next save writes the whole index
+    def dropchanges(self):
+        self.__changes = None
+
+    # function: load the index from a sidecar file and replay its journal
+    # return: 0 on sucess, 1 if the sidecar is missing, stale or corrupt
+    def load(self, filename, stamp) -> int:
+        s = readsidecar(filename, self.MAGIC, stamp)
+        if s == None:
+            return 1
+        payload, batches = s
+
+        try:
+            fieldid, pos = unpackval(payload, 0)
+            if fieldid != self.__fieldid:
+                return 1
+            groups = list()
+            while pos < len(payload):
+                val, pos = unpackval(payload, pos)
+                n = COUNT.unpack_from(payload, pos)[0]
+                pos += COUNT.size
+                keys = array("q")
+                keys.frombytes(payload[pos:pos + n * INT.size])
+                if len(keys) != n:
+                    return 1
+                pos += n * INT.size
+                groups.append((val, keys))
+
+            ops = list()
+            for b in batches:
+                pos = 0
+                while pos < len(b):
+                    op = b[pos:pos + 1]
+                    k = INT.unpack_from(b, pos + 1)[0]
+                    val, pos = unpackval(b, pos + 1 + INT.size)
+                    ops.append((op, k, val))
+        except (struct.error, ValueError, UnicodeDecodeError):
+            return 1
+
+        self.restore(groups, ops)
+        self.__changes = list()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: write the whole index to a sidecar file
+    # return: 0 on sucess, 1 on fail
+    def save(self, filename, stamp) -> int:
+        p = [packval(self.__fieldid)]
+        for val, keys in self.groups():
+            p.append(packval(val))
+            p.append(COUNT.pack(len(keys)))
+            p.append(array("q", keys).tobytes())
+        if writesidecar(filename, self.MAGIC, stamp, b"".join(p)) != 0:
+            return 1
+        self.__changes = list()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: save the adds and removes made since the last load or save
+    #  - appended to the journal, a whole save is done instead when there is no
+    #    sidecar to append to or the journal has outgrown it
+    # return: 0 on sucess, 1 on fail
+    def savechanges(self, filename, stamp) -> int:
+        if self.__changes == None or self.__stamp == None:
+            return self.save(filename, stamp)
+        if len(self.__changes) == 0 and self.__stamp == tuple(stamp):
+            return 0
+
+        b = b"".join(op + INT.pack(k) + packval(val) for op, k, val in self.__changes)
+        if appendjournal(filename, self.__stamp, stamp, b) != 0:
+            return self.save(filename, stamp)
+        self.__changes = list()
+        self.__stamp = tuple(stamp)
+        return 0
+
+# class: a secondary index over one field, maps each value to the set of keys with it
+#  - lets findval look up matching rows instead of scanning the file
+# entries: a dict of value -> set of keys
+class hashindex(fieldindex):
+    kind = "hash"
+
+    def __init__(self, fieldid):
+        fieldindex.__init__(self, fieldid)
+        self.__entries = dict()
+
+    # function: get the keys of the rows with a value
+    # return: a set of keys (empty if no row has the value)
+    def get(self, val) -> set:
+        return self.__entries.get(val, set())
+
+    def add(self, key, val):
+        s = self.__entries.get(val)
+        if s == None:
+            s = set()
+            self.__entries[val] = s
+        s.add(key)
+        self.logchange(self.ADD, key, val)
+
+    # function: add many (key, val) pairs at once
+    def addmany(self, pairs):
+        for key, val in pairs:
+            self.add(key, val)
+
+    def remove(self, key, val):
+        s = self.__entries.get(val)
+        if s == None:
+            return
+        s.discard(key)
+        if len(s) == 0:
+            del self.__entries[val]
+        self.logchange(self.REMOVE, key, val)
+
+    def clear(self):
+        self.__entries = dict()
+        self.dropchanges()
+
+    # function: get the index as a list of (value, keys) groups for the sidecar
+    def groups(self) -> list:
+        return list(self.__entries.items())
+
+    # function: set the index from the groups and journal ops of a sidecar
+    def restore(self, groups, ops):
+        entries = {val: set(keys) for val, keys in groups}
+        for op, k, val in ops:
+            if op == self.ADD:
+                entries.setdefault(val, set()).add(k)
+            else:
+                s = entries.get(val)
+                if s != None:
+                    s.discard(k)
+                    if len(s) == 0:
+                        del entries[val]
+        self.__entries = entries
+
+# class: a sorted secondary index over a numeric field
+#  - answers range queries with two binary searches
+# vals: every indexed value in ascending order
+# keys: the key of the row each value in vals belongs to
+class rangeindex(fieldindex):
+    kind = "range"
+
+    def __init__(self, fieldid):
+        fieldindex.__init__(self, fieldid)
+        self.__vals = list()
+        self.__keys = list()
+
+    # function: get the keys of the rows with a value in [lo, hi]
+    # lo, hi: inclusive bounds, None for no bound
+    # return: a list of keys ordered by value
+    def range(self, lo, hi) -> list:
+        i = 0 if lo == None else bisect_left(self.__vals, lo)
+        j = len(self.__vals) if hi == None else bisect_right(self.__vals, hi)
+        return self.__keys[i:j]
+
+    # function: get the keys of the rows with a value
+    # return: a set of keys (empty if no row has the value)
+    def get(self, val) -> set:
+        return set(self.range(val, val))
+
+    def add(self, key, val):
+        i = bisect_right(self.__vals, val)
+        self.__vals.insert(i, val)
+        self.__keys.insert(i, key)
+        self.logchange(self.ADD, key, val)
+
+    # function: add many (key, val) pairs at once
+    #  - sorts once instead of inserting one at a time
+    def addmany(self, pairs):
+        pairs = list(pairs)
+        e = sorted(list(zip(self.__vals, self.__keys)) + [(v, k) for k, v in pairs])
+        self.__vals = [v for v, k in e]
+        self.__keys = [k for v, k in e]
+        for k, v in pairs:
+            self.logchange(self.ADD, k, v)
+
+    def remove(self, key, val):
+        i = bisect_left(self.__vals, val)
+        j = bisect_right(self.__vals, val)
+        while i < j:
+            if self.__keys[i] == key:
+                del self.__vals[i]
+                del self.__keys[i]
+                self.logchange(self.REMOVE, key, val)
+                return
+            i += 1
+
+    def clear(self):
+        self.__vals = list()
+        self.__keys = list()
+        self.dropchanges()
+
+    # function: get the index as a list of (value, keys) groups for the sidecar
+    def groups(self) -> list:
+        r = list()
+        for v, k in zip(self.__vals, self.__keys):
+            if len(r) > 0 and r[-1][0] == v:
+                r[-1][1].append(k)
+            else:
+                r.append((v, [k]))
+        return r
+
+    # function: set the index from the groups and journal ops of a sidecar
+    #  - a row has one value in the field, so the ops are applied per key
+    def restore(self, groups, ops):
+        d = dict()
+        for val, keys in groups:
+            for k in keys:
+                d[k] = val
+        for op, k, val in ops:
+            if op == self.ADD:
+                d[k] = val
+            elif d.get(k) == val:
+                del d[k]
+        e = sorted((v, k) for k, v in d.items())
+        self.__vals = [v for v, k in e]
+        self.__keys = [k for v, k in e]
+
+# index classes by kind
+FIELDINDEXES = {"hash": hashindex, "range": rangeindex}
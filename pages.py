@@ -0,0 +1,447 @@
+#!/usr/local/bin/python3
+
+import os
+import struct
+from array import array
+
+from index import readsidecar, writesidecar, appendjournal
+
+# size of a page in a paged db file
+PAGESIZE = 4096
+
+# page header: number of slots, offset of the start of the record area (0 in a
+# page that was never written, which means the area is empty)
+HEADER = struct.Struct("<HH")
+
+# slot: offset and length of a record in the page, a length of 0 is a free slot
+SLOT = struct.Struct("<HH")
+
+# class: one fixed-size page holding records
+#  - a slot directory grows from the front of the page, records are packed
+#    against the back
+#  - a record keeps its slot while it lives, deleted records leave a free slot
+#    and a hole that is reclaimed by defragmenting the page
+# buf: the bytes of the page, a bytearray passed in (a pinned frame of a buffer
+#  pool) is changed in place, anything else is copied
+# slots: a list of [offset, length] for every slot
+# start: the offset of the lowest record in the page
+class slottedpage:
+    def __init__(self, buf=None, size=PAGESIZE):
+        self.__size = size
+        if buf == None:
+            self.__buf = bytearray(size)
+        elif type(buf) == bytearray:
+            self.__buf = buf
+        else:
+            self.__buf = bytearray(buf)
+        n, start = HEADER.unpack_from(self.__buf, 0)
+        self.__slots = [list(SLOT.unpack_from(self.__buf, HEADER.size + i * SLOT.size)) for i in range(n)]
+        self.__start = start if start != 0 else size
+
+    # function: get the live records in the page in slot order
+    # return: a list of (offset in page, record) tuples
+    def records(self) -> list:
+        return [(o, bytes(self.__buf[o:o + n])) for o, n in self.__slots if n > 0]
+
+    # function: get how many bytes could be freed up for records (holes included)
+    #  - a new record also needs a slot unless a free one can be reused
+    def free(self) -> int:
+        return self.__size - HEADER.size - SLOT.size * len(self.__slots) - sum(n for o, n in self.__slots)
+
+    # function: check if a record of a size fits in the page
+    def fits(self, n) -> bool:
+        need = n
+        if not any(s[1] == 0 for s in self.__slots):
+            need += SLOT.size
+        return self.free() >= need
+
+    # function: add a record to the page, defragmenting it if the free space is in holes
+    # return: the offset of the record in the page, -1 if it does not fit
+    def insert(self, rec) -> int:
+        n = len(rec)
+        if n == 0 or not self.fits(n):
+            return -1
+        i = next((i for i, s in enumerate(self.__slots) if s[1] == 0), len(self.__slots))
+        dirend = HEADER.size + SLOT.size * max(len(self.__slots), i + 1)
+        if self.__start - n < dirend:
+            self.defragment()
+
+        self.__start -= n
+        self.__buf[self.__start:self.__start + n] = rec
+        if i == len(self.__slots):
+            self.__slots.append([self.__start, n])
+        else:
+            self.__slots[i] = [self.__start, n]
+        return self.__start
+
+    # function: remove the record at an offset
+    # return: True on sucess, False if there is no record there
+    def delete(self, offset) -> bool:
+        for s in self.__slots:
+            if s[0] == offset and s[1] > 0:
+                s[0] = 0
+                s[1] = 0
+                break
+        else:
+            return False
+
+        # free slots at the end of the directory give their space back
+        while len(self.__slots) > 0 and self.__slots[-1][1] == 0:
+            self.__slots.pop()
+        if len(self.__slots) == 0:
+            self.__start = self.__size
+        return True
+
+    # function: overwrite the record at an offset with a new version of it
+    #  - only done if the new version is no bigger, so no other record moves
+    # return: True on sucess, False if there is no record there or the new one is bigger
+    def replace(self, offset, rec) -> bool:
+        for s in self.__slots:
+            if s[0] == offset and s[1] >= len(rec) and len(rec) > 0:
+                self.__buf[offset:offset + len(rec)] = rec
+                s[1] = len(rec)
+                return True
+        return False
+
+    # function: pack the records against the back of the page, closing the holes
+    #  - records move, their slots do not
+    def defragment(self):
+        live = [(i, bytes(self.__buf[o:o + n])) for i, (o, n) in enumerate(self.__slots) if n > 0]
+        start = self.__size
+        for i, rec in live:
+            start -= len(rec)
+            self.__buf[start:start + len(rec)] = rec
+            self.__slots[i][0] = start
+        self.__start = start
+
+    # function: write the header and slot directory into the bytes of the page
+    def pack(self):
+        HEADER.pack_into(self.__buf, 0, len(self.__slots), self.__start if self.__start < self.__size else 0)
+        for i, (o, n) in enumerate(self.__slots):
+            SLOT.pack_into(self.__buf, HEADER.size + i * SLOT.size, o, n)
+
+    # function: get the page as it should be written to file
+    def tobytes(self) -> bytes:
+        self.pack()
+        return bytes(self.__buf)
+
+# function: iterate over the live records of the pages in a buffer
+# buf: whole pages
+# base: the offset of buf[0] in file
+# return: a generator of (offset in file, record) tuples
+def iterpages(buf, base, size=PAGESIZE):
+    for p in range(0, len(buf) - size + 1, size):
+        for o, n in getslots(buf, p):
+            if n > 0:
+                yield (base + p + o, buf[p + o:p + o + n])
+
+# function: read the slot directory of a page without copying the page
+# p: the offset of the page in buf
+# return: a list of (offset in page, length) tuples
+def getslots(buf, p) -> list:
+    n = HEADER.unpack_from(buf, p)[0]
+    return list(SLOT.iter_unpack(buf[p + HEADER.size:p + HEADER.size + n * SLOT.size]))
+
+# function: lay out records in new pages
+# start: the offset in file of the first page
+# return: (the pages, a list of the offset in file of each record), None if a
+#  record is too big for a page
+def packpages(recs, start, size=PAGESIZE):
+    pages = list()
+    offsets = list()
+    page = slottedpage(size=size)
+    for rec in recs:
+        o = page.insert(rec)
+        if o < 0:
+            pages.append(page.tobytes())
+            page = slottedpage(size=size)
+            o = page.insert(rec)
+            if o < 0:
+                return None
+        offsets.append(start + len(pages) * size + o)
+    if len(page.records()) > 0:
+        pages.append(page.tobytes())
+    return (b"".join(pages), offsets)
+
+# class: how much space each page of a paged file has free
+#  - pages are kept in buckets by free space so a page with room for a record is
+#    found without looking at every page
+#  - persisted to a sidecar file next to the db file, like the key index: a save
+#    only journals the pages whose free space changed since the last one
+# free: an array of the free bytes of each page
+# buckets: a list of sets of page numbers, bucket i holds the pages with
+#  [i * BUCKET, (i + 1) * BUCKET) bytes free
+# changes: a dict of page number -> free bytes set since the map was loaded or
+#  saved, None if only a whole save will do
+# stamp: the stamp the sidecar was loaded or saved with, None if there is none
+class freespacemap:
+    BUCKET = 64
+
+    # sidecar magic, the sidecar holds the free bytes of every page
+    __MAGIC = b"TDS2"
+
+    # journal entry: page number, free bytes
+    __ENTRY = struct.Struct("<qH")
+
+    def __init__(self, size=PAGESIZE):
+        self.__size = size
+        self.__stamp = None
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self.__free)
+
+    def clear(self):
+        self.__free = array("H")
+        self.__buckets = [set() for i in range(self.__size // self.BUCKET + 1)]
+        self.__changes = None
+
+    def get(self, pageno) -> int:
+        return self.__free[pageno]
+
+    def set(self, pageno, free):
+        while len(self.__free) <= pageno:
+            self.__free.append(0)
+            self.__buckets[0].add(len(self.__free) - 1)
+        self.__buckets[self.__free[pageno] // self.BUCKET].discard(pageno)
+        self.__free[pageno] = free
+        self.__buckets[free // self.BUCKET].add(pageno)
+        if self.__changes != None:
+            self.__changes[pageno] = free
+
+    # function: find a page with at least some bytes free
+    # return: the page number, -1 if no page has room
+    def find(self, need) -> int:
+        for b in range(-(-need // self.BUCKET), len(self.__buckets)):
+            if len(self.__buckets[b]) > 0:
+                return next(iter(self.__buckets[b]))
+        return -1
+
+    # function: load the map from a sidecar file and replay its journal
+    # stamp: (size, mtime) of the db file, the sidecar is stale if it does not match
+    # return: 0 on sucess, 1 if the sidecar is missing, stale or corrupt
+    def load(self, filename, stamp) -> int:
+        sc = readsidecar(filename, self.__MAGIC, stamp)
+        if sc == None:
+            return 1
+        payload, batches = sc
+        a = array("H")
+        try:
+            a.frombytes(payload)
+        except ValueError:
+            return 1
+        for b in batches:
+            if len(b) % self.__ENTRY.size != 0:
+                return 1
+
+        self.clear()
+        for i, free in enumerate(a):
+            self.set(i, free)
+        for b in batches:
+            for pageno, free in self.__ENTRY.iter_unpack(b):
+                self.set(pageno, free)
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: write the whole map to a sidecar file
+    # return: 0 on sucess, 1 on fail
+    def save(self, filename, stamp) -> int:
+        if writesidecar(filename, self.__MAGIC, stamp, self.__free.tobytes()) != 0:
+            return 1
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+    # function: save the pages whose free space changed since the last load or save
+    #  - appended to the journal, a whole save is done instead when there is no
+    #    sidecar to append to or the journal has outgrown it
+    # return: 0 on sucess, 1 on fail
+    def savechanges(self, filename, stamp) -> int:
+        if self.__changes == None or self.__stamp == None:
+            return self.save(filename, stamp)
+        if len(self.__changes) == 0 and self.__stamp == tuple(stamp):
+            return 0
+
+        b = b"".join(self.__ENTRY.pack(p, free) for p, free in sorted(self.__changes.items()))
+        if appendjournal(filename, self.__stamp, stamp, b) != 0:
+            return self.save(filename, stamp)
+        self.__changes = dict()
+        self.__stamp = tuple(stamp)
+        return 0
+
+# class: writes changed rows into the pages of a paged db file
+#  - a deleted row frees its slot, a modified row is rewritten in its page if it
+#    still fits there, new rows (and rows that outgrew their page) go in the first
+#    page the free space map finds room in, or in new pages at the end of the file
+#  - each page that is touched is read and written once per batch
+# dataoffset: the offset of the first page
+# pool: a bufferpool the pages are read and written through, None to use the file
+# pinframes: pages are one block of the pool each, so a page is changed right in
+#  its frame (pinned while the batch is written) instead of in a copy
+# fsm: the freespacemap, None until the first write needs it
+class pagestore:
+    # pages read at once when building the free space map
+    SCANPAGES = 256
+
+    def __init__(self, dataoffset, pool=None, size=PAGESIZE):
+        self.__dataoffset = dataoffset
+        self.__pool = pool
+        self.__size = size
+        self.__pinframes = pool != None and pool.getblocksize() == size and dataoffset % size == 0
+        self.__fsm = None
+
+    # function: save the changes to the free space map if it is loaded
+    def savefsm(self, filename, stamp):
+        if self.__fsm != None:
+            self.__fsm.savechanges(filename, stamp)
+
+    # function: load the free space map, or build it by reading every page
+    # return: the freespacemap
+    def getfsm(self, f, filename, stamp) -> freespacemap:
+        if self.__fsm != None:
+            return self.__fsm
+        fsm = freespacemap(self.__size)
+        if fsm.load(filename, stamp) != 0:
+            fsm.clear()
+            fd = f.fileno()
+            pos = self.__dataoffset
+            pageno = 0
+            while True:
+                b = os.pread(fd, self.__size * self.SCANPAGES, pos)
+                n = len(b) // self.__size
+                for i in range(n):
+                    slots = getslots(b, i * self.__size)
+                    fsm.set(pageno, self.__size - HEADER.size - SLOT.size * len(slots) - sum(m for o, m in slots))
+                    pageno += 1
+                pos += n * self.__size
+                if len(b) < self.__size * self.SCANPAGES:
+                    break
+        self.__fsm = fsm
+        return fsm
+
+    # function: write a batch of changed rows to their pages
+    # f: the db file handle
+    # nd: a list of (key, record) tuples, a tombstone record deletes the row
+    # index: the offsetindex, pointed at where each row lands (and kept right for
+    #  rows that move within a page)
+    # deleted: a dict of key -> offset of the rows deleted since the last write,
+    #  entries are used up by the tombstones in nd
+    # fmt: the file format, for the keys of records
+    # fsmfile, stamp: the sidecar of the free space map and the stamp of the file
+    # return: the number of bytes written, -1 if a record is too big for a page
+    def write(self, f, nd, index, deleted, fmt, fsmfile, stamp) -> int:
+        if any(len(rec) + SLOT.size > self.__size - HEADER.size for k, rec in nd):
+            return -1
+
+        f.flush()
+        fsm = self.getfsm(f, fsmfile, stamp)
+        pinned = list()
+        try:
+            n = self.__writepages(f.fileno(), nd, index, deleted, fmt, fsm, pinned)
+        except BaseException:
+            # a page left half changed in its frame must not be read again
+            for pageno in pinned:
+                self.__pool.invalidate(self.__pageoffset(pageno), self.__size)
+            raise
+
+        # only the pages dirtied here are written back
+        for pageno in pinned:
+            self.__pool.unpin(self.__pageoffset(pageno) // self.__size, dirty=True)
+        if self.__pool != None:
+            self.__pool.flush()
+        return n
+
+    # function: change the pages of a batch of rows, see write
+    # pinned: filled with the pages changed in their pinned frames
+    # return: the number of bytes written
+    def __writepages(self, fd, nd, index, deleted, fmt, fsm, pinned) -> int:
+        pages = dict()
+
+        def load(pageno):
+            p = pages.get(pageno)
+            if p != None:
+                return p
+            base = self.__pageoffset(pageno)
+            buf = None
+            if self.__pinframes:
+                buf = self.__pool.pin(base // self.__size)
+                if buf != None:
+                    pinned.append(pageno)
+            if buf == None:
+                # no frame to spare, change a copy of the page
+                if self.__pool != None:
+                    b = self.__pool.read(base, self.__size)
+                else:
+                    b = os.pread(fd, self.__size, base)
+                buf = b + bytes(self.__size - len(b))
+            p = slottedpage(buf, self.__size)
+            pages[pageno] = p
+            return p
+
+        # deletes and rows rewritten where they are. nothing moves within a page
+        # until every offset taken from the index and deleted has been used
+        moved = list()
+        for k, rec in nd:
+            if fmt.istombstone(rec):
+                pos = deleted.pop(k, None)
+                if pos != None:
+                    pageno, o = self.__locate(pos)
+                    p = load(pageno)
+                    p.delete(o)
+                    fsm.set(pageno, p.free())
+                continue
+            pos = index.get(k)
+            if pos == None or pos < 0:
+                moved.append((k, rec))
+                continue
+            pageno, o = self.__locate(pos)
+            p = load(pageno)
+            if not p.replace(o, rec):
+                p.delete(o)
+                moved.append((k, rec))
+            fsm.set(pageno, p.free())
+
+        # new rows (and rows that outgrew their page) go where there is room
+        inserted = set()
+        for k, rec in moved:
+            pageno = fsm.find(len(rec) + SLOT.size)
+            if pageno < 0:
+                pageno = len(fsm)
+            p = load(pageno)
+            index.set(k, self.__pageoffset(pageno) + p.insert(rec))
+            fsm.set(pageno, p.free())
+            inserted.add(pageno)
+
+        # rows can move when an insert defragments a page, the index and the
+        # pending deletes follow them
+        n = 0
+        for pageno in sorted(pages.keys()):
+            p = pages[pageno]
+            base = self.__pageoffset(pageno)
+            if pageno in inserted:
+                for o, rec in p.records():
+                    k = fmt.recordkey(rec)
+                    pos = index.get(k)
+                    if pos != None and base <= pos < base + self.__size:
+                        index.set(k, base + o)
+                    pos = deleted.get(k)
+                    if pos != None and base <= pos < base + self.__size:
+                        deleted[k] = base + o
+            if pageno in pinned:
+                p.pack()
+            elif self.__pool != None:
+                self.__pool.write(base, p.tobytes())
+            else:
+                os.pwrite(fd, p.tobytes(), base)
+            n += self.__size
+        return n
+
+    # return: the offset in file of a page
+    def __pageoffset(self, pageno) -> int:
+        return self.__dataoffset + pageno * self.__size
+
+    # return: (page number, offset in page) of an offset in file
+    def __locate(self, pos):
+        pageno = (pos - self.__dataoffset) // self.__size
+        return (pageno, pos - self.__pageoffset(pageno))
@@ -0,0 +1,98 @@
+#!/usr/local/bin/python3
+
+from bisect import bisect_left
+
+from fileformat import FORMATS
+
+# how much of a range a worker reads at a time
+CHUNKSIZE = 1 << 22
+
+# data regions smaller than this are scanned in the calling process
+MINBYTES = 1 << 20
+
+# function: split the data region of a db file into byte ranges for workers
+#  - every range starts and ends on a record boundary
+# offsets: sorted offsets of records in file (the live offsets from the key index),
+#  or of the pages of a paged file
+# start, end: the data region of the file
+# n: how many ranges to make (fewer if there are not enough records)
+# return: a list of (start, end) tuples covering [start, end)
+def splitranges(offsets, start, end, n) -> list:
+    bounds = [start]
+    for i in range(1, n):
+        target = start + (end - start) * i // n
+        j = bisect_left(offsets, target)
+        if j < len(offsets) and offsets[j] > bounds[-1]:
+            bounds.append(offsets[j])
+    bounds.append(end)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+# function: check the data of a row against a where
+# where: (field index, lo, hi, is equality) or None to match every row
+def matchwhere(where, data) -> bool:
+    if where == None:
+        return True
+    fi, lo, hi, eq = where
+    y = data[fi]
+    if eq:
+        return y == lo
+    return (lo == None or y >= lo) and (hi == None or y <= hi)
+
+# function: decode and filter the rows in one byte range of a db file
+#  - runs in a worker process, reads the file through its own handle
+#  - does not know which records are live, the caller checks the offsets
+# formatname: the name of the file's format ("text", "binary" or "paged")
+# start, end: the range, both on record boundaries (page boundaries in a paged file)
+# where: see matchwhere
+# return: a list of (offset, record size, key, data) for the matching rows
+def scanrange(filename, formatname, schema, start, end, where) -> list:
+    fmt = FORMATS[formatname]()
+    codec = fmt.compile(schema)
+    r = list()
+    if fmt.paged:
+        return scanpages(filename, fmt, codec, start, end, where)
+    with open(filename, "rb") as f:
+        f.seek(start)
+        readpos = start
+        pos = start # offset of buf[0] in file
+        buf = b""
+        while readpos < end:
+            b = f.read(min(CHUNKSIZE, end - readpos))
+            if len(b) == 0:
+                break
+            readpos += len(b)
+            buf += b
+
+            i = 0
+            while True:
+                j = fmt.recordend(buf, i)
+                if j < 0:
+                    break
+                rec = buf[i:j]
+                if not fmt.istombstone(rec):
+                    row = codec.decode(rec)
+                    if row != None and matchwhere(where, row[1]):
+                        r.append((pos + i, j - i, row[0], row[1]))
+                i = j
+            buf = buf[i:]
+            pos += i
+    return r
+
+# function: decode and filter the rows in the pages of a byte range of a paged file
+# start, end: the range, both on page boundaries
+# return: see scanrange
+def scanpages(filename, fmt, codec, start, end, where) -> list:
+    r = list()
+    with open(filename, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            b = f.read(min(CHUNKSIZE, end - pos))
+            if len(b) == 0:
+                break
+            for i, rec in fmt.iterbuffer(b, 0):
+                row = codec.decode(rec)
+                if row != None and matchwhere(where, row[1]):
+                    r.append((pos + i, len(rec), row[0], row[1]))
+            pos += len(b)
+    return r
@@ -0,0 +1,84 @@
+#!/usr/local/bin/python3
+
+import json
+import struct
+
+# the framed protocol spoken by server.py and client.py
+# a frame is: u32 length of the rest, u64 request id, u8 code, then a json body
+#  - requests: code is the op, body is a json list of the op's arguments
+#  - responses: code is a status, body is the result (or an error message)
+#  - a response carries the id of its request, responses on a connection come
+#    back in the order the requests were sent, so requests can be pipelined
+# rows are sent as [key, [field, ...]], dicts of rows as lists of rows
+HEADER = struct.Struct("<IQB")
+
+# ops
+GET = 1       # key -> data
+ADD = 2       # data -> status of addrow
+UPDATE = 3    # key, field, val -> status of update
+DELETE = 4    # key -> status of removerow
+FIND = 5      # field, val -> rows
+RANGE = 6     # field, lo, hi -> rows
+SCAN = 7      # -> MORE frames of rows, then OK with the number of rows
+AGGREGATE = 8 # op, field, groupby, where -> result ([[group, result], ...] with groupby)
+FLUSH = 9     # -> status of flush
+
+OPS = (GET, ADD, UPDATE, DELETE, FIND, RANGE, SCAN, AGGREGATE, FLUSH)
+
+# statuses
+OK = 0
+ERROR = 1
+MORE = 2
+
+# frames bigger than this are refused
+MAXFRAME = 1 << 28
+
+# function: build a frame
+# return: the raw frame
+def encodeframe(id, code, body) -> bytes:
+    b = json.dumps(body, separators=(",", ":")).encode()
+    return HEADER.pack(HEADER.size - 4 + len(b), id, code) + b
+
+# function: split the part of a frame after the length
+# return: (id, code, body) on sucess, None if the body is not valid json
+def decodeframe(b):
+    id, code = struct.unpack_from("<QB", b)
+    try:
+        body = json.loads(b[HEADER.size - 4:])
+    except ValueError:
+        return None
+    return (id, code, body)
+
+# function: read a frame from an asyncio stream
+# return: (id, code, body), None at the end of the stream or on a bad frame
+async def readframe(reader):
+    try:
+        h = await reader.readexactly(4)
+        n = struct.unpack("<I", h)[0]
+        if n < HEADER.size - 4 or n > MAXFRAME:
+            return None
+        return decodeframe(await reader.readexactly(n))
+    except EOFError:
+        return None
+
+# function: read a frame from a binary file object (a socket's makefile("rb"))
+# return: (id, code, body), None at the end of the stream or on a bad frame
+def recvframe(f):
+    h = f.read(4)
+    if len(h) != 4:
+        return None
+    n = struct.unpack("<I", h)[0]
+    if n < HEADER.size - 4 or n > MAXFRAME:
+        return None
+    b = f.read(n)
+    if len(b) != n:
+        return None
+    return decodeframe(b)
+
+# function: turn a dict of key -> data into rows for a frame
+def encoderows(d) -> list:
+    return [[k, list(v)] for k, v in d.items()]
+
+# function: turn rows from a frame back into a dict of key -> data tuple
+def decoderows(rows) -> dict:
+    return {k: tuple(v) for k, v in rows}
@@ -0,0 +1,81 @@
+#!/usr/local/bin/python3
+
+import threading
+from collections import OrderedDict
+
+# class: a bounded least recently used cache of rows read from a db file
+#  - kept apart from the db's dirty cache, rows in here always match the file
+#  - bounded by number of rows and/or bytes (the size of each row's record in file)
+# maxrows: most rows to hold, None for no limit, 0 to disable the cache
+# maxbytes: most record bytes to hold, None for no limit
+# entries: an OrderedDict of key -> (data, size), least recently used first
+# lock: every hit reorders the entries, so readers in different threads need it
+class readcache:
+    def __init__(self, maxrows=1024, maxbytes=None):
+        self.__maxrows = maxrows
+        self.__maxbytes = maxbytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    # function: get a row from the cache
+    # return: the data of the row, None on a miss
+    def get(self, key):
+        with self.__lock:
+            e = self.__entries.get(key)
+            if e == None:
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return e[0]
+
+    # function: add a row to the cache, evicting the least recently used rows to fit
+    # size: the size of the row's record in file
+    def put(self, key, data, size):
+        if self.__maxrows == 0:
+            return
+        with self.__lock:
+            self.__drop(key)
+            self.__entries[key] = (data, size)
+            self.__bytes += size
+
+            while len(self.__entries) > 0:
+                if self.__maxrows != None and len(self.__entries) > self.__maxrows:
+                    pass
+                elif self.__maxbytes != None and self.__bytes > self.__maxbytes:
+                    pass
+                else:
+                    break
+                k, e = self.__entries.popitem(last=False)
+                self.__bytes -= e[1]
+
+    # function: drop a row from the cache (it changed or was deleted)
+    def invalidate(self, key):
+        with self.__lock:
+            self.__drop(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries = OrderedDict()
+            self.__bytes = 0
+
+    def __drop(self, key):
+        e = self.__entries.pop(key, None)
+        if e != None:
+            self.__bytes -= e[1]
+
+    # function: get the hit/miss counters and current size of the cache
+    # return: a dict with hits, misses, rows and bytes
+    def getstats(self) -> dict:
+        return {
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "rows": len(self.__entries),
+            "bytes": self.__bytes,
+        }
@@ -0,0 +1,105 @@
+#!/usr/local/bin/python3
+
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+
+# class: a readers-writer lock
+#  - any number of readers at once, or one writer
+#  - writers are preferred, new readers wait while a writer is waiting
+#  - reentrant: a thread holding the lock can take it again, and the writer can
+#    also read
+# readers: how many read holds are out (including the writer's)
+# writer: the ident of the thread holding the write lock, None if there is none
+# writes: how many times the writer holds the write lock
+# waiting: how many writers are waiting
+#
+# NOTE: a reader can not upgrade to a writer, it would wait on itself forever
+class rwlock:
+    def __init__(self):
+        self.__cond = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writer = None
+        self.__writes = 0
+        self.__waiting = 0
+        self.__local = threading.local()
+
+    def acquireread(self):
+        me = threading.get_ident()
+        depth = getattr(self.__local, "reads", 0)
+        with self.__cond:
+            # a thread that already holds the lock must not wait behind a writer
+            if self.__writer != me and depth == 0:
+                while self.__writer != None or self.__waiting > 0:
+                    self.__cond.wait()
+            self.__readers += 1
+        self.__local.reads = depth + 1
+
+    def releaseread(self):
+        with self.__cond:
+            self.__readers -= 1
+            if self.__readers == 0:
+                self.__cond.notify_all()
+        self.__local.reads -= 1
+
+    def acquirewrite(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer == me:
+                self.__writes += 1
+                return
+            self.__waiting += 1
+            while self.__writer != None or self.__readers > 0:
+                self.__cond.wait()
+            self.__waiting -= 1
+            self.__writer = me
+            self.__writes = 1
+
+    def releasewrite(self):
+        with self.__cond:
+            self.__writes -= 1
+            if self.__writes == 0:
+                self.__writer = None
+                self.__cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquireread()
+        try:
+            yield
+        finally:
+            self.releaseread()
+
+    @contextmanager
+    def writing(self):
+        self.acquirewrite()
+        try:
+            yield
+        finally:
+            self.releasewrite()
+
+# class: stands in for an rwlock when a db is only used from one thread
+class nolock:
+    __NULL = nullcontext()
+
+    def reading(self):
+        return self.__NULL
+
+    def writing(self):
+        return self.__NULL
+
+# function: decorate a method of a class with getlock() to hold the read lock
+def readlocked(f):
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.getlock().reading():
+            return f(self, *args, **kwargs)
+    return wrapper
+
+# function: decorate a method of a class with getlock() to hold the write lock
+def writelocked(f):
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.getlock().writing():
+            return f(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,155 @@
+#!/usr/local/bin/python3
+
+# serves one open db to many clients over tcp or a unix socket
+#  - usage: python3 server.py <db file> [host:port | unix socket path]
+#  - every client shares the server's caches and indexes, see protocol.py for
+#    the wire format and client.py for a client
+
+import os
+import sys
+import asyncio
+
+import util as ut
+import protocol as pr
+from asyncdb import asyncdatabase
+
+# address the server listens on if none is given
+DEFAULTADDRESS = "127.0.0.1:7411"
+
+# how many rows go in each frame of a scan
+SCANCHUNK = 1000
+
+# class: a server holding a db open for its clients
+#  - each connection is read in a loop, requests on it are answered in order so
+#    clients can pipeline, connections are served concurrently
+#  - db calls go through an asyncdatabase, so lookups from different clients are
+#    coalesced and adds from different clients share flushes
+# db: the asyncdatabase being served
+# server: the asyncio server, None when not listening
+class server:
+    def __init__(self, maxworkers=4):
+        self.__db = asyncdatabase(maxworkers)
+        self.__server = None
+
+    # function: open the db and start listening
+    # filename: the db file to serve
+    # address: "host:port" for tcp, anything else is the path of a unix socket
+    # kwargs: passed on to database.open
+    # return: 0 on sucess, 1 on fail
+    async def start(self, filename, address=DEFAULTADDRESS, **kwargs) -> int:
+        if await self.__db.open(filename, **kwargs) != 0:
+            ut.output("unable to serve {}. failed to open the db.".format(filename))
+            return 1
+
+        try:
+            host, sep, port = address.rpartition(":")
+            if sep != "" and port.isdigit():
+                self.__server = await asyncio.start_server(self.__handle, host, int(port))
+            else:
+                if os.path.exists(address):
+                    os.remove(address)
+                self.__server = await asyncio.start_unix_server(self.__handle, address)
+        except OSError:
+            ut.output("unable to serve {}. unable to listen on {}.".format(filename, address))
+            await self.__db.close()
+            return 1
+
+        ut.log(ut.INFO, "serving {} on {}.", filename, address)
+        return 0
+
+    async def serveforever(self):
+        await self.__server.serve_forever()
+
+    # function: stop listening and close the db
+    async def stop(self) -> int:
+        if self.__server != None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        return await self.__db.close()
+
+    # function: serve one connection until the client hangs up
+    async def __handle(self, reader, writer):
+        try:
+            while True:
+                f = await pr.readframe(reader)
+                if f == None:
+                    break
+                id, op, args = f
+                try:
+                    await self.__dispatch(writer, id, op, args)
+                except (TypeError, ValueError) as e:
+                    writer.write(pr.encodeframe(id, pr.ERROR, "bad request: {}".format(e)))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # function: run one request and write its response
+    async def __dispatch(self, writer, id, op, args):
+        db = self.__db
+        if type(args) != list:
+            raise ValueError("arguments must be a list")
+
+        if op == pr.GET:
+            d = await db.findkey(*args)
+            r = None if d == None else list(d)
+        elif op == pr.ADD:
+            r = await db.addrow(tuple(*args))
+        elif op == pr.UPDATE:
+            r = await db.update(*args)
+        elif op == pr.DELETE:
+            r = await db.removerow(*args)
+        elif op == pr.FIND:
+            r = await db.findval(*args)
+            r = None if r == None or type(r) != dict else pr.encoderows(r)
+        elif op == pr.RANGE:
+            r = await db.findrange(*args)
+            r = None if r == None else pr.encoderows(r)
+        elif op == pr.SCAN:
+            n = 0
+            chunk = list()
+            async for row in db.iterall(SCANCHUNK):
+                chunk.append([row.key, list(row.data)])
+                if len(chunk) >= SCANCHUNK:
+                    writer.write(pr.encodeframe(id, pr.MORE, chunk))
+                    await writer.drain()
+                    n += len(chunk)
+                    chunk = list()
+            if len(chunk) > 0:
+                writer.write(pr.encodeframe(id, pr.MORE, chunk))
+                n += len(chunk)
+            r = n
+        elif op == pr.AGGREGATE:
+            if len(args) > 3 and args[3] != None:
+                args[3] = tuple(args[3])
+            r = await db.aggregate(*args)
+            if type(r) == dict:
+                r = [[g, x] for g, x in r.items()]
+        elif op == pr.FLUSH:
+            r = await db.flush()
+        else:
+            writer.write(pr.encodeframe(id, pr.ERROR, "unknown op {}".format(op)))
+            return
+
+        writer.write(pr.encodeframe(id, pr.OK, r))
+
+async def main(filename, address):
+    s = server()
+    if await s.start(filename, address) != 0:
+        return 1
+    try:
+        await s.serveforever()
+    finally:
+        await s.stop()
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        ut.output("usage: server.py <db file> [host:port | unix socket path]")
+        sys.exit(1)
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else DEFAULTADDRESS)))
+    except KeyboardInterrupt:
+        pass
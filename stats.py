@@ -0,0 +1,126 @@
+#!/usr/local/bin/python3
+
+import time
+import functools
+
+# how many histogram buckets each op has, bucket i counts calls that took
+# [2^(i-1), 2^i) microseconds, the last bucket also counts anything slower
+BUCKETS = 32
+
+# class: counts and times the calls made on a db
+#  - every call of an instrumented method is counted and its time added to a
+#    histogram of that method, calls made by other calls are counted too
+#  - counters for bytes read and written and rows decoded are bumped by the db
+#  - a profiler hook can be set to wrap every instrumented call
+# enabled: False to skip the timing (counters are still bumped)
+# profiler: a function taking the name of a method and returning a context manager
+#  that is entered around the call, None if there is none
+# ops: a dict of method name -> [calls, total seconds, max seconds, histogram list]
+# bytesread, byteswritten: bytes of records read from and written to the db file
+# rowsdecoded: how many records were decoded into rows
+#
+# NOTE: counts are not locked, calls in different threads at the same moment
+#       can lose an update
+class statsrecorder:
+    def __init__(self):
+        self.__enabled = True
+        self.__profiler = None
+        self.reset()
+
+    def reset(self):
+        self.__ops = dict()
+        self.__bytesread = 0
+        self.__byteswritten = 0
+        self.__rowsdecoded = 0
+
+    def isenabled(self) -> bool:
+        return self.__enabled
+
+    def setenabled(self, enabled):
+        self.__enabled = enabled
+
+    def getprofiler(self):
+        return self.__profiler
+
+    def setprofiler(self, profiler):
+        self.__profiler = profiler
+
+    def addread(self, n):
+        self.__bytesread += n
+
+    def addwritten(self, n):
+        self.__byteswritten += n
+
+    def adddecoded(self, n):
+        self.__rowsdecoded += n
+
+    # function: add one call to the stats of a method
+    # seconds: how long the call took
+    def record(self, name, seconds):
+        op = self.__ops.get(name)
+        if op == None:
+            op = [0, 0.0, 0.0, [0] * BUCKETS]
+            self.__ops[name] = op
+        op[0] += 1
+        op[1] += seconds
+        if seconds > op[2]:
+            op[2] = seconds
+        op[3][min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+
+    # function: get a copy of everything recorded
+    #  - percentiles come from the histogram, so they are the upper bound of the
+    #    bucket the percentile falls in
+    # return: a dict with the counters and a dict of method name -> stats
+    def snapshot(self) -> dict:
+        ops = dict()
+        for name, (calls, total, longest, hist) in list(self.__ops.items()):
+            ops[name] = {
+                "calls": calls,
+                "seconds": total,
+                "mean": total / calls,
+                "max": longest,
+                "p50": percentile(hist, calls, 0.50),
+                "p90": percentile(hist, calls, 0.90),
+                "p99": percentile(hist, calls, 0.99),
+                "histogram": list(hist),
+            }
+        return {
+            "ops": ops,
+            "bytesread": self.__bytesread,
+            "byteswritten": self.__byteswritten,
+            "rowsdecoded": self.__rowsdecoded,
+        }
+
+# function: find a percentile in a histogram
+# return: the upper bound in seconds of the bucket holding the percentile
+def percentile(hist, calls, p) -> float:
+    target = p * calls
+    n = 0
+    for i, c in enumerate(hist):
+        n += c
+        if n >= target and c > 0:
+            return (1 << i) / 1e6
+    return (1 << (len(hist) - 1)) / 1e6
+
+# decorator: count and time calls of a db method
+#  - the db must have a getrecorder method returning its statsrecorder
+#  - goes above readlocked and writelocked, so time waiting on the lock is included
+def instrumented(f):
+    name = f.__name__
+    clock = time.perf_counter
+
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        rec = self.getrecorder()
+        if not rec.isenabled():
+            return f(self, *args, **kwargs)
+        profiler = rec.getprofiler()
+        start = clock()
+        try:
+            if profiler == None:
+                return f(self, *args, **kwargs)
+            with profiler(name):
+                return f(self, *args, **kwargs)
+        finally:
+            rec.record(name, clock() - start)
+    return wrapper
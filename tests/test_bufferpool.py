@@ -0,0 +1,68 @@
+#!/usr/local/bin/python3
+
+# tests: a db read and written through the buffer pool
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+from fileformat import binaryformat
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class bufferpooltest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.dir, "t.db")
+        d = db.createdb(self.fn, SCHEMA)
+        d.addrows([("a", i) for i in range(10)])
+        d.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def generation(self) -> int:
+        with open(self.fn, "rb") as f:
+            return binaryformat().readgeneration(f)
+
+    # the header shares the first block with the rows of a small file, an append
+    # must not write an old copy of it back
+    def test_generation(self):
+        d = db.database()
+        self.assertEqual(d.open(self.fn, poolbytes=1 << 16), 0)
+        d.findkey(1)
+        g = self.generation()
+        for i in range(3):
+            d.addrow(("b", i))
+            d.flush()
+            self.assertEqual(self.generation(), g + i + 1)
+        d.close()
+
+        d = db.database()
+        self.assertEqual(d.open(self.fn), 0)
+        self.assertEqual(d.getnumrows(), 13)
+        self.assertEqual(d.findkey(13), ("b", 2))
+        d.close()
+
+    def test_multiprocess(self):
+        a = db.database()
+        self.assertEqual(a.open(self.fn, poolbytes=1 << 16, multiprocess=True), 0)
+        b = db.database()
+        self.assertEqual(b.open(self.fn, multiprocess=True), 0)
+        a.findkey(1)
+        for i in range(3):
+            a.addrow(("b", i))
+            a.update(1, "qty", 100 + i)
+            a.flush()
+            self.assertEqual(b.findkey(11 + i), ("b", i))
+            self.assertEqual(b.findkey(1), ("a", 100 + i))
+        b.close()
+        a.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/local/bin/python3
+
+# tests: importing csv and jsonl files
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class dataiotest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # a row the file format can not store is skipped, not the whole chunk
+    def test_importskipsrows(self):
+        path = os.path.join(self.dir, "in.csv")
+        with open(path, "w") as f:
+            f.write("name,qty\n")
+            for i in range(51):
+                f.write("\"Smith, John\",{}\n".format(i) if i == 25 else "n{},{}\n".format(i, i))
+            f.write("bad,notanint\n")
+
+        d = db.createdb(os.path.join(self.dir, "t.db"), SCHEMA, "text")
+        self.assertEqual(d.importfile(path, "csv", chunksize=10), 50)
+        self.assertEqual(d.getnumrows(), 50)
+        self.assertEqual(d.findkey(26), ("n26", 26))
+        d.close()
+
+if __name__ == "__main__":
+    unittest.main()
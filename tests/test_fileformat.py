@@ -0,0 +1,39 @@
+#!/usr/local/bin/python3
+
+# tests: rows are checked against what each file format can store
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class fileformattest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unstorablevalues(self):
+        for format in ("binary", "text", "paged"):
+            with self.subTest(format=format):
+                fn = os.path.join(self.dir, format + ".db")
+                d = db.createdb(fn, SCHEMA, format)
+                self.assertEqual(d.addrow(("a", 1)), 0)
+                self.assertEqual(d.addrow(("\ud800", 1)), 1)
+                self.assertEqual(d.addrow(("b", 2 ** 70)), 1 if format != "text" else 0)
+                self.assertEqual(d.update(1, "name", "x\udfffy"), 1)
+                self.assertEqual(d.addrows([("c", 3), ("\ud800", 4)]), None)
+                self.assertEqual(d.flush(), 0)
+                self.assertEqual(d.findkey(1), ("a", 1))
+                d.close()
+
+if __name__ == "__main__":
+    unittest.main()
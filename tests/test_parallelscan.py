@@ -0,0 +1,48 @@
+#!/usr/local/bin/python3
+
+# tests: scans split across worker processes
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class parallelscantest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.dir, "t.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # the offsets the file is split on are reused between scans, they have to
+    # follow appends and compactions
+    def test_scansafterwrites(self):
+        d = db.createdb(self.fn, SCHEMA)
+        d.addrows([("n{}".format(i % 10), i) for i in range(60000)])
+        d.close()
+
+        d = db.database()
+        self.assertEqual(d.open(self.fn, scanworkers=2), 0)
+        self.assertEqual(len(d.findval("name", "n3")), 6000)
+        self.assertEqual(len(d.findval("name", "n3")), 6000)
+        d.addrows([("n3", i) for i in range(30000)])
+        self.assertEqual(len(d.findval("name", "n3")), 36000)
+        for k in range(1, 30001):
+            d.removerow(k)
+        d.flush()
+        self.assertEqual(len(d.findval("name", "n3")), 33000)
+        self.assertEqual(d.compact(), 0)
+        self.assertEqual(len(d.findval("name", "n3")), 33000)
+        self.assertEqual(d.count(), 60000)
+        d.close()
+
+if __name__ == "__main__":
+    unittest.main()
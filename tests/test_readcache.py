@@ -0,0 +1,45 @@
+#!/usr/local/bin/python3
+
+# tests: the read cache never serves a row older than the one in file
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class readcachetest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # a scan held across a flush must not cache the rows it read before it
+    def test_scanacrossflush(self):
+        for format in ("binary", "text", "paged"):
+            with self.subTest(format=format):
+                fn = os.path.join(self.dir, format + ".db")
+                d = db.createdb(fn, SCHEMA, format)
+                d.addrows([("x", i) for i in range(100)])
+                d.close()
+
+                d = db.database()
+                self.assertEqual(d.open(fn), 0)
+                it = d.iterval("name", "x")
+                next(it)
+                d.update(50, "qty", 999)
+                d.flush()
+                for row in it:
+                    pass
+                self.assertEqual(d.findkey(50), ("x", 999))
+                d.close()
+
+if __name__ == "__main__":
+    unittest.main()
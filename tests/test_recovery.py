@@ -0,0 +1,223 @@
+#!/usr/local/bin/python3
+
+# tests: getting a db back after a crash, compaction and reuse of paged slots
+#  - a crash is simulated by copying the files of a db that is still open, the
+#    copy is what would be on disk had the process died there
+#  - usage: python3 -m pytest tests
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import database as db
+
+SCHEMA = db.Schema(2, ["name", "qty"], [str, int])
+
+class recoverytest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.dir, "t.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # function: create a db with some rows in it and close it
+    def create(self, format, numrows=10):
+        d = db.createdb(self.fn, SCHEMA, format)
+        d.addrows([("n{}".format(i), i) for i in range(numrows)])
+        d.close()
+
+    # function: copy every file of the db as it is right now to another name
+    # return: the name of the copy
+    def crash(self):
+        fn = os.path.join(self.dir, "crashed.db")
+        for f in glob.glob(glob.escape(self.fn) + "*"):
+            shutil.copyfile(f, fn + f[len(self.fn):])
+        return fn
+
+    def reopen(self, fn, **kwargs):
+        d = db.database()
+        self.assertEqual(d.open(fn, **kwargs), 0)
+        return d
+
+    def test_walreplay(self):
+        for format in ("binary", "text", "paged"):
+            with self.subTest(format=format):
+                self.create(format)
+                d = self.reopen(self.fn)
+                d.addrow(("new", 100))
+                d.update(3, "qty", -3)
+                d.removerow(5)
+                fn = self.crash()
+                d.close()
+
+                c = self.reopen(fn)
+                self.assertEqual(c.getnumrows(), 10)
+                self.assertEqual(c.findkey(11), ("new", 100))
+                self.assertEqual(c.findkey(3), ("n2", -3))
+                self.assertEqual(c.findkey(5), None)
+                c.close()
+                self.tearDown()
+                self.setUp()
+
+    def test_torntail(self):
+        for format in ("binary", "text"):
+            with self.subTest(format=format):
+                self.create(format)
+                d = self.reopen(self.fn)
+                d.addrow(("new", 100))
+                fn = self.crash()
+                d.close()
+
+                # the flush got half of the row into the file before the crash
+                size = os.path.getsize(fn)
+                with open(self.fn, "rb") as f:
+                    f.seek(size)
+                    rec = f.read()
+                with open(fn, "ab") as f:
+                    f.write(rec[:len(rec) // 2])
+
+                c = self.reopen(fn)
+                self.assertEqual(c.getnumrows(), 11)
+                self.assertEqual(c.findkey(11), ("new", 100))
+                self.assertEqual(c.findkey(10), ("n9", 9))
+                c.close()
+                self.tearDown()
+                self.setUp()
+
+    def test_torntailnowal(self):
+        self.create("binary")
+        d = self.reopen(self.fn, wal=False)
+        d.addrow(("new", 100))
+        fn = self.crash()
+        d.close()
+
+        # no log to go by, the key index was saved with the file ending before the tail
+        size = os.path.getsize(fn)
+        with open(self.fn, "rb") as f:
+            f.seek(size)
+            rec = f.read()
+        with open(fn, "ab") as f:
+            f.write(rec[:len(rec) // 2])
+
+        c = self.reopen(fn, wal=False)
+        self.assertEqual(c.getnumrows(), 10)
+        self.assertEqual(os.path.getsize(fn), size)
+        c.close()
+
+    def test_unterminatedline(self):
+        self.create("text", 0)
+        with open(self.fn, "ab") as f:
+            f.write(b"1,a,1\n2,b,2")
+        for fn in glob.glob(glob.escape(self.fn) + ".*"):
+            os.remove(fn)
+
+        d = self.reopen(self.fn)
+        self.assertEqual(d.getnumrows(), 2)
+        self.assertEqual(d.findkey(2), ("b", 2))
+        d.addrow(("c", 3))
+        d.close()
+
+        d = self.reopen(self.fn)
+        self.assertEqual(d.findkey(2), ("b", 2))
+        self.assertEqual(d.findkey(3), ("c", 3))
+        d.close()
+
+    def test_corruptmiddle(self):
+        self.create("binary")
+        d = self.reopen(self.fn)
+        d.addrow(("new", 100))
+        d.close()
+
+        # a bad length prefix in the middle of the file must not drop the rows after it
+        #  - the rows n0 to n9 take 26 bytes each, the last row 27
+        with open(self.fn, "rb+") as f:
+            f.seek(-27 - 26 * 8, 2)
+            f.write(b"\xff\xff\xff\x7f")
+        for fn in glob.glob(glob.escape(self.fn) + ".*"):
+            os.remove(fn)
+        d = db.database()
+        self.assertEqual(d.open(self.fn), 2)
+
+    def test_closewithoutwal(self):
+        self.create("binary")
+        d = self.reopen(self.fn, wal=False)
+        d.addrow(("x", 1))
+        d.flush = lambda: 1
+        self.assertEqual(d.close(), 0)
+
+    # two dbs sharing the file in one process each keep their own log
+    def test_multiprocesswals(self):
+        self.create("binary")
+        a = self.reopen(self.fn, multiprocess=True)
+        b = self.reopen(self.fn, multiprocess=True)
+        a.addrow(("a", 1))
+        b.addrow(("b", 2))
+        b.flush()
+        wals = glob.glob(glob.escape(self.fn) + ".*.wal")
+        self.assertEqual(len(wals), 2)
+        self.assertEqual(sum(1 for fn in wals if os.path.getsize(fn) > 0), 1)
+        self.assertEqual(a.close(), 0)
+        self.assertEqual(b.close(), 0)
+
+        d = self.reopen(self.fn)
+        self.assertEqual(d.getnumrows(), 12)
+        self.assertEqual(d.findkey(11), ("a", 1))
+        self.assertEqual(d.findkey(12), ("b", 2))
+        d.close()
+
+    def test_compact(self):
+        for format in ("binary", "text", "paged"):
+            with self.subTest(format=format):
+                self.create(format, 100)
+                d = self.reopen(self.fn)
+                for k in range(1, 101, 2):
+                    d.removerow(k)
+                for k in range(2, 20, 2):
+                    d.update(k, "qty", -k)
+                d.removerow(100)
+                d.flush()
+                self.assertEqual(d.compact(), 0)
+                self.assertEqual(d.getnumrows(), 49)
+                self.assertEqual(d.getdeadrows(), 0)
+                self.assertEqual(d.findkey(2), ("n1", -2))
+                self.assertEqual(d.findkey(98), ("n97", 97))
+                self.assertEqual(d.findkey(99), None)
+
+                # the key of the deleted last row is not handed out again
+                d.addrow(("new", 1))
+                d.close()
+                d = self.reopen(self.fn)
+                self.assertEqual(d.findkey(101), ("new", 1))
+                self.assertEqual(d.findkey(100), None)
+                self.assertEqual(d.getnumrows(), 50)
+                d.close()
+                self.tearDown()
+                self.setUp()
+
+    def test_pagedslotreuse(self):
+        self.create("paged", 2000)
+        size = os.path.getsize(self.fn)
+        d = self.reopen(self.fn)
+        for k in range(1, 1001):
+            d.removerow(k)
+        d.flush()
+        for i in range(1000):
+            d.addrow(("n{}".format(i), i))
+        d.flush()
+        self.assertEqual(os.path.getsize(self.fn), size)
+        self.assertEqual(d.getnumrows(), 2000)
+        d.close()
+
+        d = self.reopen(self.fn)
+        self.assertEqual(d.findkey(1), None)
+        self.assertEqual(d.findkey(2001), ("n0", 0))
+        self.assertEqual(d.findkey(3000), ("n999", 999))
+        d.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 #!/usr/local/bin/python3
 
+import os
+
 # function: strips \n from given string
 # return: newline-less string on sucess, empty string on failure
 def stripnewlines(string) -> str:
@@ -8,8 +10,55 @@ def stripnewlines(string) -> str:
         return str()
     return string.replace("\n", "")
 
-def output(msg, newline=True):
+# log levels, messages below the current level are dropped
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+SILENT = 100
+
+# the level messages must be at to be printed
+loglevel = INFO
+
+# function: set the level messages must be at to be printed
+#  - SILENT drops everything
+def setlevel(level):
+    global loglevel
+    loglevel = level
+
+def getlevel() -> int:
+    return loglevel
+
+# function: check if messages at a level are printed
+#  - lets callers skip building a message that would be dropped
+def isenabled(level) -> bool:
+    return level >= loglevel
+
+# function: print a message
+# level: the level of the message, dropped if below the current level
+def output(msg, newline=True, level=ERROR):
+    if level < loglevel:
+        return
     if newline:
         print("db: {}".format(msg))
     else:
-        print("db: ", end="")
\ No newline at end of file
+        print("db: ", end="")
+
+# function: print a message, formatting it only if it is not dropped
+#  - for messages inside loops, a dropped message costs one comparison
+# msg: a format string for args
+def log(level, msg, *args):
+    if level < loglevel:
+        return
+    print("db: {}".format(msg.format(*args) if len(args) > 0 else msg))
+
+# function: check if a process is still running
+# return: True if a process with pid exists, False otherwise
+def isalive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,122 @@
+#!/usr/local/bin/python3
+
+import os
+import struct
+import zlib
+
+import util as ut
+
+# class: an append-only write-ahead log that sits next to a db file
+#  - every change to a db is logged here before it is applied to the db cache
+#  - changes are buffered and written to the log in groups (group commit)
+#  - replayed by database.open after a crash, emptied by database.flush
+# a log record is: u32 payload length, u32 crc32 of the payload, then the payload
+#  - payload: u8 op, i64 key, then the raw row record (empty for deletes)
+#
+# NOTE: replay stops at the first torn or corrupt record, anything after it was
+#       never committed
+class writeaheadlog:
+    PUT = 1
+    DELETE = 2
+
+    # when to fsync the log
+    #  - always: after every group commit
+    #  - flush: only when the db is flushed
+    #  - never: leave it to the os
+    SYNCMODES = ("always", "flush", "never")
+
+    HEADER = struct.Struct("<II")
+    OP = struct.Struct("<Bq")
+
+    # filename: the name of the log file
+    # batchsize: how many changes to buffer before a group commit
+    # sync: one of SYNCMODES
+    def __init__(self, filename, batchsize=1, sync="flush"):
+        self.__filename = filename
+        self.__file = None
+        self.__batchsize = max(1, batchsize)
+        self.__syncmode = sync
+        self.__buffer = list()
+
+    # function: open (or create) the log file
+    # return: 0 on sucess, 1 on fail
+    def open(self) -> int:
+        if self.__syncmode not in self.SYNCMODES:
+            ut.output("unable to open wal. {} is not a valid sync mode.".format(self.__syncmode))
+            return 1
+        try:
+            self.__file = open(self.__filename, "ab+")
+        except OSError:
+            ut.output("unable to open wal {}.".format(self.__filename))
+            return 1
+        return 0
+
+    # function: close the log
+    # remove: delete the log file as well (only safe once the db is flushed)
+    def close(self, remove=False):
+        if self.__file == None or self.__file.closed:
+            return
+        self.commit()
+        self.__file.close()
+        if remove:
+            try:
+                os.remove(self.__filename)
+            except FileNotFoundError:
+                pass
+
+    def getsyncmode(self) -> str:
+        return self.__syncmode
+
+    # function: log a change
+    #  - the change is buffered until batchsize changes are waiting
+    # op: PUT or DELETE
+    # rec: the raw row record for a PUT
+    # return: 0 on sucess, 1 on fail
+    def append(self, op, key, rec=b"") -> int:
+        p = self.OP.pack(op, key) + rec
+        self.__buffer.append(self.HEADER.pack(len(p), zlib.crc32(p)) + p)
+        if len(self.__buffer) >= self.__batchsize:
+            return self.commit()
+        return 0
+
+    # function: write all buffered changes to the log with a single write
+    # return: 0 on sucess, 1 on fail
+    def commit(self) -> int:
+        if len(self.__buffer) == 0:
+            return 0
+        try:
+            self.__file.write(b"".join(self.__buffer))
+            self.__file.flush()
+            if self.__syncmode == "always":
+                os.fsync(self.__file.fileno())
+        except OSError:
+            ut.output("unable to commit {} changes to wal.".format(len(self.__buffer)))
+            return 1
+        self.__buffer = list()
+        return 0
+
+    # function: read back every committed change in the log
+    # return: a list of (op, key, rec) tuples in the order they were logged
+    def replay(self) -> list:
+        r = list()
+        self.__file.seek(0)
+        while True:
+            h = self.__file.read(self.HEADER.size)
+            if len(h) != self.HEADER.size:
+                break
+            n, crc = self.HEADER.unpack(h)
+            p = self.__file.read(n)
+            if len(p) != n or zlib.crc32(p) != crc or n < self.OP.size:
+                ut.output("wal has a torn record. ignoring the rest of the log.")
+                break
+            op, key = self.OP.unpack_from(p)
+            r.append((op, key, p[self.OP.size:]))
+        return r
+
+    # function: empty the log once its changes are safely in the db file
+    def reset(self):
+        self.__buffer = list()
+        self.__file.truncate(0)
+        self.__file.flush()
+        if self.__syncmode != "never":
+            os.fsync(self.__file.fileno())